@@ -0,0 +1,103 @@
+# ----------------------------------------------------------------------------#
+# JSON API helpers.
+#
+# Resources expose a mapping of field name to getter; clients pick fields
+# with ?fields=a,b. Responses carry a strong ETag computed from the row
+# versions they are built from, so a conditional GET can be answered with
+# 304 Not Modified after a cheap version query, before any row is loaded or
+# serialized.
+# ----------------------------------------------------------------------------#
+
+import datetime
+import hashlib
+import json
+
+from flask import request, jsonify, Response
+
+
+class APIError(Exception):
+    """Turned into a JSON error response by the API error handler."""
+
+    def __init__(self, status, message):
+        super(APIError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+def attribute(name):
+    """Getter for a plain attribute, with dates and times as ISO 8601 strings."""
+    def get(obj):
+        value = getattr(obj, name)
+        if isinstance(value, (datetime.date, datetime.time)):
+            return value.isoformat()
+        return value
+    return get
+
+
+def parse_fields(value, getters):
+    """Returns the field names listed in `value` in order, all fields when it is empty."""
+    if not value:
+        return list(getters)
+    fields = list(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in getters]
+    if unknown:
+        raise APIError(400, 'Unknown fields: ' + ', '.join(unknown))
+    return fields
+
+
+def page_limit(default, maximum):
+    limit = request.args.get('limit', default, type=int)
+    if limit < 1:
+        raise APIError(400, 'limit must be positive')
+    return min(limit, maximum)
+
+
+def date_arg(name, default=None):
+    """The ISO 8601 date of query argument `name`, `default` when it is absent."""
+    value = request.args.get(name)
+    if not value:
+        if default is None:
+            raise APIError(400, '%s is required' % name)
+        return default
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise APIError(400, '%s must be a date as YYYY-MM-DD' % name)
+
+
+def int_arg(name):
+    """The integer of query argument `name`, None when it is absent."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise APIError(400, '%s must be an integer' % name)
+
+
+def serialize(obj, fields, getters):
+    return {field: getters[field](obj) for field in fields}
+
+
+def make_etag(*parts):
+    """Digest of the versions (and anything else) a representation is derived from."""
+    return hashlib.sha1(json.dumps(parts, default=str, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def conditional(etag, build):
+    """Answers 304 when the client already holds `etag`, otherwise the JSON of `build()`."""
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    # Clients may store responses but have to revalidate them
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def error_response(error):
+    response = jsonify({'error': error.message})
+    response.status_code = error.status
+    return response
@@ -3,19 +3,41 @@
 # ----------------------------------------------------------------------------#
 
 import json
-import dateutil.parser
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify
+import click
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify, abort, \
+    stream_with_context, g, has_request_context, session as cookie_session
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
-import logging
-from logging import Formatter, FileHandler
+from database import SQLAlchemy, pool_status, insert_ignoring_conflicts
 from flask_wtf import Form
 from forms import *
 from flask_migrate import Migrate
-from sqlalchemy.orm import load_only
-from sqlalchemy import func
+from itsdangerous import URLSafeSerializer, BadSignature
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.attributes import get_history
+from sqlalchemy import func, tuple_, event, or_, and_, case, literal, literal_column, select, text, exc, bindparam
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 import datetime
+import time
+import uuid
+import hashlib
+from itertools import groupby
+from functools import lru_cache
+import search
+from caching import create_cache, Cache, MemoryBackend, DiskBackend
+from availability import AvailabilityIndex
+import conflicts
+import api
+import importer
+import geo
+import exporter
+import profiler
+import metrics
+import logs
+import tasks
+import thumbnails
+from profiler import query_budget
+from formatting import DateTimeFormatter
+from clock import Clock, seconds_until_tomorrow
 
 # ----------------------------------------------------------------------------#
 # App Config.
@@ -28,7 +50,21 @@ db = SQLAlchemy(app)
 
 # TODO: connect to a local postgresql database
 migrate = Migrate(app, db)
-now = datetime.datetime.now()
+cache = create_cache(app.config)
+# Rendered detail page fragments, kept in this process and bounded by size as well
+fragments = Cache(MemoryBackend(max_entries=app.config['FRAGMENT_CACHE_MAX_ENTRIES'],
+                                max_bytes=app.config['FRAGMENT_CACHE_MAX_BYTES']),
+                  default_ttl=app.config['FRAGMENT_CACHE_TTL'])
+# Scaled venue and artist images on disk, kept until evicted
+thumbnailer = thumbnails.Thumbnailer(
+    thumbnails.create_fetcher(app.config),
+    Cache(DiskBackend(app.config['THUMBNAIL_CACHE_DIR'], max_entries=app.config['THUMBNAIL_CACHE_MAX_ENTRIES'],
+                      max_bytes=app.config['THUMBNAIL_CACHE_MAX_BYTES']), default_ttl=0),
+    app.config['THUMBNAIL_SIZES'])
+clock = Clock()
+log_pipeline = logs.init_app(app)
+metrics.init_app(app)
+profiler.init_app(app)
 
 
 # ----------------------------------------------------------------------------#
@@ -36,7 +72,45 @@ now = datetime.datetime.now()
 # ----------------------------------------------------------------------------#
 
 
-class Venue(db.Model):
+venue_genres = db.Table(
+    'venue_genres',
+    db.Column('genre_id', db.Integer, db.ForeignKey('genres.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('venue_id', db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_venue_genres_venue_id', 'venue_id')
+)
+
+artist_genres = db.Table(
+    'artist_genres',
+    db.Column('genre_id', db.Integer, db.ForeignKey('genres.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('artist_id', db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_artist_genres_artist_id', 'artist_id')
+)
+
+
+class Genre(db.Model):
+    __tablename__ = 'genres'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False, unique=True)
+
+
+class Versioned(object):
+    # Every UPDATE of the row, through the ORM or not, bumps the version; the JSON API
+    # derives its ETags from it
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1',
+                        onupdate=literal_column('version') + 1)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow,
+                           onupdate=datetime.datetime.utcnow)
+
+
+class Located(object):
+    # City centre from the gazetteer and its geohash, filled in by `flask geocode`
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    geohash = db.Column(db.String(12), nullable=True, index=True)
+
+
+class Venue(Versioned, Located, db.Model):
     __tablename__ = 'Venue'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -45,16 +119,19 @@ class Venue(db.Model):
     state = db.Column(db.String(120))
     address = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(500), nullable=True)
+    genres = db.relationship('Genre', secondary=venue_genres, order_by=Genre.name, lazy=True)
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     website = db.Column(db.String(500))
     seeking_talent = db.Column(db.Boolean, default=False, nullable=True)
     seeking_description = db.Column(db.String(), nullable=True)
+    # Maintained by the show counter hooks below
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     shows = db.relationship('Show', backref='venue_shows', cascade="all,delete", lazy=True)
 
 
-class Artist(db.Model):
+class Artist(Versioned, Located, db.Model):
     __tablename__ = 'Artist'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -62,17 +139,20 @@ class Artist(db.Model):
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
+    genres = db.relationship('Genre', secondary=artist_genres, order_by=Genre.name, lazy=True)
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     website = db.Column(db.String(500))
     seeking_venue = db.Column(db.Boolean, default=False, nullable=True)
     seeking_description = db.Column(db.String(), nullable=True)
+    # Maintained by the show counter hooks below
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     shows = db.relationship('Show', backref='artist_shows', cascade="all,delete", lazy=True)
     calender = db.relationship('ArtistCalender', backref='artist_calender', cascade="all,delete", lazy=True)
 
 
-class Show(db.Model):
+class Show(Versioned, db.Model):
     __tablename__ = 'shows'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -81,6 +161,21 @@ class Show(db.Model):
     start_time = db.Column(db.Time, nullable=True)
     start_date = db.Column(db.Date, nullable=True)
 
+    __table_args__ = (
+        # Backs the double-booking check
+        db.Index('ix_shows_venue_start', 'venue_id', 'start_date', 'start_time'),
+    )
+
+
+# The /shows feed is ordered by these keys and id: shows without a date come last and a missing
+# time counts as the start of the day, as in the double-booking check. The literals are in the
+# form SQLite stores dates and times in, so keys of shows with and without a time compare right.
+SHOW_DATE_KEY = func.coalesce(Show.start_date, literal_column("'9999-12-31'", db.Date))
+SHOW_TIME_KEY = func.coalesce(Show.start_time, literal_column("'00:00:00.000000'", db.Time))
+SHOW_FEED_ORDER = (SHOW_DATE_KEY, SHOW_TIME_KEY, Show.id)
+# Backs the keyset ordering of the /shows feed
+db.Index('ix_shows_start', *SHOW_FEED_ORDER)
+
 
 class ArtistCalender(db.Model):
     __tablename__ = 'calender'
@@ -89,6 +184,328 @@ class ArtistCalender(db.Model):
     artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
     date = db.Column(db.Date, nullable=True)
 
+    __table_args__ = (db.UniqueConstraint('artist_id', 'date', name='uq_calender_artist_date'),)
+
+
+class ShowCountsState(db.Model):
+    __tablename__ = 'show_counts_state'
+
+    # Single row holding the date the upcoming/past counters are split at
+    id = db.Column(db.Integer, primary_key=True)
+    counted_on = db.Column(db.Date, nullable=False)
+
+
+class Task(db.Model):
+    __tablename__ = 'tasks'
+
+    # Background task, see tasks.py
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    idempotency_key = db.Column(db.String(200), nullable=True, unique=True)
+    status = db.Column(db.String(10), nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    max_attempts = db.Column(db.Integer, nullable=False)
+    run_at = db.Column(db.DateTime, nullable=False)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        # Backs the workers' search for due tasks
+        db.Index('ix_tasks_status_run_at', 'status', 'run_at'),
+    )
+
+
+VENUE_SEARCH_FIELDS = ('name', 'city', 'state')
+ARTIST_SEARCH_FIELDS = ('name', 'city', 'state')
+
+
+def genres_by_name(names):
+    # Returns Genre rows for the given names, creating the missing ones
+    names = list(dict.fromkeys(name.strip() for name in names if name.strip()))
+    existing = {genre.name: genre for genre in Genre.query.filter(Genre.name.in_(names))} if names else {}
+    return [existing.get(name) or Genre(name=name) for name in names]
+
+
+# ----------------------------------------------------------------------------#
+# Change tracking.
+# ----------------------------------------------------------------------------#
+
+
+def models_changed(models, pages=(), calender=()):
+    # Called after a commit that wrote rows of the given model classes, affecting the given
+    # detail pages and calender dates
+    for model in models & {Venue, Artist}:
+        search.invalidate(model)
+    if Venue in models:
+        cache.delete(NEW_VENUES_KEY)
+    if Artist in models:
+        cache.delete(NEW_ARTISTS_KEY)
+    if models & {Show, Venue, Artist}:
+        cache.delete(SHOW_PARTITIONS_VERSION_KEY)
+    cache.delete(*[fragment_stamp_key(kind, owner_id) for kind, owner_id in pages])
+    if calender or ArtistCalender in models:
+        calender_changed(calender)
+
+
+def track_changes(session, models, pages=None):
+    # `pages` are the (kind, id) detail pages showing the changed rows; without them every
+    # detail page that could show rows of the models is taken as changed, (kind, None)
+    session.info.setdefault('changed_models', set()).update(models)
+    if pages is None:
+        pages = {(kind, None) for kind in DETAIL_KINDS} if models & {Show, Venue, Artist} else ()
+    session.info.setdefault('changed_pages', set()).update(pages)
+
+
+def track_calender(session, changes):
+    # (kind, artist_id, date) changes for the availability index, see calender_changed
+    session.info.setdefault('calender_changes', []).extend(changes)
+
+
+@event.listens_for(db.session, 'after_flush')
+def after_flush(session, flush_context):
+    track_changes(session, {type(obj) for obj in session.new | session.dirty | session.deleted},
+                  changed_detail_pages(session))
+    track_calender(session, changed_calender(session))
+
+
+def changed_calender(session):
+    changes = []
+    for obj in session.new:
+        if isinstance(obj, ArtistCalender):
+            changes.append(('add', obj.artist_id, obj.date))
+    for obj in session.deleted:
+        if isinstance(obj, ArtistCalender):
+            changes.append(('remove', obj.artist_id, obj.date))
+        elif isinstance(obj, Artist):
+            changes.append(('drop', obj.id, None))
+    if any(isinstance(obj, ArtistCalender) and session.is_modified(obj) for obj in session.dirty):
+        changes.append(('rebuild', None, None))
+    return changes
+
+
+def changed_detail_pages(session):
+    # A show is on its venue's and its artist's page. A venue's name and image are also on the
+    # pages of the artists it has shows with, and the other way round. The session still holds
+    # the flushed changes and their history at this point.
+    pages = set()
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, Show):
+            for column, kind in (('venue_id', 'venue'), ('artist_id', 'artist')):
+                pages.update((kind, int(owner_id)) for owner_id in get_history(obj, column).sum()
+                             if owner_id is not None)
+        elif isinstance(obj, (Venue, Artist)) and (obj not in session.dirty or session.is_modified(obj)):
+            kind, other, own_column, other_column = (
+                ('venue', 'artist', Show.venue_id, Show.artist_id) if isinstance(obj, Venue) else
+                ('artist', 'venue', Show.artist_id, Show.venue_id))
+            pages.add((kind, obj.id))
+            if obj in session.dirty and any(get_history(obj, name).has_changes() for name in ('name', 'image_link')):
+                rows = session.execute(select([other_column]).where(own_column == obj.id).distinct())
+                pages.update((other, owner_id) for owner_id, in rows)
+    return pages
+
+
+@event.listens_for(db.session, 'before_flush')
+def touch_versioned(session, flush_context, instances):
+    # Changes to a collection such as genres do not update the row by themselves;
+    # touching updated_at makes them bump the version too
+    for obj in session.dirty:
+        if isinstance(obj, Versioned) and session.is_modified(obj):
+            obj.updated_at = datetime.datetime.utcnow()
+
+
+@event.listens_for(db.session, 'before_flush')
+def forget_moved_locations(session, flush_context, instances):
+    # A location is only as good as the city it was geocoded from; the next geocode run
+    # locates the row again
+    for obj in session.dirty:
+        if isinstance(obj, Located) and any(get_history(obj, name).has_changes() for name in ('city', 'state')):
+            obj.latitude = obj.longitude = obj.geohash = None
+
+
+@event.listens_for(db.session, 'after_bulk_update')
+@event.listens_for(db.session, 'after_bulk_delete')
+def after_bulk_change(context):
+    track_changes(context.session, {context.mapper.class_})
+    if context.mapper.class_ is ArtistCalender:
+        track_calender(context.session, [('rebuild', None, None)])
+
+
+@event.listens_for(db.session, 'after_commit')
+def after_commit(session):
+    models = session.info.pop('changed_models', None)
+    pages = session.info.pop('changed_pages', ())
+    calender = session.info.pop('calender_changes', ())
+    if models:
+        models_changed(models, pages, calender)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def after_rollback(session):
+    session.info.pop('changed_models', None)
+    session.info.pop('changed_pages', None)
+    session.info.pop('calender_changes', None)
+
+
+# ----------------------------------------------------------------------------#
+# Clock.
+# ----------------------------------------------------------------------------#
+
+
+@app.before_request
+def read_clock():
+    # Read once so every part of a request agrees on the date, even across midnight
+    g.now = clock.now()
+
+
+def current_time():
+    if has_request_context() and 'now' in g:
+        return g.now
+    return clock.now()
+
+
+def current_date():
+    return current_time().date()
+
+
+# ----------------------------------------------------------------------------#
+# Show counters.
+# ----------------------------------------------------------------------------#
+
+
+def count_show(connection, venue_id, artist_id, start_date, step):
+    # Adds `step` to the venue's and artist's counter for a show on start_date. The show is
+    # classified against the stored split date, not the local clock, so a rollover running
+    # in another process moves it exactly once.
+    if start_date is None:
+        return
+    counted_on = select([ShowCountsState.counted_on]).limit(1).as_scalar()
+    upcoming = literal(start_date) >= func.coalesce(counted_on, literal(current_date()))
+    for model, owner_id in ((Venue, venue_id), (Artist, artist_id)):
+        table = model.__table__
+        connection.execute(table.update().where(table.c.id == owner_id).values(
+            upcoming_shows_count=table.c.upcoming_shows_count + case([(upcoming, step)], else_=0),
+            past_shows_count=table.c.past_shows_count + case([(upcoming, 0)], else_=step)))
+
+
+@event.listens_for(Show, 'after_insert')
+def show_inserted(mapper, connection, show):
+    count_show(connection, show.venue_id, show.artist_id, show.start_date, 1)
+
+
+@event.listens_for(Show, 'after_delete')
+def show_deleted(mapper, connection, show):
+    count_show(connection, show.venue_id, show.artist_id, show.start_date, -1)
+
+
+@event.listens_for(Show, 'after_update')
+def show_updated(mapper, connection, show):
+    histories = [get_history(show, name) for name in ('venue_id', 'artist_id', 'start_date')]
+    if not any(history.deleted for history in histories):
+        return
+    old = [history.deleted[0] if history.deleted else history.unchanged[0] for history in histories]
+    count_show(connection, old[0], old[1], old[2], -1)
+    count_show(connection, show.venue_id, show.artist_id, show.start_date, 1)
+
+
+def roll_show_counts(today):
+    # Moves shows dated before `today` from the upcoming to the past counters. The conditional
+    # update of the state row lets only one process apply a given rollover.
+    state = ShowCountsState.__table__
+    counted_on = db.session.query(state.c.counted_on).scalar()
+    if counted_on is None:
+        db.session.execute(state.insert().values(id=1, counted_on=today))
+        recount_shows(today)
+    elif counted_on < today:
+        rolled = db.session.execute(state.update().where(state.c.counted_on == counted_on).values(counted_on=today))
+        if rolled.rowcount:
+            for model, owner_id in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+                moved = select([func.count(Show.id)]).where(and_(
+                    owner_id == model.id, Show.start_date >= counted_on, Show.start_date < today)).as_scalar()
+                touched = select([owner_id]).where(and_(Show.start_date >= counted_on, Show.start_date < today))
+                db.session.execute(model.__table__.update().where(model.id.in_(touched)).values(
+                    upcoming_shows_count=model.upcoming_shows_count - moved,
+                    past_shows_count=model.past_shows_count + moved))
+    db.session.commit()
+
+
+def recount_shows(today):
+    for model, owner_id in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+        shows_of = select([func.count(Show.id)]).where(owner_id == model.id)
+        db.session.execute(model.__table__.update().values(
+            upcoming_shows_count=shows_of.where(Show.start_date >= today).as_scalar(),
+            past_shows_count=shows_of.where(Show.start_date < today).as_scalar()))
+
+
+show_counts_day = None
+
+
+@app.before_request
+def roll_show_counts_daily():
+    global show_counts_day
+    today = current_date()
+    if show_counts_day != today:
+        try:
+            with profiler.ignored():
+                roll_show_counts(today)
+        except exc.IntegrityError:
+            # Another process created the state row first
+            db.session.rollback()
+        show_counts_day = today
+
+
+@app.cli.command('roll-show-counts')
+def roll_show_counts_command():
+    """Moves shows that started before today to the past show counters."""
+    roll_show_counts(clock.today())
+
+
+# ----------------------------------------------------------------------------#
+# Read replicas.
+# ----------------------------------------------------------------------------#
+
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def use_primary(view):
+    # For read-only views that must see the latest data, such as the forms editing it
+    view.use_primary = True
+    return view
+
+
+def read_only(view):
+    # For views taking POSTs that write nothing, such as the search forms
+    view.read_only = True
+    return view
+
+
+def reads_only(view):
+    return request.method in READ_METHODS or getattr(view, 'read_only', False)
+
+
+@app.before_request
+def route_reads():
+    # Registered after the daily rollover above, which writes and so runs on the primary
+    view = app.view_functions.get(request.endpoint)
+    db.session.info['read_only'] = (view is not None and reads_only(view) and not getattr(view, 'use_primary', False)
+                                    and cookie_session.get('primary_until', 0) <= time.time())
+
+
+@app.after_request
+def stick_to_primary(response):
+    # Read-your-writes: the replicas can lag behind, so the user reads from the primary for a while
+    if not reads_only(app.view_functions.get(request.endpoint)):
+        cookie_session['primary_until'] = time.time() + app.config['REPLICA_STICKY_SECONDS']
+    return response
+
+
+@app.teardown_request
+def end_read_routing(error=None):
+    db.session.info.pop('read_only', None)
+
 
 # ----------------------------------------------------------------------------#
 # Filters.DateTime
@@ -96,21 +513,31 @@ class ArtistCalender(db.Model):
 
 
 # updated datetime filter to fit model field
-def format_datetime(date, time, format='medium'):
-    obj = str(date) + ' ' + str(time)
-    date = dateutil.parser.parse(obj)
-    if format == 'full':
-        format = "EEEE MMMM, d, y 'at' h:mma"
-    elif format == 'medium':
-        format = "EE MM, dd, y h:mma"
-    elif format == 'small':
-        format = "EE MM, dd, y"
+date_formatter = DateTimeFormatter()
+
 
-    return babel.dates.format_datetime(date, format)
+def format_datetime(date, time, format='medium'):
+    return date_formatter.format(date, time, format)
 
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+# Thumbnail URLs carry the image link, signed so that only links the app rendered are fetched
+def thumbnail_signer():
+    key = app.config['THUMBNAIL_SIGNING_KEY']
+    return URLSafeSerializer(key, salt='thumbnail') if key else None
+
+
+def thumbnail_url(link, size='medium'):
+    signer = thumbnail_signer()
+    # Without a stable key, links signed by one worker would not load from another
+    if not link or signer is None:
+        return link
+    return url_for('thumbnail', size=size, token=signer.dumps(link))
+
+
+app.jinja_env.filters['thumb'] = thumbnail_url
+
 
 # ----------------------------------------------------------------------------#
 # Controllers.
@@ -119,62 +546,207 @@ app.jinja_env.filters['datetime'] = format_datetime
 
 @app.route('/')
 def index():
-    new_artists = Artist.query.order_by(Artist.id.desc()).limit(10).all()
-    new_venues = Venue.query.order_by(Venue.id.desc()).limit(10).all()
+    return render_home()
+
+
+NEW_ARTISTS_KEY = 'home:new_artists'
+NEW_VENUES_KEY = 'home:new_venues'
+
+
+def render_home():
+    # The "recently listed" panels are cached until an artist or venue write commits
+    new_artists = cache.get_or_set(NEW_ARTISTS_KEY, lambda: newest(Artist))
+    new_venues = cache.get_or_set(NEW_VENUES_KEY, lambda: newest(Venue))
     return render_template('pages/home.html', new_artists=new_artists, new_venues=new_venues)
 
 
+def newest(model, limit=10):
+    rows = db.session.query(model.id, model.name, model.image_link).order_by(model.id.desc()).limit(limit)
+    return [row._asdict() for row in rows]
+
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(dict(cache.stats(), fragments=fragments.stats(), thumbnails=thumbnailer.cache.stats()))
+
+
+@app.route('/pool/stats')
+def pool_stats():
+    return jsonify(pool_status(db.engine))
+
+
+@app.route('/logging/stats')
+def logging_stats():
+    return jsonify(log_pipeline.stats() if log_pipeline else {})
+
+
+@app.route('/metrics')
+def metrics_text():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/tasks/stats')
+def task_stats():
+    return jsonify(task_queue.stats())
+
+
+@app.route('/thumbnails/<size>/<token>')
+@query_budget(0)
+def thumbnail(size, token):
+    signer = thumbnail_signer()
+    if size not in app.config['THUMBNAIL_SIZES'] or signer is None:
+        abort(404)
+    try:
+        link = signer.loads(token)
+    except BadSignature:
+        abort(404)
+    # Images that failed to load are not fetched again for a while
+    error_key = 'thumbnail-error:' + link
+    error = cache.get(error_key)
+    if error is None:
+        try:
+            data = thumbnailer.get(link, size)
+        except thumbnails.ThumbnailError as failure:
+            error = str(failure)
+            cache.set(error_key, error, ttl=app.config['THUMBNAIL_ERROR_TTL'])
+    if error is not None:
+        response = Response(error, status=404, mimetype='text/plain')
+        response.cache_control.max_age = app.config['THUMBNAIL_ERROR_TTL']
+        return response
+    response = Response(data, mimetype=thumbnails.sniff(data))
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['THUMBNAIL_MAX_AGE']
+    response.set_etag(hashlib.sha256(data).hexdigest())
+    return response.make_conditional(request)
+
+
 # ----------------------------------------------------------------------------#
 #  Venues
 # ----------------------------------------------------------------------------#
 
 @app.route('/venues')
+@query_budget(1)
 def venues():
-    states_city = db.session.query(Venue).options(load_only("city", "state")).all()
-    data = []
-    for i in states_city:
-        obj = {
-            "city": i.city,
-            "state": i.state,
-            "venues": []
-        }
-        if obj not in data:
-            data.append(obj)
-    for k in data:
-        k['venues'] = Venue.query.filter_by(state=k['state'], city=k['city']).all()
+    # A single query ordered by area, grouped into areas in one linear pass
+    query = db.session.query(Venue.id, Venue.name, Venue.city, Venue.state, Venue.upcoming_shows_count)
+    genre = request.args.get('genre')
+    if genre:
+        # Served by the (genre_id, venue_id) primary key of venue_genres
+        query = query.join(venue_genres, venue_genres.c.venue_id == Venue.id) \
+            .join(Genre, Genre.id == venue_genres.c.genre_id).filter(Genre.name == genre)
+    if request.args.get('state'):
+        query = query.filter(Venue.state == request.args['state'])
+    if request.args.get('sort') == 'upcoming':
+        query = query.order_by(Venue.state, Venue.city, Venue.upcoming_shows_count.desc(), Venue.id)
+    else:
+        query = query.order_by(Venue.state, Venue.city, Venue.id)
+    rows = query.all()
+    return render_template('pages/venues.html', areas=group_by_area(rows), genre=genre)
+
 
-    return render_template('pages/venues.html', areas=data)
+def group_by_area(rows):
+    # Rows must already be ordered by state and city
+    return [{
+        "city": city,
+        "state": state,
+        "venues": list(area_venues)
+    } for (state, city), area_venues in groupby(rows, key=lambda v: (v.state, v.city))]
 
 
 @app.route('/venues/search', methods=['POST'])
+@read_only
 def search_venues():
     search_term = request.form.get('search_term', '')
-    res = db.session.query(Venue).filter(func.lower(Venue.name).contains(search_term.lower()))
-    response = {
-        "count": res.count(),
-        "data": res
-    }
+    page = request.form.get('page', 1, type=int)
+    response = search.search(db.session, Venue, search_term, VENUE_SEARCH_FIELDS, tags=Venue.genres,
+                             page=page, per_page=app.config['SEARCH_PAGE_SIZE'])
     return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
 
 @app.route('/venues/<int:venue_id>')
+@query_budget(2)
 def show_venue(venue_id):
-    data = Venue.query.get(venue_id)
-    data.past_shows = Show.query.filter_by(venue_id=venue_id).filter(Show.start_date <= now.date()).order_by(
-        Show.start_date).all()
-    data.past_shows_count = len(data.past_shows)
-    data.upcoming_shows = Show.query.filter_by(venue_id=venue_id).filter(Show.start_date >= now.date()).order_by(
-        Show.start_date).all()
-    data.upcoming_shows_count = len(data.upcoming_shows)
-    for i in data.past_shows:
-        i.artist_name = Artist.query.get(i.artist_id).name
-        i.artist_image_link = Artist.query.get(i.artist_id).image_link
-
-    for k in data.upcoming_shows:
-        k.artist_name = Artist.query.get(k.artist_id).name
-        k.artist_image_link = Artist.query.get(k.artist_id).image_link
-    data.genres = data.genres.split(",")
-    return render_template('pages/show_venue.html', venue=data)
+    return render_template('pages/show_venue.html', detail=detail_fragment('venue', venue_id, render_venue_detail))
+
+
+def render_venue_detail(venue_id):
+    # The venue and its genres come in one query; its shows, with their artists, in a second
+    # one unless today's partition is cached
+    data = Venue.query.options(joinedload(Venue.genres)).get(venue_id)
+    if data is None:
+        abort(404)
+    data.past_shows, data.upcoming_shows = show_partitions(
+        'venue', venue_id, lambda: Show.query.options(joinedload(Show.artist_shows)).filter(Show.venue_id == venue_id))
+    return {'title': data.name, 'html': render_template('fragments/show_venue.html', venue=data)}
+
+
+DETAIL_KINDS = ('venue', 'artist')
+
+
+def fragment_stamp_key(kind, owner_id):
+    # None stands for all pages of the kind
+    return 'fragment:stamp:%s:%s' % (kind, '*' if owner_id is None else owner_id)
+
+
+def versioned_ttl(ttl):
+    # TTL of a value cached under a version or stamp that writes replace in `cache`. Only a shared
+    # cache carries the replacement to the other processes; with the in-process one, they would
+    # keep the old value, so it is kept no longer than anything else there.
+    return ttl if cache.shared else min(ttl, app.config['CACHE_DEFAULT_TTL'])
+
+
+def detail_fragment(kind, owner_id, render):
+    # The content of a detail page, without the layout and its flashed messages, cached for the
+    # day under stamps that commits affecting the page replace, see changed_detail_pages. With a
+    # shared cache, a write in one process reaches the others' fragments through the stamps.
+    now = current_time()
+    stamps = [cache.get_or_set(fragment_stamp_key(kind, page_id), lambda: uuid.uuid4().hex, ttl=0)
+              for page_id in (None, owner_id)]
+    key = 'fragment:%s:%d:%s:%s' % (kind, owner_id, now.date().isoformat(), ':'.join(stamps))
+    ttl = versioned_ttl(min(seconds_until_tomorrow(now), app.config['FRAGMENT_CACHE_TTL']))
+    if db.session.info.get('read_only'):
+        ttl = min(ttl, app.config['REPLICA_STICKY_SECONDS'])
+    return fragments.get_or_set(key, lambda: render(owner_id), ttl=ttl, single_flight=True)
+
+
+SHOW_PARTITIONS_VERSION_KEY = 'shows:partitions_version'
+
+
+def show_partitions(owner, owner_id, load_shows):
+    # (past, upcoming) shows of a venue or artist, cached until midnight: the date is part of the
+    # key, and show, venue and artist writes replace the version so every partition is recomputed
+    now = current_time()
+    version = cache.get_or_set(SHOW_PARTITIONS_VERSION_KEY, lambda: uuid.uuid4().hex, ttl=0)
+    key = 'shows:%s:%d:%s:%s' % (owner, owner_id, now.date().isoformat(), version)
+    ttl = versioned_ttl(seconds_until_tomorrow(now))
+    if db.session.info.get('read_only'):
+        # A replica may not have the write that changed the version yet; keep what it returned briefly
+        ttl = min(ttl, app.config['REPLICA_STICKY_SECONDS'])
+    return cache.get_or_set(key, lambda: split_shows(load_shows(), now.date()), ttl=ttl)
+
+
+def split_shows(shows, today):
+    # Partitions already loaded shows into (past, upcoming) in a single pass, oldest first.
+    # Shows on the current date count as upcoming.
+    past, upcoming = [], []
+    dated = [show for show in shows if show.start_date is not None]
+    for show in sorted(dated, key=lambda s: (s.start_date, s.start_time or datetime.time.min, s.id)):
+        artist, venue = show.artist_shows, show.venue_shows
+        summary = {
+            "artist_id": show.artist_id,
+            "artist_name": artist.name,
+            "artist_image_link": artist.image_link,
+            "venue_id": show.venue_id,
+            "venue_name": venue.name,
+            "venue_image_link": venue.image_link,
+            "start_date": show.start_date,
+            "start_time": show.start_time
+        }
+        if show.start_date < today:
+            past.append(summary)
+        else:
+            upcoming.append(summary)
+    return past, upcoming
 
 
 # ----------------------------------------------------------------------------#
@@ -204,12 +776,14 @@ def create_venue_submission():
             city=city,
             state=state,
             phone=phone,
-            genres=",".join(genres),
+            genres=genres_by_name(genres),
             address=address,
             image_link=image_link,
             facebook_link=facebook_link
         )
         db.session.add(new_venue)
+        db.session.flush()
+        follow_up_later('venue', new_venue)
         db.session.commit()
         flash('Venue ' + request.form['name'] + ' was successfully listed!')
     except:
@@ -217,13 +791,14 @@ def create_venue_submission():
         db.session.rollback()
     finally:
         db.session.close()
-    return render_template('pages/home.html')
+    return render_home()
 
 
 @app.route('/venues/<venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
     try:
-        Venue.query.filter_by(id=venue_id).delete()
+        # Deleted through the session so its shows cascade and the artists' counters follow
+        db.session.delete(Venue.query.get(venue_id))
         db.session.commit()
         flash('Venue deleted!')
     except:
@@ -239,41 +814,48 @@ def delete_venue(venue_id):
 
 
 @app.route('/artists')
+@query_budget(1)
 def artists():
-    data = Artist.query.order_by('id').all()
-    return render_template('pages/artists.html', artists=data)
+    query = Artist.query
+    genre = request.args.get('genre')
+    if genre:
+        # Served by the (genre_id, artist_id) primary key of artist_genres
+        query = query.join(artist_genres, artist_genres.c.artist_id == Artist.id) \
+            .join(Genre, Genre.id == artist_genres.c.genre_id).filter(Genre.name == genre)
+    if request.args.get('state'):
+        query = query.filter(Artist.state == request.args['state'])
+    if request.args.get('sort') == 'upcoming':
+        query = query.order_by(Artist.upcoming_shows_count.desc(), Artist.id)
+    else:
+        query = query.order_by(Artist.id)
+    data = query.all()
+    return render_template('pages/artists.html', artists=data, genre=genre)
 
 
 @app.route('/artists/search', methods=['POST'])
+@read_only
 def search_artists():
     search_term = request.form.get('search_term', '')
-    res = db.session.query(Artist).filter(func.lower(Artist.name).contains(search_term.lower()))
-    response = {
-        "count": res.count(),
-        "data": res
-    }
+    page = request.form.get('page', 1, type=int)
+    response = search.search(db.session, Artist, search_term, ARTIST_SEARCH_FIELDS, tags=Artist.genres,
+                             page=page, per_page=app.config['SEARCH_PAGE_SIZE'])
     return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 
 @app.route('/artists/<int:artist_id>')
+@query_budget(2)
 def show_artist(artist_id):
-    artist = Artist.query.get(artist_id)
-    artist.genres = artist.genres.split(',')
-    artist.upcoming_shows = Show.query.filter_by(artist_id=artist_id).filter(Show.start_date >= now.date()).order_by(
-        Show.start_date).all()
-    artist.upcoming_shows_count = len(artist.upcoming_shows)
-    artist.past_shows = Show.query.filter_by(artist_id=artist_id).filter(Show.start_date <= now.date()).order_by(
-        Show.start_date).all()
-    artist.past_shows_count = len(artist.past_shows)
-    for v in artist.upcoming_shows:
-        v.venue_image_link = Venue.query.get(v.venue_id).image_link
-        v.venue_name = Venue.query.get(v.venue_id).name
+    return render_template('pages/show_artist.html', detail=detail_fragment('artist', artist_id, render_artist_detail))
 
-    for i in artist.past_shows:
-        i.venue_image_link = Venue.query.get(i.venue_id).image_link
-        i.venue_name = Venue.query.get(i.venue_id).name
 
-    return render_template('pages/show_artist.html', artist=artist)
+def render_artist_detail(artist_id):
+    # Same loading as show_venue, with each show's venue
+    artist = Artist.query.options(joinedload(Artist.genres)).get(artist_id)
+    if artist is None:
+        abort(404)
+    artist.past_shows, artist.upcoming_shows = show_partitions(
+        'artist', artist_id, lambda: Show.query.options(joinedload(Show.venue_shows)).filter(Show.artist_id == artist_id))
+    return {'title': artist.name, 'html': render_template('fragments/show_artist.html', artist=artist)}
 
 
 # ----------------------------------------------------------------------------#
@@ -282,9 +864,13 @@ def show_artist(artist_id):
 
 
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@use_primary
 def edit_artist(artist_id):
     artist = Artist.query.get(artist_id)
+    if artist is None:
+        abort(404)
     form = ArtistForm(obj=artist)
+    form.genres.data = [genre.name for genre in artist.genres]
     return render_template('forms/edit_artist.html', form=form, artist=artist)
 
 
@@ -305,13 +891,15 @@ def edit_artist_submission(artist_id):
         artist.name = name
         artist.city = city
         artist.state = state
-        artist.genres = ','.join(genres)
+        artist.genres = genres_by_name(genres)
         artist.image_link = image_link
         artist.facebook_link = facebook_link
         artist.phone = phone
         artist.website = website
         artist.seeking_description = seeking_description
         artist.seeking_venue = eval(seeking_venue)
+        db.session.flush()
+        follow_up_later('artist', artist)
         db.session.commit()
         flash('Artist ' + request.form['name'] + ' was successfully updated!')
     except:
@@ -325,7 +913,8 @@ def edit_artist_submission(artist_id):
 @app.route('/artists/<artist_id>', methods=['DELETE'])
 def delete_artist(artist_id):
     try:
-        Artist.query.filter_by(id=artist_id).delete()
+        # Deleted through the session so its shows and calender cascade and the venues' counters follow
+        db.session.delete(Artist.query.get(artist_id))
         db.session.commit()
         flash('Artist was successfully deleted!')
     except:
@@ -337,9 +926,13 @@ def delete_artist(artist_id):
 
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@use_primary
 def edit_venue(venue_id):
     venue = Venue.query.get(venue_id)
+    if venue is None:
+        abort(404)
     form = VenueForm(obj=venue)
+    form.genres.data = [genre.name for genre in venue.genres]
     return render_template('forms/edit_venue.html', form=form, venue=venue)
 
 
@@ -363,12 +956,14 @@ def edit_venue_submission(venue_id):
         venue.state = state
         venue.address = address
         venue.phone = phone
-        venue.genres = ",".join(genres)
+        venue.genres = genres_by_name(genres)
         venue.image_link = image_link
         venue.facebook_link = facebook_link
         venue.website = website
         venue.seeking_description = seeking_description
         venue.seeking_talent = eval(seeking_talent)
+        db.session.flush()
+        follow_up_later('venue', venue)
         db.session.commit()
         flash('Venue ' + request.form['name'] + ' was successfully updated!')
     except:
@@ -406,11 +1001,13 @@ def create_artist_submission():
             city=city,
             state=state,
             phone=phone,
-            genres=",".join(genres),
+            genres=genres_by_name(genres),
             image_link=image_link,
             facebook_link=facebook_link
         )
         db.session.add(new_artist)
+        db.session.flush()
+        follow_up_later('artist', new_artist)
         db.session.commit()
         flash('Artist ' + request.form['name'] + ' was successfully listed!')
     except:
@@ -419,7 +1016,7 @@ def create_artist_submission():
     finally:
         db.session.close()
 
-    return render_template('pages/home.html')
+    return render_home()
 
 
 # ----------------------------------------------------------------------------#
@@ -427,13 +1024,48 @@ def create_artist_submission():
 # ----------------------------------------------------------------------------#
 
 @app.route('/shows')
+@query_budget(1)
 def shows():
-    data = Show.query.order_by(Show.start_date).all()
-    for i in data:
-        i.artist_name = Artist.query.get(i.artist_id).name
-        i.artist_image_link = Artist.query.get(i.artist_id).image_link
-        i.venue_name = Venue.query.get(i.venue_id).name
-    return render_template('pages/shows.html', shows=data)
+    # Keyset pagination on (start_date, start_time, id); artist and venue columns come from one joined query
+    limit = min(request.args.get('limit', app.config['SHOWS_PAGE_SIZE'], type=int), app.config['SHOWS_PAGE_SIZE_MAX'])
+    if limit < 1:
+        abort(400)
+    query = db.session.query(
+        Show.id, Show.artist_id, Show.venue_id, Show.start_date, Show.start_time,
+        SHOW_DATE_KEY.label('sort_date'), SHOW_TIME_KEY.label('sort_time'),
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'),
+        Venue.name.label('venue_name')
+    ).join(Artist, Show.artist_id == Artist.id).join(Venue, Show.venue_id == Venue.id)
+    after = request.args.get('after')
+    if after:
+        try:
+            position = decode_show_cursor(after)
+        except ValueError:
+            abort(400)
+        query = query.filter(tuple_(*SHOW_FEED_ORDER) > tuple_(*position))
+    data = query.order_by(*SHOW_FEED_ORDER).limit(limit + 1).all()
+    next_cursor = encode_show_cursor(data[limit - 1]) if len(data) > limit else None
+    return stream_template('pages/shows.html', shows=data[:limit], next_cursor=next_cursor, limit=limit)
+
+
+def encode_show_cursor(show):
+    return '%s_%s_%d' % (show.sort_date.isoformat(), show.sort_time.strftime('%H:%M:%S'), show.id)
+
+
+def decode_show_cursor(cursor):
+    # Raises ValueError on malformed cursors
+    start_date, start_time, show_id = cursor.split('_')
+    return (datetime.datetime.strptime(start_date, '%Y-%m-%d').date(),
+            datetime.datetime.strptime(start_time, '%H:%M:%S').time(),
+            int(show_id))
+
+
+def stream_template(template_name, **context):
+    # Renders a template incrementally, flushing chunks to the client as they are generated
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    return Response(stream_with_context(template.generate(context)))
 
 
 @app.route('/shows/create')
@@ -445,19 +1077,23 @@ def create_shows():
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
     not_available = False
+    double_booked = None
     try:
         venue_id = request.form.get('venue_id', '')
         artist_id = request.form.get('artist_id', '')
-        start_date = request.form.get('start_date', '')
-        start_time = request.form.get('start_time', '')
-        # We check if an artist has dates in their calender, then check is the artist is available on the selected
-        # show date
-
-        # We assume any artist with an empty calender is available on all dates
-
-        artist_cal = ArtistCalender.query.filter_by(artist_id=artist_id).all()
-        artist_cal_2 = ArtistCalender.query.filter_by(date=start_date, artist_id=artist_id).all()
-        if len(artist_cal) == 0 or len(artist_cal) > 0 and len(artist_cal_2) > 0:
+        start_date = datetime.datetime.strptime(request.form.get('start_date', ''), '%Y-%m-%d').date()
+        start_time = datetime.datetime.strptime(request.form.get('start_time', ''), '%H:%M').time()
+        start = datetime.datetime.combine(start_date, start_time)
+        available, venue_busy, artist_busy = db.session.query(
+            artist_available(artist_id, start_date),
+            booked(Show.venue_id, venue_id, start),
+            booked(Show.artist_id, artist_id, start)
+        ).one()
+        if not available:
+            not_available = True
+        elif venue_busy or artist_busy:
+            double_booked = 'Venue' if venue_busy else 'Artist'
+        else:
             new_show = Show(
                 venue_id=venue_id,
                 artist_id=artist_id,
@@ -467,20 +1103,98 @@ def create_show_submission():
             db.session.add(new_show)
             db.session.commit()
             flash('Show was successfully listed!')
-        else:
-            not_available = True
 
     except:
         flash('Show not successfully listed!')
         db.session.rollback()
     finally:
         db.session.close()
-    if not_available:
-        flash('Artist is not available on the selected date!')
+    if not_available or double_booked:
+        if not_available:
+            flash('Artist is not available on the selected date!')
+        else:
+            flash('%s already has a show at the selected time!' % double_booked)
         form = ShowForm()
         return render_template('forms/new_show.html', form=form)
     else:
-        return render_template('pages/home.html')
+        return render_home()
+
+
+def artist_available(artist_id, date):
+    # An artist with an empty calender is available on all dates, otherwise only on the listed ones.
+    # Both EXISTS probes are served by the (artist_id, date) unique index.
+    has_calender = db.session.query(ArtistCalender.id).filter(ArtistCalender.artist_id == artist_id).exists()
+    listed = db.session.query(ArtistCalender.id).filter(
+        ArtistCalender.artist_id == artist_id, ArtistCalender.date == date).exists()
+    return or_(~has_calender, listed)
+
+
+def booked(column, owner_id, start):
+    # Whether a show of the venue or artist overlaps one starting at `start`, by the rule of
+    # validate_schedule: the two start less than SHOW_DURATION_MINUTES apart. The date range
+    # lets the probe use ix_shows_venue_start for venues.
+    duration = datetime.timedelta(minutes=app.config['SHOW_DURATION_MINUTES'])
+    low, high = start - duration, start + duration
+    show_start = tuple_(Show.start_date, func.coalesce(Show.start_time, datetime.time.min))
+    return db.session.query(Show.id).filter(
+        column == owner_id,
+        Show.start_date.between(low.date(), high.date()),
+        show_start > tuple_(literal(low.date(), db.Date), literal(low.time(), db.Time)),
+        show_start < tuple_(literal(high.date(), db.Date), literal(high.time(), db.Time))).exists()
+
+
+@app.route('/shows/validate', methods=['POST'])
+@read_only
+def validate_shows():
+    # Batch-checks an uploaded schedule: [{venue_id, artist_id, start_date, start_time}, ...]
+    try:
+        bookings = [conflicts.Booking(
+            venue_id=int(row['venue_id']),
+            artist_id=int(row['artist_id']),
+            start=datetime.datetime.strptime(row['start_date'] + ' ' + row['start_time'], '%Y-%m-%d %H:%M'),
+            ref=('row', i)
+        ) for i, row in enumerate(request.get_json()['shows'])]
+    except (KeyError, TypeError, ValueError):
+        abort(400)
+    found = validate_schedule(bookings)
+    return jsonify({
+        'valid': not found,
+        'conflicts': [{
+            'row': conflict.booking.ref[1],
+            'kind': conflict.kind,
+            'conflicts_with': None if conflict.other is None else {
+                'show_id' if conflict.other[0] == 'show' else 'row': conflict.other[1]
+            }
+        } for conflict in found]
+    })
+
+
+def validate_schedule(bookings):
+    # Loads the stored shows and calender entries that can clash with the bookings, three queries
+    # in all, and checks every booking against them and against the earlier bookings of the batch
+    if not bookings:
+        return []
+    duration = datetime.timedelta(minutes=app.config['SHOW_DURATION_MINUTES'])
+    first, last = conflicts.window(bookings, duration)
+    venue_ids = {booking.venue_id for booking in bookings}
+    artist_ids = {booking.artist_id for booking in bookings}
+    existing = db.session.query(Show.id, Show.venue_id, Show.artist_id, Show.start_date, Show.start_time).filter(
+        or_(Show.venue_id.in_(venue_ids), Show.artist_id.in_(artist_ids)),
+        Show.start_date.between(first, last))
+    calender = db.session.query(ArtistCalender.artist_id, ArtistCalender.date).filter(
+        ArtistCalender.artist_id.in_(artist_ids), ArtistCalender.date.between(first, last))
+    with_calender = db.session.query(ArtistCalender.artist_id).filter(
+        ArtistCalender.artist_id.in_(artist_ids)).distinct()
+    validator = conflicts.ScheduleValidator(
+        existing_shows=(conflicts.Booking(
+            show.venue_id, show.artist_id,
+            datetime.datetime.combine(show.start_date, show.start_time or datetime.time.min),
+            ('show', show.id)
+        ) for show in existing),
+        calender={(row.artist_id, row.date) for row in calender},
+        artists_with_calender={row.artist_id for row in with_calender},
+        duration=duration)
+    return validator.validate(bookings)
 
 
 # ----------------------------------------------------------------------------#
@@ -489,6 +1203,7 @@ def create_show_submission():
 
 
 @app.route('/artists/<int:artist_id>/calender')
+@use_primary
 def show_calender(artist_id):
     # Returns dates an artist is available for booking and also provision to add new dates
     artist = Artist.query.get(artist_id)
@@ -498,20 +1213,14 @@ def show_calender(artist_id):
 
 @app.route('/create_calender', methods=['POST'])
 def create_artist_calender():
-    # Adds new date to an Artist's calender
+    # Adds new dates to an Artist's calender
     try:
         artist_id = request.get_json()['artist_id']
         dates = request.get_json()['dates']
-        for i in dates:
-            date_obj = datetime.datetime.strptime(i, '%Y-%m-%dT%H:%M:%S.000Z').date() + datetime.timedelta(days=1)
-            artist_cal = ArtistCalender.query.filter_by(date=date_obj, artist_id=artist_id).all()
-            if len(artist_cal) == 0:
-                new_date = ArtistCalender(
-                    artist_id=artist_id,
-                    date=date_obj
-                )
-                db.session.add(new_date)
-
+        add_availability(artist_id, {
+            datetime.datetime.strptime(i, '%Y-%m-%dT%H:%M:%S.000Z').date() + datetime.timedelta(days=1)
+            for i in dates
+        })
         db.session.commit()
         flash('Calender data was successfully listed!')
     except:
@@ -523,11 +1232,35 @@ def create_artist_calender():
     return jsonify({'message': 'Calender Added'})
 
 
+CALENDER_INSERT_CHUNK = 500
+
+
+def add_availability(artist_id, dates):
+    # Adds the dates an artist is not available on yet and returns how many were inserted.
+    # Existing dates are read with one range query; the rest go in multi-row inserts that
+    # skip rows racing in through uq_calender_artist_date.
+    if not dates:
+        return 0
+    existing = {row.date for row in db.session.query(ArtistCalender.date).filter(
+        ArtistCalender.artist_id == artist_id, ArtistCalender.date.between(min(dates), max(dates)))}
+    rows = [{'artist_id': artist_id, 'date': date} for date in sorted(set(dates) - existing)]
+    for start in range(0, len(rows), CALENDER_INSERT_CHUNK):
+        db.session.execute(insert_ignoring_conflicts(db.session, ArtistCalender.__table__).values(
+            rows[start:start + CALENDER_INSERT_CHUNK]))
+    if rows:
+        track_changes(db.session, {ArtistCalender})
+        track_calender(db.session, [('add', int(artist_id), row['date']) for row in rows])
+    return len(rows)
+
+
 @app.route('/del_calender/<cal_id>', methods=['DELETE'])
 def del_calender(cal_id):
     try:
-        ArtistCalender.query.filter_by(id=cal_id).delete()
-        db.session.commit()
+        # Deleted through the session so the availability index learns which date went
+        entry = ArtistCalender.query.get(cal_id)
+        if entry is not None:
+            db.session.delete(entry)
+            db.session.commit()
     except:
         db.session.rollback()
     finally:
@@ -535,6 +1268,658 @@ def del_calender(cal_id):
     return jsonify({'success': True})
 
 
+# ----------------------------------------------------------------------------#
+#  Availability index
+# ----------------------------------------------------------------------------#
+
+
+AVAILABILITY_VERSION_KEY = 'availability:version'
+availability_index = AvailabilityIndex()
+
+
+def current_availability():
+    # The index, rebuilt when the version in the shared cache moved because another process
+    # changed a calender, or after AVAILABILITY_INDEX_MAX_AGE seconds as a safety net, sooner
+    # when the cache is per process and other processes' changes do not move the version
+    version = cache.get_or_set(AVAILABILITY_VERSION_KEY, lambda: uuid.uuid4().hex, ttl=0)
+    index = availability_index
+    if index.version != version or \
+            time.monotonic() - index.built_at > versioned_ttl(app.config['AVAILABILITY_INDEX_MAX_AGE']):
+        # Read from the primary: a lagging replica's calender would be kept under the new version
+        with db.engine.connect() as connection:
+            index.load(connection.execute(select([ArtistCalender.artist_id, ArtistCalender.date])), version)
+    return index
+
+
+def calender_changed(changes):
+    # Applies this process's committed calender changes to its index in place and replaces the
+    # shared version so that other processes rebuild theirs. The index is left to be rebuilt
+    # when it was already behind, or when a change does not say which dates it touched.
+    previous = cache.get(AVAILABILITY_VERSION_KEY)
+    version = uuid.uuid4().hex
+    cache.set(AVAILABILITY_VERSION_KEY, version, ttl=0)
+    index = availability_index
+    if index.version is None or index.version != previous or not changes or \
+            any(kind == 'rebuild' for kind, _, _ in changes):
+        index.version = None
+        return
+    for kind, artist_id, date in changes:
+        if kind == 'drop':
+            index.drop(artist_id)
+        elif date is not None:
+            getattr(index, kind)(artist_id, date)
+    index.version = version
+
+
+# ----------------------------------------------------------------------------#
+#  Geography
+# ----------------------------------------------------------------------------#
+
+
+@lru_cache()
+def load_gazetteer(path):
+    return geo.Gazetteer.load(path)
+
+
+@app.cli.command('geocode')
+@click.option('--gazetteer', help='CSV of city, state, latitude and longitude; defaults to GAZETTEER_PATH.')
+@click.option('--all', 'everything', is_flag=True, help='Locate rows that already have a location too.')
+def geocode_command(gazetteer, everything):
+    """Fills in venue and artist locations from the gazetteer of city centres."""
+    places = load_gazetteer(gazetteer or app.config['GAZETTEER_PATH'])
+    for model in (Venue, Artist):
+        located, unknown = geocode(model, places, everything)
+        click.echo('%s: %d located, %d in places missing from the gazetteer%s' % (
+            model.__tablename__, located, len(unknown), (': ' + '; '.join(sorted(unknown)[:20])) if unknown else ''))
+    db.session.commit()
+
+
+def geocode(model, places, everything=False, chunk_size=1000):
+    # Returns how many rows were located and the (city, state) places that were not found
+    query = db.session.query(model.id, model.city, model.state)
+    if not everything:
+        query = query.filter(model.latitude.is_(None))
+    table = model.__table__
+    update = table.update().where(table.c.id == bindparam('row_id'))
+    located, unknown = 0, set()
+    for chunk in importer.chunks(query.all(), chunk_size):
+        rows = []
+        for row in chunk:
+            point = places.locate(row.city, row.state)
+            if point is None:
+                unknown.add('%s, %s' % (row.city, row.state))
+                continue
+            rows.append({'row_id': row.id, 'latitude': point[0], 'longitude': point[1],
+                         'geohash': geo.encode(*point)})
+        if rows:
+            db.session.execute(update, rows)
+            located += len(rows)
+    return located, unknown
+
+
+@app.route('/venues/nearby')
+@query_budget(2)
+def venues_nearby():
+    return nearby(Venue)
+
+
+@app.route('/artists/nearby')
+@query_budget(2)
+def artists_nearby():
+    return nearby(Artist)
+
+
+def nearby(model):
+    # Rows within ?radius= miles of the origin, nearest first. Only the geohash cells covering
+    # the circle are read, each as a range scan on the geohash index.
+    latitude, longitude = nearby_origin()
+    miles = request.args.get('radius', app.config['NEARBY_RADIUS_MILES'], type=float)
+    if not 0 < miles <= app.config['NEARBY_RADIUS_MAX_MILES']:
+        raise api.APIError(400, 'radius must be between 0 and %s miles' % app.config['NEARBY_RADIUS_MAX_MILES'])
+    limit = api.page_limit(app.config['API_PAGE_SIZE'], app.config['API_PAGE_SIZE_MAX'])
+    cells = []
+    for low, high in map(geo.prefix_range, geo.covering_cells(latitude, longitude, miles)):
+        cells.append(model.geohash >= low if high is None else and_(model.geohash >= low, model.geohash < high))
+    rows = db.session.query(model.id, model.name, model.city, model.state, model.latitude, model.longitude) \
+        .filter(or_(*cells))
+    found = []
+    for row in rows:
+        distance = geo.distance_miles(latitude, longitude, row.latitude, row.longitude)
+        if distance <= miles:
+            found.append((distance, row.id, row))
+    found.sort()
+    return jsonify({
+        'origin': {'latitude': latitude, 'longitude': longitude},
+        'radius': miles,
+        'data': [{'id': row.id, 'name': row.name, 'city': row.city, 'state': row.state,
+                  'distance': round(distance, 1)} for distance, _, row in found[:limit]],
+    })
+
+
+def nearby_origin():
+    # ?lat=&lng=, the location of ?artist_id= or ?venue_id=, or the gazetteer's ?city=&state=
+    args = request.args
+    if 'lat' in args or 'lng' in args:
+        latitude, longitude = args.get('lat', type=float), args.get('lng', type=float)
+        if latitude is None or longitude is None or not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+            raise api.APIError(400, 'lat and lng must be a latitude and a longitude in degrees')
+        return latitude, longitude
+    for name, model in (('artist_id', Artist), ('venue_id', Venue)):
+        if name in args:
+            row = db.session.query(model.latitude, model.longitude).filter(
+                model.id == args.get(name, type=int)).first()
+            if row is None:
+                raise api.APIError(404, '%s %s not found' % (model.__name__, args[name]))
+            if row.latitude is None:
+                raise api.APIError(400, '%s %s has not been located yet' % (model.__name__, args[name]))
+            return row.latitude, row.longitude
+    if 'city' in args:
+        point = load_gazetteer(app.config['GAZETTEER_PATH']).locate(args['city'], args.get('state'))
+        if point is None:
+            raise api.APIError(400, 'Unknown city')
+        return point
+    raise api.APIError(400, 'Give lat and lng, artist_id, venue_id or city and state')
+
+
+# ----------------------------------------------------------------------------#
+#  Background tasks
+# ----------------------------------------------------------------------------#
+
+
+# Read through the module's clock, which tests replace
+task_queue = tasks.TaskQueue(app, db, Task, now=lambda: clock.now())
+
+
+@app.before_first_request
+def start_task_workers():
+    # Off by default; run `flask worker` processes instead
+    if app.config['TASKS_WORKER_THREADS']:
+        task_queue.start(app.config['TASKS_WORKER_THREADS'])
+
+
+@app.cli.command('worker')
+@click.option('--burst', is_flag=True, help='Exit once no task is due instead of waiting for more.')
+@click.option('--threads', default=1, show_default=True, help='Tasks run at the same time.')
+@click.option('--batch-size', type=int, help='Tasks claimed at a time; defaults to TASKS_BATCH_SIZE.')
+@click.option('--poll-interval', type=float, help='Seconds between looks for due tasks; defaults to TASKS_POLL_SECONDS.')
+def worker_command(burst, threads, batch_size, poll_interval):
+    """Runs background tasks as they become due."""
+    start = time.perf_counter()
+    stats = task_queue.work(burst=burst, threads=threads, batch_size=batch_size, poll_seconds=poll_interval)
+    seconds = time.perf_counter() - start
+    total = sum(stats.values())
+    click.echo('%d tasks in %.1f s (%.0f/s): %s' % (
+        total, seconds, total / seconds if seconds else 0,
+        ', '.join('%d %s' % (count, status) for status, count in sorted(stats.items())) or 'none due'))
+
+
+@app.cli.command('purge-tasks')
+@click.option('--days', default=7, show_default=True, help='Keep tasks finished in the last this many days.')
+def purge_tasks_command(days):
+    """Deletes finished background tasks, whose idempotency keys can then be used again."""
+    purged = task_queue.purge(current_time() - datetime.timedelta(days=days))
+    click.echo('%d tasks purged' % purged)
+
+
+def follow_up_later(kind, row):
+    # Called after a flush of a created or edited venue or artist. Rows without a location are
+    # geocoded once per version of the row, and image links checked once per link.
+    if row.latitude is None:
+        task_queue.enqueue('locate', key='locate:%s:%d:%s' % (kind, row.id, row.updated_at.isoformat()),
+                           kind=kind, row_id=row.id)
+    if row.image_link:
+        check_image_later(row.image_link)
+
+
+def check_image_later(link):
+    return task_queue.enqueue('check_image', key='check_image:' + hashlib.sha256(link.encode()).hexdigest(),
+                              link=link)
+
+
+@task_queue.task()
+def locate(kind, row_id):
+    row = (Venue if kind == 'venue' else Artist).query.get(row_id)
+    if row is None or row.latitude is not None:
+        return
+    point = load_gazetteer(app.config['GAZETTEER_PATH']).locate(row.city, row.state)
+    if point is not None:
+        row.latitude, row.longitude = point
+        row.geohash = geo.encode(*point)
+
+
+@task_queue.task()
+def check_image(link):
+    # Fails, and so is retried, unless the link is an image; otherwise its thumbnails are
+    # made ahead of the first page showing them
+    thumbnailer.check(link)
+    cache.delete('thumbnail-error:' + link)
+
+
+@app.cli.command('check-images')
+def check_images_command():
+    """Queues a check of every venue and artist image link not checked yet."""
+    links = {link for model in (Venue, Artist)
+             for link, in db.session.query(model.image_link).filter(model.image_link != '').distinct()
+             if link}
+    queued = sum(check_image_later(link) for link in links)
+    db.session.commit()
+    click.echo('%d of %d image links queued for a check' % (queued, len(links)))
+
+
+# ----------------------------------------------------------------------------#
+#  Bulk import
+# ----------------------------------------------------------------------------#
+
+
+# Form validating each record and the fields loaded from it
+IMPORT_KINDS = {
+    'venues': (VenueForm, ('name', 'city', 'state', 'address', 'phone', 'genres', 'image_link',
+                           'facebook_link', 'website', 'seeking_talent', 'seeking_description')),
+    'artists': (ArtistForm, ('name', 'city', 'state', 'phone', 'genres', 'image_link',
+                             'facebook_link', 'website', 'seeking_venue', 'seeking_description')),
+    'shows': (ShowForm, ('artist_id', 'venue_id', 'start_date', 'start_time')),
+}
+
+
+@app.cli.command('import-data')
+@click.argument('kind', type=click.Choice(sorted(IMPORT_KINDS)))
+@click.argument('path')
+@click.option('--format', type=click.Choice(['csv', 'json', 'ndjson']), help='Defaults to the file extension.')
+@click.option('--chunk-size', default=1000, show_default=True, help='Records validated and inserted together.')
+@click.option('--dry-run', is_flag=True, help='Validate and load, then roll back.')
+def import_data_command(kind, path, format, chunk_size, dry_run):
+    """Loads venues, artists or shows from a CSV, JSON or NDJSON file.
+
+    Shows name their artist and venue by artist_id/venue_id or by
+    artist_name/venue_name. Rejected records are reported with their line
+    and the rest are committed together.
+    """
+    progress = import_records(kind, importer.read_records(path, format), chunk_size,
+                              echo=lambda message: click.echo(message, err=True))
+    if dry_run or not progress.loaded:
+        db.session.rollback()
+        click.echo('Nothing committed.', err=True)
+    else:
+        db.session.commit()
+
+
+def import_records(kind, records, chunk_size=1000, echo=print):
+    # Validates and inserts (line number, record) pairs chunk by chunk without committing;
+    # returns the Progress with the counts
+    form_class, fields = IMPORT_KINDS[kind]
+    progress = importer.Progress(kind, echo)
+    for chunk in importer.chunks(records, chunk_size):
+        progress.read += len(chunk)
+        rows = []
+        for number, record in chunk:
+            record = dict(record)
+            if kind != 'shows':
+                record['genres'] = split_list(record.get('genres'))
+            errors = importer.form_errors(form_class, record, fields)
+            if errors:
+                progress.reject(number, errors)
+            else:
+                rows.append((number, record))
+        if kind == 'shows':
+            progress.loaded += import_shows(rows, progress)
+        else:
+            progress.loaded += import_owners(Venue if kind == 'venues' else Artist, fields, rows)
+        progress.report()
+    if kind == 'shows' and progress.loaded:
+        # Shows went in without the mapper events that keep the counters
+        recount_shows(db.session.query(ShowCountsState.counted_on).scalar() or current_date())
+    return progress
+
+
+def split_list(value):
+    # Stripped, non-empty and without repeats, as genres_by_name does; a repeated genre would
+    # break the primary key of the link tables
+    items = value if isinstance(value, (list, tuple)) else (value or '').split(',')
+    return list(dict.fromkeys(item for item in (str(item).strip() for item in items) if item))
+
+
+def import_owners(model, fields, rows):
+    # Inserts venues or artists with executemany; ids are allocated up front so the genre
+    # links can go in the same way
+    if not rows:
+        return 0
+    genre_ids = genre_ids_by_name({name for _, record in rows for name in record['genres']})
+    columns = [field for field in fields if field != 'genres']
+    values, links = [], []
+    for row_id, (_, record) in zip(allocate_ids(model, len(rows)), rows):
+        value = {column: record.get(column) or None for column in columns}
+        for flag in ('seeking_talent', 'seeking_venue'):
+            if flag in value:
+                value[flag] = str(value[flag]).lower() in ('true', '1', 'yes')
+        value['id'] = row_id
+        values.append(value)
+        links.extend({'genre_id': genre_ids[name], 'owner_id': row_id} for name in record['genres'])
+    links_table = venue_genres if model is Venue else artist_genres
+    owner_column = 'venue_id' if model is Venue else 'artist_id'
+    db.session.execute(model.__table__.insert(), values)
+    db.session.execute(links_table.insert(), [{'genre_id': link['genre_id'], owner_column: link['owner_id']}
+                                              for link in links])
+    track_changes(db.session, {model})
+    return len(values)
+
+
+def allocate_ids(model, count):
+    table = model.__table__
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return [row[0] for row in db.session.execute(
+            text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :count)"),
+            {'table': '"%s"' % table.name, 'count': count})]
+    # Other databases are single-writer (SQLite), and this transaction already holds the write lock
+    # or takes it with the inserts that follow
+    start = (db.session.query(func.max(table.c.id)).scalar() or 0) + 1
+    return list(range(start, start + count))
+
+
+def genre_ids_by_name(names):
+    # Ids of the named genres, inserting the missing ones
+    if not names:
+        return {}
+    ids = dict(db.session.query(Genre.name, Genre.id).filter(Genre.name.in_(names)))
+    missing = [{'name': name} for name in names if name not in ids]
+    if missing:
+        db.session.execute(insert_ignoring_conflicts(db.session, Genre.__table__), missing)
+        ids.update(db.session.query(Genre.name, Genre.id).filter(Genre.name.in_([m['name'] for m in missing])))
+    return ids
+
+
+def import_shows(rows, progress):
+    # Resolves the chunk's artist and venue references with one query per kind and way of
+    # naming them, checks the bookings like /shows/validate, then inserts with executemany
+    references = {}
+    for model, prefix in ((Artist, 'artist'), (Venue, 'venue')):
+        ids = {int(record[prefix + '_id']) for _, record in rows
+               if str(record.get(prefix + '_id') or '').strip().isdigit()}
+        names = {record[prefix + '_name'] for _, record in rows
+                 if not record.get(prefix + '_id') and record.get(prefix + '_name')}
+        known_ids = {row.id for row in db.session.query(model.id).filter(model.id.in_(ids))} if ids else set()
+        by_name = {}
+        if names:
+            for row in db.session.query(model.id, model.name).filter(model.name.in_(names)):
+                by_name.setdefault(row.name, []).append(row.id)
+        references[prefix] = (known_ids, by_name)
+
+    bookings, errors = {}, {}
+    for number, record in rows:
+        resolved, problems = {}, {}
+        for prefix in ('artist', 'venue'):
+            known_ids, by_name = references[prefix]
+            raw_id, name = str(record.get(prefix + '_id') or '').strip(), record.get(prefix + '_name')
+            if raw_id:
+                if raw_id.isdigit() and int(raw_id) in known_ids:
+                    resolved[prefix] = int(raw_id)
+                else:
+                    problems[prefix + '_id'] = ['No %s with id %s.' % (prefix, raw_id)]
+            elif len(by_name.get(name, ())) == 1:
+                resolved[prefix] = by_name[name][0]
+            else:
+                problems[prefix + '_name'] = ['%d %ss named %r.' % (len(by_name.get(name, ())), prefix, name)]
+        if problems:
+            errors[number] = problems
+            continue
+        start = datetime.datetime.strptime('%s %s' % (record['start_date'], record['start_time']), '%Y-%m-%d %H:%M')
+        bookings[number] = conflicts.Booking(resolved['venue'], resolved['artist'], start, ('row', number))
+    for conflict in validate_schedule(list(bookings.values())):
+        number = conflict.booking.ref[1]
+        bookings.pop(number, None)
+        message = 'The artist is not available on that date.' if conflict.kind == 'unavailable' else \
+            'Conflicts with another %s booking.' % conflict.kind
+        errors.setdefault(number, {}).setdefault('start_time', []).append(message)
+    for number in sorted(errors):
+        progress.reject(number, errors[number])
+    if bookings:
+        db.session.execute(Show.__table__.insert(), [{
+            'artist_id': booking.artist_id,
+            'venue_id': booking.venue_id,
+            'start_date': booking.start.date(),
+            'start_time': booking.start.time(),
+        } for booking in bookings.values()])
+        track_changes(db.session, {Show, Venue, Artist})
+    return len(bookings)
+
+
+# ----------------------------------------------------------------------------#
+#  JSON API
+# ----------------------------------------------------------------------------#
+
+
+VENUE_API_FIELDS = {name: api.attribute(name) for name in (
+    'id', 'name', 'city', 'state', 'address', 'phone', 'image_link', 'facebook_link', 'website',
+    'seeking_talent', 'seeking_description', 'upcoming_shows_count', 'past_shows_count', 'updated_at')}
+VENUE_API_FIELDS['genres'] = lambda venue: [genre.name for genre in venue.genres]
+
+ARTIST_API_FIELDS = {name: api.attribute(name) for name in (
+    'id', 'name', 'city', 'state', 'phone', 'image_link', 'facebook_link', 'website',
+    'seeking_venue', 'seeking_description', 'upcoming_shows_count', 'past_shows_count', 'updated_at')}
+ARTIST_API_FIELDS['genres'] = lambda artist: [genre.name for genre in artist.genres]
+
+SHOW_API_FIELDS = {name: api.attribute(name) for name in (
+    'id', 'venue_id', 'venue_name', 'artist_id', 'artist_name', 'artist_image_link',
+    'start_date', 'start_time', 'updated_at')}
+
+
+app.register_error_handler(api.APIError, api.error_response)
+
+
+@app.route('/api/v1/venues')
+def api_venues():
+    return api_list(Venue, VENUE_API_FIELDS)
+
+
+@app.route('/api/v1/venues/<int:venue_id>')
+def api_venue(venue_id):
+    return api_detail(Venue, VENUE_API_FIELDS, venue_id)
+
+
+@app.route('/api/v1/artists')
+def api_artists():
+    return api_list(Artist, ARTIST_API_FIELDS)
+
+
+@app.route('/api/v1/artists/<int:artist_id>')
+def api_artist(artist_id):
+    return api_detail(Artist, ARTIST_API_FIELDS, artist_id)
+
+
+@app.route('/api/v1/artists/available')
+def api_available_artists():
+    # Artists free on ?date=, or on every date up to ?until=, optionally in a ?city= and ?state=.
+    # The candidates come from one query; their calenders from the availability index.
+    first = api.date_arg('date')
+    last = api.date_arg('until', first)
+    if last < first:
+        raise api.APIError(400, 'until must not be before date')
+    query = db.session.query(Artist.id, Artist.name, Artist.city, Artist.state)
+    for name in ('city', 'state'):
+        if request.args.get(name):
+            query = query.filter(func.lower(getattr(Artist, name)) == request.args[name].lower())
+    rows = query.order_by(Artist.id).all()
+    free = set(current_availability().free_on([row.id for row in rows], first, last))
+    return jsonify({'data': [row._asdict() for row in rows if row.id in free]})
+
+
+def api_list(model, getters):
+    # Keyset pagination on id. The page's (id, version) pairs are read first and make up the
+    # ETag; rows are only loaded and serialized when the client does not hold that version.
+    fields = api.parse_fields(request.args.get('fields'), getters)
+    limit = api.page_limit(app.config['API_PAGE_SIZE'], app.config['API_PAGE_SIZE_MAX'])
+    after = request.args.get('after', 0, type=int)
+    stamps = db.session.query(model.id, model.version).filter(model.id > after) \
+        .order_by(model.id).limit(limit + 1).all()
+    page = stamps[:limit]
+    next_url = None
+    if len(stamps) > limit:
+        next_url = url_for(request.endpoint, after=page[-1].id, limit=limit, fields=request.args.get('fields'))
+
+    def build():
+        rows = api_rows(model, fields, [stamp.id for stamp in page])
+        return {'data': [api.serialize(row, fields, getters) for row in rows], 'next': next_url}
+
+    return api.conditional(api.make_etag(fields, next_url, [tuple(stamp) for stamp in page]), build)
+
+
+def api_detail(model, getters, row_id):
+    fields = api.parse_fields(request.args.get('fields'), getters)
+    version = db.session.query(model.version).filter(model.id == row_id).scalar()
+    if version is None:
+        raise api.APIError(404, '%s %d not found' % (model.__name__, row_id))
+
+    def build():
+        rows = api_rows(model, fields, [row_id])
+        if not rows:
+            raise api.APIError(404, '%s %d not found' % (model.__name__, row_id))
+        return api.serialize(rows[0], fields, getters)
+
+    return api.conditional(api.make_etag(fields, row_id, version), build)
+
+
+def api_rows(model, fields, ids):
+    # Rows with the given ids in id order, genres loaded in one more query if requested
+    if not ids:
+        return []
+    query = model.query.filter(model.id.in_(ids)).order_by(model.id)
+    if 'genres' in fields:
+        query = query.options(selectinload(model.genres))
+    return query.all()
+
+
+@app.route('/api/v1/shows')
+def api_shows():
+    # Same keyset order and cursor as /shows. A show's representation includes its artist and
+    # venue, so their versions are part of the ETag as well.
+    fields = api.parse_fields(request.args.get('fields'), SHOW_API_FIELDS)
+    limit = api.page_limit(app.config['API_PAGE_SIZE'], app.config['API_PAGE_SIZE_MAX'])
+    query = api_show_query()
+    for name in ('venue_id', 'artist_id'):
+        value = api.int_arg(name)
+        if value is not None:
+            query = query.filter(getattr(Show, name) == value)
+    after = request.args.get('after')
+    if after:
+        try:
+            position = decode_show_cursor(after)
+        except ValueError:
+            raise api.APIError(400, 'Malformed cursor')
+        query = query.filter(tuple_(*SHOW_FEED_ORDER) > tuple_(*position))
+    stamps = query.with_entities(Show.id, SHOW_DATE_KEY.label('sort_date'), SHOW_TIME_KEY.label('sort_time'),
+                                 Show.version, Artist.version, Venue.version) \
+        .order_by(*SHOW_FEED_ORDER).limit(limit + 1).all()
+    page = stamps[:limit]
+    next_url = None
+    if len(stamps) > limit:
+        args = dict(request.args.items(), after=encode_show_cursor(page[-1]), limit=limit)
+        next_url = url_for(request.endpoint, **args)
+
+    def build():
+        rows = api_show_query(Show.id.in_([stamp.id for stamp in page])).all() if page else []
+        position = {stamp.id: i for i, stamp in enumerate(page)}
+        rows.sort(key=lambda row: position[row.id])
+        return {'data': [api.serialize(row, fields, SHOW_API_FIELDS) for row in rows], 'next': next_url}
+
+    etag = api.make_etag(fields, next_url, [(stamp[0], stamp[3], stamp[4], stamp[5]) for stamp in page])
+    return api.conditional(etag, build)
+
+
+@app.route('/api/v1/shows/<int:show_id>')
+def api_show(show_id):
+    fields = api.parse_fields(request.args.get('fields'), SHOW_API_FIELDS)
+    stamp = api_show_query(Show.id == show_id).with_entities(Show.version, Artist.version, Venue.version).first()
+    if stamp is None:
+        raise api.APIError(404, 'Show %d not found' % show_id)
+
+    def build():
+        row = api_show_query(Show.id == show_id).first()
+        if row is None:
+            raise api.APIError(404, 'Show %d not found' % show_id)
+        return api.serialize(row, fields, SHOW_API_FIELDS)
+
+    return api.conditional(api.make_etag(fields, show_id, tuple(stamp)), build)
+
+
+def api_show_query(*criteria):
+    return db.session.query(
+        Show.id, Show.venue_id, Show.artist_id, Show.start_date, Show.start_time, Show.updated_at,
+        Venue.name.label('venue_name'),
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link')
+    ).join(Artist, Show.artist_id == Artist.id).join(Venue, Show.venue_id == Venue.id).filter(*criteria)
+
+
+# ----------------------------------------------------------------------------#
+#  Export
+# ----------------------------------------------------------------------------#
+
+
+EXPORT_FIELDS = {
+    'shows': ('id', 'start_date', 'start_time', 'artist_id', 'artist_name', 'venue_id', 'venue_name',
+              'venue_city', 'venue_state'),
+    'venues': ('id', 'name', 'city', 'state', 'address', 'phone', 'genres', 'image_link', 'facebook_link',
+               'website', 'seeking_talent', 'seeking_description', 'upcoming_shows_count', 'past_shows_count'),
+    'artists': ('id', 'name', 'city', 'state', 'phone', 'genres', 'image_link', 'facebook_link', 'website',
+                'seeking_venue', 'seeking_description', 'upcoming_shows_count', 'past_shows_count'),
+}
+
+
+@app.route('/export/<kind>.<format>')
+def export_data(kind, format):
+    if kind not in EXPORT_FIELDS or format not in exporter.WRITERS:
+        abort(404)
+    # stream_with_context keeps the session, and its open cursor, for as long as the body is written
+    chunks = exporter.WRITERS[format](EXPORT_FIELDS[kind], export_records(kind))
+    return Response(stream_with_context(chunks), mimetype=exporter.MIMETYPES[format],
+                    headers={'Content-Disposition': 'attachment; filename=%s.%s' % (kind, format)})
+
+
+@app.cli.command('export-data')
+@click.argument('kind', type=click.Choice(sorted(EXPORT_FIELDS)))
+@click.option('--format', default='csv', type=click.Choice(sorted(exporter.WRITERS)), show_default=True)
+@click.option('--output', default='-', type=click.File('w', encoding='utf-8', lazy=True),
+              help='File to write, standard output by default.')
+def export_data_command(kind, format, output):
+    """Writes all shows, venues or artists as CSV or NDJSON."""
+    for chunk in exporter.WRITERS[format](EXPORT_FIELDS[kind], export_records(kind)):
+        output.write(chunk)
+
+
+def export_records(kind):
+    # Rows are fetched EXPORT_BATCH_SIZE at a time; yield_per also asks for a server-side
+    # cursor, so memory stays flat however large the table is
+    if kind == 'shows':
+        query = db.session.query(
+            Show.id, Show.start_date, Show.start_time, Show.artist_id,
+            Artist.name.label('artist_name'),
+            Show.venue_id,
+            Venue.name.label('venue_name'),
+            Venue.city.label('venue_city'),
+            Venue.state.label('venue_state')
+        ).join(Artist, Show.artist_id == Artist.id).join(Venue, Show.venue_id == Venue.id).order_by(Show.id)
+    else:
+        model = Venue if kind == 'venues' else Artist
+        links = venue_genres if model is Venue else artist_genres
+        owner_id = links.c.venue_id if model is Venue else links.c.artist_id
+        names = select([genre_names_aggregate()]).select_from(links.join(Genre, Genre.id == links.c.genre_id)) \
+            .where(owner_id == model.id).as_scalar()
+        columns = [getattr(model, field) for field in EXPORT_FIELDS[kind] if field != 'genres']
+        query = db.session.query(*columns).add_columns(names.label('genres')).order_by(model.id)
+    for row in query.yield_per(app.config['EXPORT_BATCH_SIZE']):
+        record = row._asdict()
+        if 'genres' in record:
+            record['genres'] = record['genres'].split(',') if record['genres'] else []
+        yield record
+
+
+def genre_names_aggregate():
+    # Comma-separated genre names, in name order on PostgreSQL; genre names never contain
+    # commas, as the forms and the importer split on them
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return func.string_agg(Genre.name, aggregate_order_by(literal_column("','"), Genre.name))
+    return func.group_concat(Genre.name, ',')
+
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -545,16 +1930,6 @@ def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
-
 # ----------------------------------------------------------------------------#
 # Launch.
 # ----------------------------------------------------------------------------#
@@ -0,0 +1,140 @@
+# ----------------------------------------------------------------------------#
+# Artist availability index.
+#
+# An artist with calender entries is available on the listed dates only, and
+# one without any on every date. AvailabilityIndex keeps each artist's listed
+# dates as one 366-bit bitset per year (46 bytes), so "is the artist free on
+# this date" is a byte lookup, "every day of this range" a mask over at most
+# a year's bits at a time, and "which of these artists are free" a lookup per
+# artist, none of them reading the calender table.
+# ----------------------------------------------------------------------------#
+
+import datetime
+import threading
+import time
+
+YEAR_BYTES = 46
+EMPTY_YEAR = bytes(YEAR_BYTES)
+
+_year_starts = {}
+
+
+def day_of_year(date):
+    """0-based day number of `date` within its year."""
+    start = _year_starts.get(date.year)
+    if start is None:
+        start = _year_starts[date.year] = datetime.date(date.year, 1, 1).toordinal()
+    return date.toordinal() - start
+
+
+def days_in_year(year):
+    return datetime.date(year, 12, 31).toordinal() - datetime.date(year, 1, 1).toordinal() + 1
+
+
+class AvailabilityIndex(object):
+    """Listed dates per artist, as a bytearray bitset per year; bit n of a year is its day n.
+
+    Updated in place through add/remove/drop, or rebuilt with load. `version`
+    and `built_at` record what the last load was built from and when.
+    """
+
+    def __init__(self):
+        self._years = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+        self.version = None
+        self.built_at = None
+
+    def _add(self, years, counts, artist_id, date):
+        bits = years.setdefault(artist_id, {}).setdefault(date.year, bytearray(YEAR_BYTES))
+        day = day_of_year(date)
+        mask = 1 << (day & 7)
+        if not bits[day >> 3] & mask:
+            bits[day >> 3] |= mask
+            counts[artist_id] = counts.get(artist_id, 0) + 1
+
+    def add(self, artist_id, date):
+        with self._lock:
+            self._add(self._years, self._counts, artist_id, date)
+
+    def remove(self, artist_id, date):
+        with self._lock:
+            bits = self._years.get(artist_id, {}).get(date.year)
+            day = day_of_year(date)
+            mask = 1 << (day & 7)
+            if bits is None or not bits[day >> 3] & mask:
+                return
+            bits[day >> 3] &= ~mask
+            self._counts[artist_id] -= 1
+            if not self._counts[artist_id]:
+                self._drop(artist_id)
+
+    def _drop(self, artist_id):
+        self._years.pop(artist_id, None)
+        self._counts.pop(artist_id, None)
+
+    def drop(self, artist_id):
+        """Forgets every date of an artist, e.g. once it is deleted."""
+        with self._lock:
+            self._drop(artist_id)
+
+    def load(self, rows, version=None):
+        """Replaces the contents with the (artist_id, date) pairs of `rows`."""
+        years, counts = {}, {}
+        for artist_id, date in rows:
+            if date is not None:
+                self._add(years, counts, artist_id, date)
+        with self._lock:
+            self._years, self._counts = years, counts
+            self.version = version
+            self.built_at = time.monotonic()
+
+    def has_calender(self, artist_id):
+        return artist_id in self._counts
+
+    def listed(self, artist_id, date):
+        bits = self._years.get(artist_id, {}).get(date.year)
+        if bits is None:
+            return False
+        day = day_of_year(date)
+        return bool(bits[day >> 3] & (1 << (day & 7)))
+
+    def available(self, artist_id, date):
+        return not self.has_calender(artist_id) or self.listed(artist_id, date)
+
+    def available_between(self, artist_id, first, last):
+        """Whether the artist is available on every date from `first` to `last` inclusive."""
+        if not self.has_calender(artist_id):
+            return True
+        years = self._years.get(artist_id, {})
+        for year in range(first.year, last.year + 1):
+            bits = years.get(year)
+            if bits is None:
+                return False
+            low = day_of_year(first) if year == first.year else 0
+            high = day_of_year(last) if year == last.year else days_in_year(year) - 1
+            mask = ((1 << (high - low + 1)) - 1) << low
+            if int.from_bytes(bits, 'little') & mask != mask:
+                return False
+        return True
+
+    def free_on(self, artist_ids, first, last=None):
+        """The ids among `artist_ids` available on `first`, or on every date up to `last`.
+
+        Artists without a calender are free on every date and the index does not
+        know of them, hence the candidates are given.
+        """
+        if last is None or last == first:
+            # available() inlined, with the byte and bit of the date worked out once
+            counts, years, year, day = self._counts, self._years, first.year, day_of_year(first)
+            offset, mask = day >> 3, 1 << (day & 7)
+            return [artist_id for artist_id in artist_ids if artist_id not in counts or
+                    years[artist_id].get(year, EMPTY_YEAR)[offset] & mask]
+        return [artist_id for artist_id in artist_ids if self.available_between(artist_id, first, last)]
+
+    def stats(self):
+        return {
+            'artists': len(self._counts),
+            'dates': sum(self._counts.values()),
+            'bytes': sum(len(years) for years in self._years.values()) * YEAR_BYTES,
+        }
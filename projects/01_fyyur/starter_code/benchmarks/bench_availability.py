@@ -0,0 +1,117 @@
+# ----------------------------------------------------------------------------#
+# Benchmark: "which artists in this city are free", queried on the calender
+# rows versus answered from availability.AvailabilityIndex.
+#
+# Usage: python benchmarks/bench_availability.py [--artists 2000] [--dates 150]
+#                                                [--queries 200] [--range-days 3]
+# Seeds a SQLite database file with --dates calender entries per artist (a
+# tenth of the artists have none), then times single-date and date-range
+# lookups for random cities, and single dates over all artists, both ways
+# and checks they agree. Both ways read the candidate artists from the
+# database; the index replaces the calender part of the query.
+# ----------------------------------------------------------------------------#
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import and_, exists, func, or_, select
+
+from app import app, db, Artist, ArtistCalender
+from availability import AvailabilityIndex
+
+FIRST_DAY = datetime.date(2035, 1, 1)
+CITIES = 50
+SPAN_DAYS = 730
+
+
+def seed(artists, dates):
+    db.drop_all()
+    db.create_all()
+    db.session.execute(Artist.__table__.insert(), [
+        {'id': i + 1, 'name': 'Artist %d' % i, 'city': 'City %d' % (i % CITIES), 'state': 'CA'}
+        for i in range(artists)])
+    rows = []
+    for artist_id in range(1, artists + 1):
+        if artist_id % 10 == 0:
+            continue
+        for day in random.sample(range(SPAN_DAYS), dates):
+            rows.append({'artist_id': artist_id, 'date': FIRST_DAY + datetime.timedelta(days=day)})
+    for start in range(0, len(rows), 50000):
+        db.session.execute(ArtistCalender.__table__.insert(), rows[start:start + 50000])
+    db.session.commit()
+    return len(rows)
+
+
+def artists_in(city):
+    query = db.session.query(Artist.id)
+    if city is not None:
+        query = query.filter(Artist.city == city)
+    return query.order_by(Artist.id)
+
+
+def sql_free(city, first, last):
+    # Artists without calender entries, or with one on every date of the range
+    days = (last - first).days + 1
+    listed = select([func.count(ArtistCalender.id)]).where(and_(
+        ArtistCalender.artist_id == Artist.id, ArtistCalender.date.between(first, last))).as_scalar()
+    has_calender = exists().where(ArtistCalender.artist_id == Artist.id)
+    return [row.id for row in artists_in(city).filter(or_(~has_calender, listed == days))]
+
+
+def index_free(index, city, first, last):
+    return index.free_on([row.id for row in artists_in(city)], first, last)
+
+
+def timed(fn, queries):
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append(fn(*query))
+    return (time.perf_counter() - start) * 1000 / len(queries), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the artist availability index')
+    parser.add_argument('--artists', type=int, default=2000)
+    parser.add_argument('--dates', type=int, default=150)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--range-days', type=int, default=3)
+    args = parser.parse_args()
+    random.seed(1)
+
+    database = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + database
+    with app.app_context():
+        rows = seed(args.artists, args.dates)
+        index = AvailabilityIndex()
+        start = time.perf_counter()
+        index.load(db.session.query(ArtistCalender.artist_id, ArtistCalender.date))
+        build_ms = (time.perf_counter() - start) * 1000
+        stats = index.stats()
+        print('%d calender rows; index built in %.0f ms, %d bytes of bitsets for %d artists' % (
+            rows, build_ms, stats['bytes'], stats['artists']))
+
+        print('%-12s %12s %12s %8s' % ('query', 'rows ms', 'index ms', 'speedup'))
+        for name, days, any_city in (('single date', 1, False), ('%d-day range' % args.range_days, args.range_days, False),
+                                     ('any city', 1, True)):
+            queries = []
+            for _ in range(args.queries):
+                first = FIRST_DAY + datetime.timedelta(days=random.randrange(SPAN_DAYS - days))
+                city = None if any_city else 'City %d' % random.randrange(CITIES)
+                queries.append((city, first, first + datetime.timedelta(days=days - 1)))
+            sql_ms, expected = timed(sql_free, queries)
+            index_ms, results = timed(lambda city, first, last: index_free(index, city, first, last), queries)
+            assert results == expected, 'the index disagrees with the calender rows'
+            print('%-12s %12.2f %12.2f %7.1fx' % (name, sql_ms, index_ms, sql_ms / index_ms))
+    os.unlink(database)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# ----------------------------------------------------------------------------#
+# Benchmark: the `datetime` Jinja filter, previous implementation versus
+# formatting.DateTimeFormatter.
+#
+# Usage: python benchmarks/bench_datetime_filter.py [--shows 5000] [--distinct 300]
+# Formats one value per show, as rendering /shows does; --distinct sets how
+# many different start dates/times occur among them.
+# ----------------------------------------------------------------------------#
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import babel.dates
+import dateutil.parser
+
+from formatting import DateTimeFormatter
+
+
+def legacy_format_datetime(date, time, format='medium'):
+    # The original filter, kept here for comparison only
+    obj = str(date) + ' ' + str(time)
+    date = dateutil.parser.parse(obj)
+    if format == 'full':
+        format = "EEEE MMMM, d, y 'at' h:mma"
+    elif format == 'medium':
+        format = "EE MM, dd, y h:mma"
+    elif format == 'small':
+        format = "EE MM, dd, y"
+
+    return babel.dates.format_datetime(date, format)
+
+
+def run(fn, values):
+    start = time.perf_counter()
+    for date, start_time in values:
+        fn(date, start_time, 'full')
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the datetime template filter')
+    parser.add_argument('--shows', type=int, default=5000)
+    parser.add_argument('--distinct', type=int, default=300)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    first = datetime.date(2021, 1, 1)
+    pool = [(first + datetime.timedelta(days=rng.randrange(365)), datetime.time(rng.randrange(12, 24), 0))
+            for _ in range(args.distinct)]
+    values = [rng.choice(pool) for _ in range(args.shows)]
+
+    formatter = DateTimeFormatter()
+    assert all(legacy_format_datetime(d, t, 'full') == formatter.format(d, t, 'full') for d, t in pool)
+
+    uncached = DateTimeFormatter(memo_size=0)
+    results = (
+        ('legacy', run(legacy_format_datetime, values)),
+        ('compiled', run(uncached.format, values)),
+        ('memoized', run(formatter.format, values)),
+    )
+    print('%-10s %10s %12s' % ('impl', 'total ms', 'us per call'))
+    for name, elapsed in results:
+        print('%-10s %10.1f %12.2f' % (name, elapsed * 1000, elapsed * 1e6 / len(values)))
+
+
+if __name__ == '__main__':
+    main()
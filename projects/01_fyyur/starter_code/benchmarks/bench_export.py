@@ -0,0 +1,105 @@
+# ----------------------------------------------------------------------------#
+# Benchmark: exporting all shows, loaded at once versus streamed.
+#
+# Usage: python benchmarks/bench_export.py [--shows 1000000] [--format csv]
+# Seeds a SQLite database file, then runs each implementation in its own
+# process and reports its time and peak resident memory.
+# ----------------------------------------------------------------------------#
+
+import argparse
+import datetime
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as fyyur
+import exporter
+from app import app, db, Venue, Artist, Show
+
+
+def seed(shows, venues=1000, artists=5000):
+    db.drop_all()
+    db.create_all()
+    db.session.execute(Venue.__table__.insert(), [
+        {'id': i + 1, 'name': 'Venue %d' % i, 'city': 'City %d' % (i % 50), 'state': 'CA'} for i in range(venues)])
+    db.session.execute(Artist.__table__.insert(), [
+        {'id': i + 1, 'name': 'Artist %d' % i, 'city': 'City %d' % (i % 50), 'state': 'NY'} for i in range(artists)])
+    first = datetime.date(2020, 1, 1)
+    for start in range(0, shows, 50000):
+        db.session.execute(Show.__table__.insert(), [{
+            'venue_id': i % venues + 1,
+            'artist_id': i % artists + 1,
+            'start_date': first + datetime.timedelta(days=i // venues),
+            'start_time': datetime.time(20, 0),
+        } for i in range(start, min(start + 50000, shows))])
+    db.session.commit()
+
+
+def buffered_records():
+    # Everything is fetched and kept before the first line is written, as rendering /shows does
+    rows = db.session.query(
+        Show.id, Show.start_date, Show.start_time, Show.artist_id, Artist.name.label('artist_name'),
+        Show.venue_id, Venue.name.label('venue_name'), Venue.city.label('venue_city'),
+        Venue.state.label('venue_state')
+    ).join(Artist, Show.artist_id == Artist.id).join(Venue, Show.venue_id == Venue.id).order_by(Show.id).all()
+    return [row._asdict() for row in rows]
+
+
+def peak_memory_mb():
+    # VmHWM belongs to this process image; ru_maxrss would include the seeding parent's peak,
+    # as Linux carries it over exec
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run(impl, format):
+    start = time.perf_counter()
+    records = buffered_records() if impl == 'buffered' else fyyur.export_records('shows')
+    written = 0
+    with open(os.devnull, 'w') as sink:
+        for chunk in exporter.WRITERS[format](fyyur.EXPORT_FIELDS['shows'], records):
+            sink.write(chunk)
+            written += len(chunk)
+    elapsed = time.perf_counter() - start
+    peak = peak_memory_mb()
+    print('%-10s %12d %10.2f %12.1f' % (impl, written, elapsed, peak))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the streaming show export')
+    parser.add_argument('--shows', type=int, default=1000000)
+    parser.add_argument('--format', default='csv', choices=sorted(exporter.WRITERS))
+    parser.add_argument('--database', help=argparse.SUPPRESS)
+    parser.add_argument('--impl', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.impl:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + args.database
+        with app.app_context():
+            run(args.impl, args.format)
+        return
+
+    database = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + database
+    with app.app_context():
+        seed(args.shows)
+    print('%-10s %12s %10s %12s' % ('impl', 'chars', 'seconds', 'peak MB'))
+    for impl in ('buffered', 'streaming'):
+        subprocess.check_call([sys.executable, '-W', 'ignore', os.path.abspath(__file__), '--impl', impl,
+                               '--database', database, '--format', args.format])
+    os.unlink(database)
+
+
+if __name__ == '__main__':
+    main()
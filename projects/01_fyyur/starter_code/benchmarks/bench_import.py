@@ -0,0 +1,103 @@
+# ----------------------------------------------------------------------------#
+# Benchmark: bulk import throughput versus one committed row at a time.
+#
+# Usage: python benchmarks/bench_import.py [--venues 5000] [--shows 20000] [--chunk-size 1000]
+# Writes generated CSV files to a temporary directory and loads them into a
+# SQLite database file, first row by row as the create forms do, then with
+# the import-data pipeline.
+# ----------------------------------------------------------------------------#
+
+import argparse
+import csv
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as fyyur
+import importer
+from app import app, db, Venue, Artist, Show, genres_by_name
+
+GENRES = ['Jazz', 'Folk', 'Blues', 'Rock n Roll', 'Classical']
+
+
+def write_csv(path, fieldnames, rows):
+    with open(path, 'w', newline='') as fp:
+        writer = csv.DictWriter(fp, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def generate(directory, venues, artists, shows):
+    paths = {kind: os.path.join(directory, kind + '.csv') for kind in ('venues', 'artists', 'shows')}
+    write_csv(paths['venues'], ['name', 'city', 'state', 'address', 'genres', 'facebook_link'], ({
+        'name': 'Venue %d' % i, 'city': 'City %d' % (i % 100), 'state': 'CA',
+        'address': '%d Main Street' % i, 'genres': ','.join(GENRES[i % 5:i % 5 + 2]),
+        'facebook_link': 'https://www.facebook.com/venue%d' % i
+    } for i in range(venues)))
+    write_csv(paths['artists'], ['name', 'city', 'state', 'genres', 'facebook_link'], ({
+        'name': 'Artist %d' % i, 'city': 'City %d' % (i % 100), 'state': 'NY',
+        'genres': GENRES[i % 5], 'facebook_link': 'https://www.facebook.com/artist%d' % i
+    } for i in range(artists)))
+    first = datetime.date(2030, 1, 1)
+    # Show i plays venue i % venues on day i // venues, so no two bookings collide
+    write_csv(paths['shows'], ['venue_name', 'artist_name', 'start_date', 'start_time'], ({
+        'venue_name': 'Venue %d' % (i % venues), 'artist_name': 'Artist %d' % (i % artists),
+        'start_date': (first + datetime.timedelta(days=i // venues)).isoformat(), 'start_time': '20:00'
+    } for i in range(shows)))
+    return paths
+
+
+def legacy_import(paths):
+    # One ORM object and one commit per record, as the create forms do
+    for kind, model in (('venues', Venue), ('artists', Artist)):
+        for _, record in importer.read_records(paths[kind]):
+            record = dict(record, genres=genres_by_name(fyyur.split_list(record['genres'])))
+            db.session.add(model(**record))
+            db.session.commit()
+    ids = {model: dict(db.session.query(model.name, model.id)) for model in (Venue, Artist)}
+    for _, record in importer.read_records(paths['shows']):
+        db.session.add(Show(
+            venue_id=ids[Venue][record['venue_name']], artist_id=ids[Artist][record['artist_name']],
+            start_date=datetime.datetime.strptime(record['start_date'], '%Y-%m-%d').date(),
+            start_time=datetime.time(20, 0)))
+        db.session.commit()
+
+
+def bulk_import(paths, chunk_size):
+    for kind in ('venues', 'artists', 'shows'):
+        fyyur.import_records(kind, importer.read_records(paths[kind]), chunk_size, echo=lambda message: None)
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the bulk import pipeline')
+    parser.add_argument('--venues', type=int, default=5000)
+    parser.add_argument('--artists', type=int, default=5000)
+    parser.add_argument('--shows', type=int, default=20000)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    paths = generate(directory, args.venues, args.artists, args.shows)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, 'bench.db')
+    total = args.venues + args.artists + args.shows
+
+    print('%-8s %8s %10s %10s' % ('impl', 'rows', 'seconds', 'rows/s'))
+    with app.app_context():
+        for name, load in (('legacy', legacy_import), ('bulk', lambda p: bulk_import(p, args.chunk_size))):
+            db.drop_all()
+            db.create_all()
+            start = time.perf_counter()
+            load(paths)
+            elapsed = time.perf_counter() - start
+            assert Show.query.count() == args.shows
+            db.session.remove()
+            print('%-8s %8d %10.2f %10.0f' % (name, total, elapsed, total / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# ----------------------------------------------------------------------------#
+# Benchmark: background task queue throughput.
+#
+# Usage: python benchmarks/bench_tasks.py [--tasks 2000] [--threads 1,2,4]
+#                                         [--batch-size 10] [--io-ms 5]
+# Times enqueueing, one committed task at a time as the write handlers do and
+# all in one transaction, then drains the queue with `flask worker --burst`'s
+# TaskQueue.work at each thread count, for tasks doing a small database write
+# and for tasks also waiting --io-ms on the network, as fetching a URL would.
+# Runs on a SQLite database file, where writers take turns; on PostgreSQL the
+# workers claim with SKIP LOCKED and scale further.
+# ----------------------------------------------------------------------------#
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, task_queue, Venue
+
+
+def seed():
+    db.drop_all()
+    db.create_all()
+    db.session.add(Venue(name='Benchmark Hall', city='San Francisco', state='CA'))
+    db.session.commit()
+
+
+def enqueue(name, count, per_commit):
+    start = time.perf_counter()
+    for i in range(count):
+        task_queue.enqueue(name, key='%s:%d:%f' % (name, i, start), number=i)
+        if per_commit:
+            db.session.commit()
+    db.session.commit()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the background task queue')
+    parser.add_argument('--tasks', type=int, default=2000)
+    parser.add_argument('--threads', default='1,2,4')
+    parser.add_argument('--batch-size', type=int, default=10)
+    parser.add_argument('--io-ms', type=float, default=5)
+    args = parser.parse_args()
+
+    @task_queue.task('bench_write')
+    def bench_write(number):
+        Venue.query.get(1).phone = str(number)
+
+    @task_queue.task('bench_io')
+    def bench_io(number):
+        time.sleep(args.io_ms / 1000)
+        bench_write(number)
+
+    database = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + database
+    with app.app_context():
+        seed()
+        print('enqueue: %.0f tasks/s committed one by one, %.0f tasks/s in one transaction' % (
+            enqueue('bench_write', args.tasks // 4, True), enqueue('bench_write', args.tasks, False)))
+        task_queue.work(burst=True, batch_size=args.batch_size)
+
+        print('%-10s %8s %12s' % ('task', 'threads', 'tasks/s'))
+        for name in ('bench_write', 'bench_io'):
+            for threads in map(int, args.threads.split(',')):
+                enqueue(name, args.tasks, False)
+                start = time.perf_counter()
+                stats = task_queue.work(burst=True, threads=threads, batch_size=args.batch_size)
+                seconds = time.perf_counter() - start
+                assert stats == {'done': args.tasks}, stats
+                print('%-10s %8d %12.0f' % (name, threads, args.tasks / seconds))
+    os.unlink(database)
+
+
+if __name__ == '__main__':
+    main()
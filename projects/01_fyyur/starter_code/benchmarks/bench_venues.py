@@ -0,0 +1,89 @@
+# ----------------------------------------------------------------------------#
+# Benchmark: /venues query count and latency versus venue count.
+#
+# Usage: python benchmarks/bench_venues.py [--sizes 100,1000,5000] [--cities 200]
+# Runs against an in-memory SQLite database.
+# ----------------------------------------------------------------------------#
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from sqlalchemy.orm import load_only
+
+import app as fyyur
+from app import app, db, Venue
+
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+
+
+def legacy_venues():
+    # The original implementation, kept here for comparison only
+    states_city = db.session.query(Venue).options(load_only("city", "state")).all()
+    data = []
+    for i in states_city:
+        obj = {
+            "city": i.city,
+            "state": i.state,
+            "venues": []
+        }
+        if obj not in data:
+            data.append(obj)
+    for k in data:
+        k['venues'] = Venue.query.filter_by(state=k['state'], city=k['city']).all()
+    return data
+
+
+def grouped_venues():
+    rows = db.session.query(Venue.id, Venue.name, Venue.city, Venue.state).order_by(
+        Venue.state, Venue.city, Venue.id).all()
+    return fyyur.group_by_area(rows)
+
+
+def seed(count, cities):
+    db.drop_all()
+    db.create_all()
+    db.session.bulk_insert_mappings(Venue, [{
+        'name': 'Venue %d' % i,
+        'city': 'City %d' % (i % cities),
+        'state': 'CA' if i % 2 else 'NY'
+    } for i in range(count)])
+    db.session.commit()
+
+
+def measure(fn):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    start = time.perf_counter()
+    areas = fn()
+    elapsed = time.perf_counter() - start
+    event.remove(db.engine, 'before_cursor_execute', count)
+    db.session.remove()
+    return len(areas), len(statements), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the /venues listing')
+    parser.add_argument('--sizes', default='100,1000,5000')
+    parser.add_argument('--cities', type=int, default=200)
+    args = parser.parse_args()
+
+    print('%8s %8s %-8s %8s %10s' % ('venues', 'areas', 'impl', 'queries', 'ms'))
+    with app.app_context():
+        for size in [int(s) for s in args.sizes.split(',')]:
+            seed(size, args.cities)
+            for name, fn in (('legacy', legacy_venues), ('grouped', grouped_venues)):
+                areas, queries, elapsed = measure(fn)
+                print('%8d %8d %-8s %8d %10.1f' % (size, areas, name, queries, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
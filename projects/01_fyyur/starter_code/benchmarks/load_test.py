@@ -0,0 +1,134 @@
+# ----------------------------------------------------------------------------#
+# Load test: request latency under concurrency, with the pool metrics.
+#
+# Usage: python benchmarks/load_test.py [--concurrency 1,8,32] [--requests 2000]
+#                                       [--paths /venues,/artists,/shows,/api/v1/venues]
+#                                       [--base-url http://localhost:5000] [--pool-size 5]
+# Without --base-url the app runs in process against a seeded SQLite file,
+# with a QueuePool of --pool-size connections so that checkout waits show up
+# once the concurrency exceeds it. With --base-url the requests go to a
+# running server and the pool figures are read from its /pool/stats.
+# ----------------------------------------------------------------------------#
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from urllib.request import urlopen
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, Venue, Artist, Show
+from database import InstrumentedQueuePool, pool_stats
+
+
+def seed(venues=200, artists=500, shows=5000):
+    db.drop_all()
+    db.create_all()
+    db.session.execute(Venue.__table__.insert(), [
+        {'id': i + 1, 'name': 'Venue %d' % i, 'city': 'City %d' % (i % 20), 'state': 'CA'} for i in range(venues)])
+    db.session.execute(Artist.__table__.insert(), [
+        {'id': i + 1, 'name': 'Artist %d' % i, 'city': 'City %d' % (i % 20), 'state': 'NY'} for i in range(artists)])
+    first = datetime.date.today()
+    db.session.execute(Show.__table__.insert(), [{
+        'venue_id': i % venues + 1, 'artist_id': i % artists + 1,
+        'start_date': first + datetime.timedelta(days=i // venues), 'start_time': datetime.time(20, 0)
+    } for i in range(shows)])
+    db.session.commit()
+
+
+def make_fetch(base_url):
+    if base_url:
+        def fetch(path):
+            with urlopen(base_url + path) as response:
+                response.read()
+                return response.status
+        return fetch
+    local = threading.local()
+
+    def fetch(path):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        return local.client.get(path).status_code
+    return fetch
+
+
+def run(fetch, paths, requests, concurrency):
+    latencies, errors = [], []
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            try:
+                status = fetch(paths[i % len(paths)])
+            except Exception as error:
+                status = repr(error)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if status != 200:
+                    errors.append(status)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, sorted(latencies), errors
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure latency under concurrent requests')
+    parser.add_argument('--concurrency', default='1,8,32')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--paths', default='/venues,/artists,/shows,/api/v1/venues')
+    parser.add_argument('--base-url')
+    parser.add_argument('--pool-size', type=int, default=5)
+    args = parser.parse_args()
+    paths = args.paths.split(',')
+
+    if not args.base_url:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'load.db')
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'poolclass': InstrumentedQueuePool, 'pool_size': args.pool_size, 'max_overflow': 0,
+            'pool_timeout': 30, 'connect_args': {'check_same_thread': False, 'timeout': 30}}
+        with app.app_context():
+            seed()
+
+    fetch = make_fetch(args.base_url)
+    print('%6s %8s %8s %8s %8s %8s %7s %12s %8s' % (
+        'conc', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms', 'errors', 'wait avg ms', 'timeouts'))
+    for concurrency in [int(c) for c in args.concurrency.split(',')]:
+        if args.base_url:
+            before = json.loads(urlopen(args.base_url + '/pool/stats').read())
+        else:
+            pool_stats.reset()
+        elapsed, latencies, errors = run(fetch, paths, args.requests, concurrency)
+        if args.base_url:
+            stats = json.loads(urlopen(args.base_url + '/pool/stats').read())
+            # Server-side averages cover its whole lifetime; timeouts are diffed
+            stats['timeouts'] -= before['timeouts']
+        else:
+            stats = pool_stats.snapshot()
+        print('%6d %8.0f %8.1f %8.1f %8.1f %8.1f %7d %12.2f %8d' % (
+            concurrency, len(latencies) / elapsed, percentile(latencies, 0.5), percentile(latencies, 0.95),
+            percentile(latencies, 0.99), latencies[-1] * 1000, len(errors), stats['wait_avg_ms'], stats['timeouts']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+# ----------------------------------------------------------------------------#
+# Small caching layer.
+#
+# Cache wraps a backend with hit/miss counters. The default backend is an
+# in-process LRU with per-entry TTL; another backend can be plugged in through
+# the CACHE_BACKEND setting as an import path to a class with the same
+# get/set/delete/clear methods (and optionally stats). Such backends are taken
+# to be shared by all processes unless they set `shared = False`.
+#
+# get_or_set can coalesce concurrent misses of a key in this process, so an
+# expensive value is computed once while the other callers wait for it.
+#
+# DiskBackend keeps byte string values in files instead, e.g. for values too
+# large or too many to hold in memory, shared by the processes on a host.
+# ----------------------------------------------------------------------------#
+
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from werkzeug.utils import import_string
+
+MISSING = object()
+
+
+def value_size(value):
+    # Characters or bytes of text values, the shallow size of anything else
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+class MemoryBackend(object):
+    """Thread-safe LRU mapping whose entries expire `ttl` seconds after being set.
+
+    With `max_bytes`, least recently used entries are also evicted while the
+    total value_size of the values exceeds it, and larger values are not kept.
+    """
+
+    # Every process has its own entries
+    shared = False
+
+    def __init__(self, max_entries=1024, clock=time.monotonic, max_bytes=None, size=value_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.size = size
+        self.evictions = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            value, expires, size = entry
+            if expires is not None and expires <= self.clock():
+                del self._entries[key]
+                self.bytes -= size
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = self.clock() + ttl if ttl else None
+        size = self.size(value) if self.max_bytes else 0
+        with self._lock:
+            self._pop(key)
+            # Would evict everything else and then itself
+            if self.max_bytes and size > self.max_bytes:
+                return
+            self._entries[key] = (value, expires, size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or (self.max_bytes and self.bytes > self.max_bytes):
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {'entries': len(self._entries), 'evictions': self.evictions, 'bytes': self.bytes}
+
+
+class DiskBackend(object):
+    """Thread-safe LRU of byte strings stored in files under `directory`.
+
+    Values are content-addressed: each is written once, named by its SHA-256
+    digest, and keys refer to digests, so keys with the same value share a
+    file. Least recently used keys are evicted while there are more than
+    `max_entries` or the distinct values take more than `max_bytes`; larger
+    values are not stored. Entries written by other processes are picked up on
+    a miss; each process only evicts the entries it knows of, so the caps hold
+    per process.
+    """
+
+    def __init__(self, directory, max_entries=10000, max_bytes=256 * 1024 * 1024, clock=time.time):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.evictions = 0
+        self.bytes = 0
+        self._entries = None
+        self._sizes = {}
+        self._refs = {}
+        self._lock = threading.Lock()
+
+    def _key_path(self, name):
+        return os.path.join(self.directory, 'keys', name)
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, 'objects', digest[:2], digest)
+
+    def _load(self):
+        # The first use reads the entries already on disk, oldest first as the key files are
+        # touched on every hit
+        if self._entries is not None:
+            return
+        self._entries = OrderedDict()
+        os.makedirs(os.path.join(self.directory, 'keys'), exist_ok=True)
+        os.makedirs(os.path.join(self.directory, 'objects'), exist_ok=True)
+        found = []
+        for entry in os.scandir(os.path.join(self.directory, 'keys')):
+            if entry.is_file() and not entry.name.startswith('.'):
+                found.append((entry.stat().st_mtime, entry.name))
+        for _, name in sorted(found):
+            self._read_key(name)
+
+    def _read_key(self, name):
+        try:
+            with open(self._key_path(name)) as fp:
+                digest, expires = fp.read().split()
+            size = os.path.getsize(self._object_path(digest))
+        except (OSError, ValueError):
+            return None
+        self._add(name, digest, float(expires) or None, size)
+        return self._entries[name]
+
+    def _add(self, name, digest, expires, size):
+        self._entries[name] = (digest, expires)
+        if digest not in self._refs:
+            self._refs[digest] = 0
+            self._sizes[digest] = size
+            self.bytes += size
+        self._refs[digest] += 1
+
+    def _pop(self, name, remove=True):
+        entry = self._entries.pop(name, None)
+        if entry is None:
+            return
+        if remove:
+            _remove(self._key_path(name))
+        digest = entry[0]
+        self._refs[digest] -= 1
+        if not self._refs[digest]:
+            del self._refs[digest]
+            self.bytes -= self._sizes.pop(digest)
+            _remove(self._object_path(digest))
+
+    def get(self, key):
+        name = _hash(key)
+        with self._lock:
+            self._load()
+            entry = self._entries.get(name) or self._read_key(name)
+            if entry is None:
+                return MISSING
+            digest, expires = entry
+            if expires is not None and expires <= self.clock():
+                self._pop(name)
+                return MISSING
+            self._entries.move_to_end(name)
+        try:
+            with open(self._object_path(digest), 'rb') as fp:
+                value = fp.read()
+            os.utime(self._key_path(name))
+        except OSError:
+            # Evicted by another process
+            with self._lock:
+                self._pop(name, remove=False)
+            return MISSING
+        return value
+
+    def set(self, key, value, ttl=None):
+        name, digest = _hash(key), hashlib.sha256(value).hexdigest()
+        expires = self.clock() + ttl if ttl else 0
+        with self._lock:
+            self._load()
+            if len(value) > self.max_bytes:
+                # Also drops the key's earlier value, even when another process wrote it
+                self._pop(name, remove=False)
+                _remove(self._key_path(name))
+                return
+            self._pop(name, remove=False)
+            path = self._object_path(digest)
+            if digest not in self._refs and not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                _write(path, value)
+            _write(self._key_path(name), ('%s %r' % (digest, expires)).encode())
+            self._add(name, digest, expires or None, len(value))
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._load()
+            self._pop(_hash(key))
+
+    def clear(self):
+        with self._lock:
+            self._load()
+            for name in list(self._entries):
+                self._pop(name)
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            return {'entries': len(self._entries), 'evictions': self.evictions, 'bytes': self.bytes}
+
+
+def _hash(key):
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def _write(path, data):
+    # Written under a temporary name first, so readers never see part of a file
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.')
+    with os.fdopen(fd, 'wb') as fp:
+        fp.write(data)
+    os.replace(temporary, path)
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class Cache(object):
+    """Counts hits and misses in front of a backend."""
+
+    def __init__(self, backend, default_ttl=60):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+    @property
+    def shared(self):
+        """Whether a value set in one process is seen by the others."""
+        return getattr(self.backend, 'shared', True)
+
+    def get(self, key, default=None):
+        value = self.backend.get(key)
+        if value is MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(key, value, ttl if ttl is not None else self.default_ttl)
+
+    def get_or_set(self, key, compute, ttl=None, single_flight=False):
+        """Returns the cached value of `key`, calling `compute()` and caching its result on a miss.
+
+        With `single_flight`, callers missing a key that another thread is already
+        computing wait for that value instead of computing it again.
+        """
+        value = self.backend.get(key)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+        if not single_flight:
+            self.misses += 1
+            value = compute()
+            self.set(key, value, ttl)
+            return value
+        with self._flights_lock:
+            flight = self._flights.setdefault(key, threading.Lock())
+        with flight:
+            value = self.backend.get(key)
+            if value is not MISSING:
+                self.coalesced += 1
+                return value
+            self.misses += 1
+            try:
+                value = compute()
+                self.set(key, value, ttl)
+            finally:
+                with self._flights_lock:
+                    self._flights.pop(key, None)
+            return value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        stats = {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced}
+        # Backends may report their own figures
+        stats.update(getattr(self.backend, 'stats', dict)())
+        return stats
+
+
+def create_cache(config):
+    """Builds the cache described by the CACHE_* settings."""
+    backend = config.get('CACHE_BACKEND', 'memory')
+    if backend == 'memory':
+        backend = MemoryBackend(max_entries=config.get('CACHE_MAX_ENTRIES', 1024))
+    else:
+        backend = import_string(backend)(**config.get('CACHE_BACKEND_OPTIONS', {}))
+    return Cache(backend, default_ttl=config.get('CACHE_DEFAULT_TTL', 60))
@@ -0,0 +1,44 @@
+# ----------------------------------------------------------------------------#
+# Clock.
+#
+# Code that splits shows into past and upcoming asks a clock for the current
+# time instead of reading it once at import, so long-lived workers follow
+# the date. FixedClock stands in for it in tests and scripts.
+# ----------------------------------------------------------------------------#
+
+import datetime
+
+
+class Clock(object):
+    """Reads the system time, local unless a tzinfo is given."""
+
+    def __init__(self, tz=None):
+        self.tz = tz
+
+    def now(self):
+        return datetime.datetime.now(self.tz)
+
+    def today(self):
+        return self.now().date()
+
+
+class FixedClock(Clock):
+    """A clock that only moves when told to."""
+
+    def __init__(self, now):
+        super(FixedClock, self).__init__(now.tzinfo)
+        self.current = now
+
+    def now(self):
+        return self.current
+
+    def advance(self, **delta):
+        self.current += datetime.timedelta(**delta)
+
+
+def seconds_until_tomorrow(now):
+    """Seconds from `now` to the following midnight, at least one."""
+    midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time.min)
+    if now.tzinfo is not None:
+        midnight = midnight.replace(tzinfo=now.tzinfo)
+    return max(int((midnight - now).total_seconds()), 1)
@@ -1,5 +1,7 @@
 import os
-SECRET_KEY = os.urandom(32)
+import tempfile
+# Set it in production so every worker accepts the same session cookies
+SECRET_KEY = os.environ.get('SECRET_KEY') or os.urandom(32)
 # Grabs the folder where the script runs.
 basedir = os.path.abspath(os.path.dirname(__file__))
 
@@ -9,5 +11,137 @@ DEBUG = True
 # Connect to the database
 
 
-# TODO IMPLEMENT DATABASE URL
-SQLALCHEMY_DATABASE_URI = 'postgres://postgres@localhost:5432/fyyur'
+def _env_flag(name, default):
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes', 'on')
+
+
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgres://postgres@localhost:5432/fyyur')
+SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# Connection pool and engine settings, see database.py. DB_PGBOUNCER is for a
+# PgBouncer in transaction mode in front of PostgreSQL: no connections are
+# pooled here and the statement timeout is set per transaction. psycopg2 never
+# prepares statements on the server, so nothing else has to change for it.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = _env_flag('DB_POOL_PRE_PING', '1')
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+DB_PGBOUNCER = _env_flag('DB_PGBOUNCER', '0')
+
+# Read replicas as comma-separated URLs. Read-only views use one of them,
+# unless the user wrote something in the last REPLICA_STICKY_SECONDS
+DATABASE_REPLICA_URLS = [url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+SQLALCHEMY_BINDS = {'replica%d' % i: url for i, url in enumerate(DATABASE_REPLICA_URLS)}
+REPLICA_BINDS = sorted(SQLALCHEMY_BINDS)
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 10))
+
+# Opt-in SQL profiling, see profiler.py: a summary line per request, with the
+# statement shapes run at least SQL_PROFILER_REPEAT_THRESHOLD times flagged as
+# possible N+1 queries. Requests running more statements than their view's
+# @query_budget, or else SQL_QUERY_BUDGET (0 for none), are logged, or raise
+# with SQL_PROFILER_STRICT as in the pytest plugin
+SQL_PROFILER = _env_flag('SQL_PROFILER', '0')
+SQL_PROFILER_STRICT = _env_flag('SQL_PROFILER_STRICT', '0')
+SQL_QUERY_BUDGET = int(os.environ.get('SQL_QUERY_BUDGET', 0))
+SQL_PROFILER_REPEAT_THRESHOLD = 5
+
+# Requests taking at least SLOW_REQUEST_MS (0 to disable) are logged with their
+# parameters and the SLOW_REQUEST_TOP_QUERIES statement shapes that took longest
+SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 500))
+SLOW_REQUEST_TOP_QUERIES = 5
+
+# Outside debug mode log records go through a bounded queue to LOG_FILE, see
+# logs.py. LOG_FORMAT is 'json' or 'text'. The file rotates at LOG_ROTATE_WHEN
+# (a TimedRotatingFileHandler interval such as 'midnight') when set, else at
+# LOG_MAX_BYTES. Records below WARNING are kept at LOG_INFO_SAMPLE_RATE, and
+# records arriving while LOG_QUEUE_SIZE are pending are dropped and counted
+LOG_FILE = os.environ.get('LOG_FILE', 'error.log')
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_ROTATE_WHEN = os.environ.get('LOG_ROTATE_WHEN', '')
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 5))
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_INFO_SAMPLE_RATE = float(os.environ.get('LOG_INFO_SAMPLE_RATE', 1.0))
+
+# Page size of the /shows feed, overridable per request up to the maximum
+SHOWS_PAGE_SIZE = 30
+SHOWS_PAGE_SIZE_MAX = 100
+
+# Shows only store a start; conflict checks assume they all last this long
+SHOW_DURATION_MINUTES = 180
+
+# Results per page for venue and artist search
+SEARCH_PAGE_SIZE = 20
+
+# Cache for hot read paths such as the home page panels. CACHE_BACKEND is
+# 'memory' or an import path to a backend class built with CACHE_BACKEND_OPTIONS.
+# Writes invalidate cached detail pages and show lists through it; as the
+# 'memory' backend is per process, those are then kept at most
+# CACHE_DEFAULT_TTL seconds, so run a shared backend to keep them longer
+CACHE_BACKEND = 'memory'
+CACHE_BACKEND_OPTIONS = {}
+CACHE_DEFAULT_TTL = 60
+CACHE_MAX_ENTRIES = 1024
+
+# In-process cache of rendered venue and artist detail pages, bounded by entry
+# count and by the total size of the HTML; entries also expire at midnight
+FRAGMENT_CACHE_MAX_ENTRIES = int(os.environ.get('FRAGMENT_CACHE_MAX_ENTRIES', 2000))
+FRAGMENT_CACHE_MAX_BYTES = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+FRAGMENT_CACHE_TTL = int(os.environ.get('FRAGMENT_CACHE_TTL', 3600))
+
+# The in-process artist availability index follows this process's calender
+# writes and rebuilds on other processes' writes; it is also rebuilt once it is
+# this many seconds old
+AVAILABILITY_INDEX_MAX_AGE = int(os.environ.get('AVAILABILITY_INDEX_MAX_AGE', 600))
+
+# City centres used by `flask geocode`, and the radius of /venues/nearby and
+# /artists/nearby searches by default and at most, in miles
+GAZETTEER_PATH = os.environ.get('GAZETTEER_PATH', os.path.join(basedir, 'data', 'gazetteer.csv'))
+NEARBY_RADIUS_MILES = 50
+NEARBY_RADIUS_MAX_MILES = 500
+
+# Background tasks, see tasks.py. Workers claim TASKS_BATCH_SIZE due tasks at
+# a time, looking every TASKS_POLL_SECONDS when none is due, and hold them for
+# TASKS_LEASE_SECONDS before another worker may take them over. Failed tasks
+# are retried after TASKS_RETRY_BASE_SECONDS, doubling up to
+# TASKS_RETRY_MAX_SECONDS, and give up after TASKS_MAX_ATTEMPTS. The web
+# process runs TASKS_WORKER_THREADS worker threads of its own, none by default
+TASKS_BATCH_SIZE = int(os.environ.get('TASKS_BATCH_SIZE', 10))
+TASKS_POLL_SECONDS = float(os.environ.get('TASKS_POLL_SECONDS', 1))
+TASKS_LEASE_SECONDS = int(os.environ.get('TASKS_LEASE_SECONDS', 300))
+TASKS_MAX_ATTEMPTS = int(os.environ.get('TASKS_MAX_ATTEMPTS', 5))
+TASKS_RETRY_BASE_SECONDS = int(os.environ.get('TASKS_RETRY_BASE_SECONDS', 10))
+TASKS_RETRY_MAX_SECONDS = int(os.environ.get('TASKS_RETRY_MAX_SECONDS', 3600))
+TASKS_WORKER_THREADS = int(os.environ.get('TASKS_WORKER_THREADS', 0))
+
+# Venue and artist images are served through /thumbnails, see thumbnails.py,
+# scaled to fit squares of these sizes in pixels. Their URLs are signed with
+# THUMBNAIL_SIGNING_KEY, or SECRET_KEY when only that is set in the
+# environment; the key must be the same in every worker and across restarts,
+# so without either pages link to the images themselves.
+# THUMBNAIL_FETCHER is 'http' or an import path to a fetcher class built with
+# THUMBNAIL_FETCHER_OPTIONS. Thumbnails are kept on disk under
+# THUMBNAIL_CACHE_DIR up to the entry and size caps, and browsers may keep
+# them for THUMBNAIL_MAX_AGE seconds; images failing to load are retried
+# after THUMBNAIL_ERROR_TTL seconds
+THUMBNAIL_SIZES = {'small': 96, 'medium': 320, 'large': 640}
+THUMBNAIL_SIGNING_KEY = os.environ.get('THUMBNAIL_SIGNING_KEY') or os.environ.get('SECRET_KEY')
+THUMBNAIL_FETCHER = os.environ.get('THUMBNAIL_FETCHER', 'http')
+THUMBNAIL_FETCHER_OPTIONS = {}
+THUMBNAIL_FETCH_TIMEOUT = float(os.environ.get('THUMBNAIL_FETCH_TIMEOUT', 5))
+THUMBNAIL_MAX_SOURCE_BYTES = int(os.environ.get('THUMBNAIL_MAX_SOURCE_BYTES', 10 * 1024 * 1024))
+THUMBNAIL_CACHE_DIR = os.environ.get('THUMBNAIL_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'fyyur-thumbnails'))
+THUMBNAIL_CACHE_MAX_ENTRIES = int(os.environ.get('THUMBNAIL_CACHE_MAX_ENTRIES', 20000))
+THUMBNAIL_CACHE_MAX_BYTES = int(os.environ.get('THUMBNAIL_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+THUMBNAIL_MAX_AGE = int(os.environ.get('THUMBNAIL_MAX_AGE', 30 * 24 * 3600))
+THUMBNAIL_ERROR_TTL = int(os.environ.get('THUMBNAIL_ERROR_TTL', 300))
+
+# Page size of the JSON API list endpoints, overridable per request up to the maximum
+API_PAGE_SIZE = 50
+API_PAGE_SIZE_MAX = 200
+
+# Rows fetched per round trip by the streaming exports
+EXPORT_BATCH_SIZE = 1000
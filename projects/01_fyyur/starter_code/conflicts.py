@@ -0,0 +1,96 @@
+# ----------------------------------------------------------------------------#
+# Booking conflict detection.
+#
+# Shows only record when they start, so every show is taken to last the same
+# configured duration. With equal-length intervals two bookings overlap
+# exactly when their starts are less than one duration apart, which lets a
+# sorted list of starts per venue and per artist answer "does this booking
+# overlap anything?" by looking at the two neighbours found with bisect.
+# ----------------------------------------------------------------------------#
+
+import bisect
+import datetime
+from collections import defaultdict, namedtuple
+
+# venue_id, artist_id, start (datetime) and ref, the caller's handle for the row (e.g. line number)
+Booking = namedtuple('Booking', ['venue_id', 'artist_id', 'start', 'ref'])
+
+# kind is 'venue', 'artist' or 'unavailable'; other is the ref of the booking it clashes with
+Conflict = namedtuple('Conflict', ['booking', 'kind', 'other'])
+
+
+class ScheduleIndex(object):
+    """Sorted starts per key; overlap checks and inserts are O(log n) searches."""
+
+    def __init__(self, duration):
+        self.duration = duration
+        self._starts = defaultdict(list)
+        self._refs = defaultdict(list)
+
+    def add(self, key, start, ref):
+        starts = self._starts[key]
+        i = bisect.bisect_right(starts, start)
+        starts.insert(i, start)
+        self._refs[key].insert(i, ref)
+
+    def overlapping(self, key, start):
+        """Returns the ref of a booking under `key` overlapping one starting at `start`, or None."""
+        starts = self._starts.get(key)
+        if not starts:
+            return None
+        i = bisect.bisect_left(starts, start)
+        if i < len(starts) and starts[i] - start < self.duration:
+            return self._refs[key][i]
+        if i > 0 and start - starts[i - 1] < self.duration:
+            return self._refs[key][i - 1]
+        return None
+
+
+class ScheduleValidator(object):
+    """Validates bookings against existing shows, artist calenders and each other.
+
+    existing_shows: iterable of Bookings already stored.
+    calender: set of (artist_id, date) the artists listed as available.
+    artists_with_calender: ids of artists with any calender entry; the others are available on all dates.
+    """
+
+    def __init__(self, existing_shows, calender, artists_with_calender, duration):
+        self.index = ScheduleIndex(duration)
+        self.calender = calender
+        self.artists_with_calender = artists_with_calender
+        for show in existing_shows:
+            self._add(show)
+
+    def _add(self, booking):
+        self.index.add(('venue', booking.venue_id), booking.start, booking.ref)
+        self.index.add(('artist', booking.artist_id), booking.start, booking.ref)
+
+    def check(self, booking):
+        """Returns the conflicts of one booking without recording it."""
+        conflicts = []
+        if booking.artist_id in self.artists_with_calender and \
+                (booking.artist_id, booking.start.date()) not in self.calender:
+            conflicts.append(Conflict(booking, 'unavailable', None))
+        for kind, key in (('venue', booking.venue_id), ('artist', booking.artist_id)):
+            other = self.index.overlapping((kind, key), booking.start)
+            if other is not None:
+                conflicts.append(Conflict(booking, kind, other))
+        return conflicts
+
+    def validate(self, bookings):
+        """Checks bookings in order, each one also against the accepted bookings before it."""
+        conflicts = []
+        for booking in bookings:
+            found = self.check(booking)
+            if found:
+                conflicts.extend(found)
+            else:
+                self._add(booking)
+        return conflicts
+
+
+def window(bookings, duration):
+    """Returns the (first, last) dates of stored shows that can overlap the bookings."""
+    margin = datetime.timedelta(days=duration.days + 1)
+    starts = [booking.start for booking in bookings]
+    return (min(starts) - margin).date(), (max(starts) + margin).date()
@@ -0,0 +1,187 @@
+# ----------------------------------------------------------------------------#
+# Database engine setup.
+#
+# SQLAlchemy below is Flask-SQLAlchemy's extension with the engine options
+# built from the DB_* settings in config.py, and with pool metrics: counts of
+# connects, checkouts and checkins for every engine, and for the default
+# QueuePool how long each checkout waited for a connection. Its sessions can
+# send reads to a replica bind, see RoutingSession.
+# ----------------------------------------------------------------------------#
+
+import random
+import threading
+import time
+
+import flask_sqlalchemy
+from sqlalchemy import event, exc, orm, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.pool import QueuePool, NullPool
+
+
+class PoolStats(object):
+    """Thread-safe pool counters, shared by all engines of the process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connects = self.checkouts = self.checkins = self.timeouts = 0
+            self.waits = 0
+            self.wait_total = self.wait_max = 0.0
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def record_wait(self, seconds, timed_out=False):
+        with self._lock:
+            self.waits += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'in_use': self.checkouts - self.checkins,
+                'timeouts': self.timeouts,
+                'wait_avg_ms': self.wait_total * 1000 / self.waits if self.waits else 0.0,
+                'wait_max_ms': self.wait_max * 1000,
+            }
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool recording the time every checkout spent getting a connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super(InstrumentedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            pool_stats.record_wait(time.perf_counter() - start, timed_out)
+
+
+PSYCOPG2_DRIVERS = ('postgres', 'postgresql', 'postgresql+psycopg2')
+
+
+def is_postgresql(url):
+    return url.drivername.split('+')[0] in ('postgres', 'postgresql')
+
+
+def engine_options(config, url):
+    """create_engine() arguments for `url` from the DB_* settings."""
+    if url.drivername.startswith('sqlite'):
+        # Flask-SQLAlchemy already picks the pool SQLite needs
+        return {}
+    options = {}
+    if config['DB_PGBOUNCER']:
+        # PgBouncer pools the server connections; keeping idle ones here as well only
+        # ties up its client slots
+        options['poolclass'] = NullPool
+    else:
+        options.update(
+            poolclass=InstrumentedQueuePool,
+            pool_size=config['DB_POOL_SIZE'],
+            max_overflow=config['DB_MAX_OVERFLOW'],
+            pool_timeout=config['DB_POOL_TIMEOUT'],
+            pool_recycle=config['DB_POOL_RECYCLE'],
+            pool_pre_ping=config['DB_POOL_PRE_PING'],
+        )
+    if url.drivername in PSYCOPG2_DRIVERS:
+        # One multi-row INSERT per executemany batch instead of a statement per row
+        options['executemany_mode'] = 'values'
+        if config['DB_STATEMENT_TIMEOUT_MS'] and not config['DB_PGBOUNCER']:
+            options['connect_args'] = {'options': '-c statement_timeout=%d' % config['DB_STATEMENT_TIMEOUT_MS']}
+    return options
+
+
+def instrument(engine, config):
+    for name, counter in (('connect', 'connects'), ('checkout', 'checkouts'), ('checkin', 'checkins')):
+        event.listen(engine, name, lambda *args, counter=counter: pool_stats.count(counter))
+    timeout = config['DB_STATEMENT_TIMEOUT_MS']
+    if timeout and config['DB_PGBOUNCER'] and is_postgresql(engine.url):
+        # Transaction pooling hands the server connection to other clients between
+        # transactions, so the timeout is set for each transaction only
+        @event.listens_for(engine, 'begin')
+        def set_statement_timeout(connection):
+            connection.execute(text('SET LOCAL statement_timeout = %d' % timeout))
+
+
+def insert_ignoring_conflicts(session, table):
+    """INSERT into `table` skipping rows that would violate a unique constraint, where the database allows."""
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return table.insert().prefix_with('OR IGNORE')
+    return table.insert()
+
+
+def pool_status(engine):
+    """pool_stats figures plus the current state of the engine's pool."""
+    status = pool_stats.snapshot()
+    pool = engine.pool
+    status['pool'] = type(pool).__name__
+    if isinstance(pool, QueuePool):
+        status.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+    return status
+
+
+class RoutingSession(flask_sqlalchemy.SignallingSession):
+    """Sends reads to one of the REPLICA_BINDS engines while info['read_only'] is set.
+
+    Flushes and INSERT/UPDATE/DELETE statements always go to the primary, and
+    after the first of them the rest of the session reads from the primary too,
+    so a request sees its own writes. A session keeps to one replica.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.info.get('read_only'):
+            if self._flushing or isinstance(clause, UpdateBase):
+                self.info['read_only'] = False
+            else:
+                replica = self.replica()
+                if replica is not None:
+                    return replica
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+    def replica(self):
+        binds = self.app.config.get('REPLICA_BINDS')
+        if not binds:
+            return None
+        if self.info.get('replica') not in binds:
+            self.info['replica'] = random.choice(binds)
+        return flask_sqlalchemy.get_state(self.app).db.get_engine(self.app, bind=self.info['replica'])
+
+
+class SQLAlchemy(flask_sqlalchemy.SQLAlchemy):
+    """Flask-SQLAlchemy configured from the DB_* settings, with routing sessions.
+
+    SQLALCHEMY_ENGINE_OPTIONS still takes precedence over the derived options.
+    """
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        super(SQLAlchemy, self).apply_driver_hacks(app, sa_url, options)
+        options.update(engine_options(app.config, sa_url))
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super(SQLAlchemy, self).create_engine(sa_url, engine_opts)
+        instrument(engine, self.get_app().config)
+        return engine
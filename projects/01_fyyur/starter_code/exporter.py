@@ -0,0 +1,59 @@
+# ----------------------------------------------------------------------------#
+# Streaming export writers.
+#
+# Turn an iterable of record dicts into CSV or newline-delimited JSON text,
+# yielded in chunks of roughly `chunk_size` characters, so a response or a
+# file can be written while the rows are still being fetched.
+# ----------------------------------------------------------------------------#
+
+import csv
+import datetime
+import io
+import json
+
+MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def _csv_value(value):
+    if isinstance(value, (list, tuple)):
+        return ','.join(str(item) for item in value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+
+def csv_chunks(fieldnames, records, chunk_size=65536):
+    """Yields a header line and then the records as CSV, lists joined with commas."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fieldnames)
+    for record in records:
+        writer.writerow([_csv_value(record[name]) for name in fieldnames])
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_chunks(fieldnames, records, chunk_size=65536):
+    """Yields one JSON object per record and line, with the keys in `fieldnames` order."""
+    lines, size = [], 0
+    for record in records:
+        line = json.dumps({name: record[name] for name in fieldnames}, default=_json_default)
+        lines.append(line)
+        size += len(line) + 1
+        if size >= chunk_size:
+            yield '\n'.join(lines) + '\n'
+            lines, size = [], 0
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+WRITERS = {'csv': csv_chunks, 'ndjson': ndjson_chunks}
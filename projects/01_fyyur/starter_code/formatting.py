@@ -0,0 +1,49 @@
+# ----------------------------------------------------------------------------#
+# Date formatting for templates.
+#
+# Works on the date and time objects read from the models instead of
+# re-parsing their string form, reuses compiled Babel patterns and Locale
+# objects, and memoizes recently formatted values.
+# ----------------------------------------------------------------------------#
+
+import datetime
+from functools import lru_cache
+
+import dateutil.parser
+from babel import Locale
+from babel.dates import LC_TIME, UTC, parse_pattern
+
+FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+    'small': "EE MM, dd, y",
+}
+
+
+@lru_cache(maxsize=64)
+def compiled_pattern(format):
+    return parse_pattern(FORMATS.get(format, format))
+
+
+def to_datetime(date, time=None):
+    """Combines a date and an optional time; strings are parsed as a fallback."""
+    if isinstance(date, datetime.datetime):
+        return date
+    if isinstance(date, datetime.date) and (time is None or isinstance(time, datetime.time)):
+        return datetime.datetime.combine(date, time or datetime.time.min)
+    return dateutil.parser.parse(str(date) + ' ' + str(time or ''))
+
+
+class DateTimeFormatter(object):
+    """Formats date/time pairs with the named FORMATS (or a Babel pattern) in one locale."""
+
+    def __init__(self, locale=LC_TIME, memo_size=4096):
+        self.locale = Locale.parse(locale)
+        self.format = lru_cache(maxsize=memo_size)(self._format)
+
+    def _format(self, date, time=None, format='medium'):
+        # Same result as babel.dates.format_datetime, which also treats naive values as UTC
+        value = to_datetime(date, time)
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=UTC)
+        return compiled_pattern(format).apply(value, self.locale)
@@ -0,0 +1,129 @@
+# ----------------------------------------------------------------------------#
+# Geocoding and radius search without a spatial database.
+#
+# Locations are geocoded from a local gazetteer of city centres and stored
+# with their geohash. Geohash cells sharing a prefix form a grid, so the rows
+# inside a cell are one range scan on an ordinary index over the geohash
+# column. A radius query reads the few cells covering its bounding box and
+# keeps the rows whose great-circle distance is within the radius.
+# ----------------------------------------------------------------------------#
+
+import csv
+import math
+import re
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+PRECISION = 12
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE_LATITUDE = math.pi * EARTH_RADIUS_MILES / 180
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    """Geohash of a point; longitudes outside [-180, 180) are wrapped."""
+    longitude = (longitude + 180) % 360 - 180
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, value, bits, even = [], 0, 0, True
+    while len(chars) < precision:
+        interval, coordinate = (lng_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        if coordinate >= middle:
+            value = value * 2 + 1
+            interval[0] = middle
+        else:
+            value *= 2
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            value, bits = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(degrees of latitude, degrees of longitude) spanned by a cell of the given precision."""
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** (5 * precision - lat_bits)
+
+
+def distance_miles(lat1, lng1, lat2, lng2):
+    """Great-circle (haversine) distance between two points."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, miles):
+    """(south, west, north, east) around the circle; west/east may pass +-180 and then wrap."""
+    dlat = miles / MILES_PER_DEGREE_LATITUDE
+    south, north = max(latitude - dlat, -90.0), min(latitude + dlat, 90.0)
+    if south == -90.0 or north == 90.0:
+        return south, -180.0, north, 180.0
+    # The circle is widest towards the pole side of the box
+    widest = math.cos(math.radians(max(abs(south), abs(north))))
+    dlng = miles / (MILES_PER_DEGREE_LATITUDE * widest)
+    if dlng >= 180:
+        return south, -180.0, north, 180.0
+    return south, longitude - dlng, north, longitude + dlng
+
+
+def covering_cells(latitude, longitude, miles, max_cells=16):
+    """Geohash prefixes of the cells covering the circle, at the finest precision needing at most `max_cells`."""
+    south, west, north, east = bounding_box(latitude, longitude, miles)
+    for precision in range(PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = int(round(180 / height))
+        columns = int(round(360 / width))
+        first_row, last_row = int((south + 90) // height), min(int((north + 90) // height), rows - 1)
+        first_column, last_column = int((west + 180) // width), int((east + 180) // width)
+        if last_column - first_column + 1 >= columns:
+            first_column, last_column = 0, columns - 1
+        if (last_row - first_row + 1) * (last_column - first_column + 1) <= max_cells:
+            break
+    cells = set()
+    for row in range(first_row, last_row + 1):
+        for column in range(first_column, last_column + 1):
+            # The centre of the cell, with columns past +-180 wrapped by encode
+            cells.add(encode((row + 0.5) * height - 90, (column + 0.5) * width - 180, precision))
+    return sorted(cells)
+
+
+def prefix_range(prefix):
+    """(low, high) such that low <= geohash < high holds exactly for geohashes starting with `prefix`.
+
+    high is None when there is no upper bound. Geohash characters sort the
+    same in byte order and in the usual collations, so the comparison can use
+    a plain index on the column.
+    """
+    chars = list(prefix)
+    while chars:
+        position = BASE32.index(chars[-1])
+        if position + 1 < len(BASE32):
+            chars[-1] = BASE32[position + 1]
+            return prefix, ''.join(chars)
+        chars.pop()
+    return prefix, None
+
+
+def place_key(city, state):
+    return re.sub(r'[^a-z0-9]+', ' ', ('%s %s' % (city or '', state or '')).lower()).strip()
+
+
+class Gazetteer(object):
+    """City centres read from a CSV file with city, state, latitude and longitude columns."""
+
+    def __init__(self, places=None):
+        self.places = places or {}
+
+    @classmethod
+    def load(cls, path):
+        places = {}
+        with open(path, newline='', encoding='utf-8') as fp:
+            for row in csv.DictReader(fp):
+                places[place_key(row['city'], row['state'])] = (float(row['latitude']), float(row['longitude']))
+        return cls(places)
+
+    def locate(self, city, state):
+        """(latitude, longitude) of a city, None when it is not listed."""
+        return self.places.get(place_key(city, state))
@@ -0,0 +1,143 @@
+# ----------------------------------------------------------------------------#
+# Bulk import helpers.
+#
+# Records are streamed from CSV, JSON array or newline-delimited JSON files
+# and handled in chunks, so memory use does not grow with the file. Every
+# record is validated with the same WTForms form the web pages use; the
+# loading itself (reference resolution and executemany inserts) lives with
+# the models in app.py, see the import-data command.
+# ----------------------------------------------------------------------------#
+
+import csv
+import io
+import json
+import os
+import sys
+import time
+from itertools import islice
+
+from werkzeug.datastructures import MultiDict
+
+WHITESPACE = ' \t\r\n'
+FORMATS = {'.csv': 'csv', '.json': 'json', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+
+def read_records(path, format=None):
+    """Yields (line number, record dict) pairs from a CSV, JSON or NDJSON file; '-' reads stdin."""
+    format = format or FORMATS.get(os.path.splitext(path)[1].lower())
+    if format not in FORMATS.values():
+        raise ValueError('Cannot tell the format of %s, pass one of csv, json, ndjson' % path)
+    fp = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8') if path == '-' else \
+        open(path, encoding='utf-8', newline='')
+    with fp:
+        if format == 'csv':
+            reader = csv.DictReader(fp)
+            for record in reader:
+                yield reader.line_num, record
+        elif format == 'ndjson':
+            for number, line in enumerate(fp, 1):
+                if line.strip():
+                    yield number, json.loads(line)
+        else:
+            for number, record in enumerate(iter_json_array(fp), 1):
+                yield number, record
+
+
+def iter_json_array(fp, chunk_size=65536):
+    """Yields the items of a top-level JSON array without reading the whole file at once."""
+    decoder = json.JSONDecoder()
+    state = {'buffer': '', 'position': 0}
+
+    def skip(characters):
+        # Moves past `characters`, reading on as needed; False at the end of the file
+        while True:
+            buffer, position = state['buffer'], state['position']
+            while position < len(buffer) and buffer[position] in characters:
+                position += 1
+            state['position'] = position
+            if position < len(buffer):
+                return True
+            more = fp.read(chunk_size)
+            if not more:
+                return False
+            state['buffer'], state['position'] = more, 0
+
+    if not skip(WHITESPACE) or state['buffer'][state['position']] != '[':
+        raise ValueError('Expected a JSON array')
+    state['position'] += 1
+    while True:
+        if not skip(WHITESPACE + ','):
+            raise ValueError('Unexpected end of JSON array')
+        if state['buffer'][state['position']] == ']':
+            return
+        while True:
+            buffer, position = state['buffer'], state['position']
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+                # Only a delimiter after it shows the value is complete: a number may go on
+                if end < len(buffer) and buffer[end] in WHITESPACE + ',]':
+                    break
+            except ValueError:
+                pass
+            more = fp.read(chunk_size)
+            if not more:
+                item, end = decoder.raw_decode(buffer, position)
+                break
+            state['buffer'], state['position'] = buffer[position:] + more, 0
+        state['position'] = end
+        yield item
+
+
+def chunks(iterable, size):
+    """Splits an iterable into lists of at most `size` items."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def form_errors(form_class, record, fields):
+    """Validates a record with a form, returning {field: [messages]} for the given fields.
+
+    Fields left out of the record are only reported when the form requires them, so that
+    optional links do not fail the URL validator just for being absent. Required fields
+    must be present even when the form has a default for them.
+    """
+    data = MultiDict()
+    for field in fields:
+        value = record.get(field)
+        if isinstance(value, (list, tuple)):
+            data.setlist(field, [str(item) for item in value])
+        elif value is not None and value != '':
+            data.add(field, str(value))
+    form = form_class(formdata=data, meta={'csrf': False})
+    form.validate()
+    errors = {field: messages for field, messages in form.errors.items()
+              if field in fields and (field in data or form[field].flags.required)}
+    for field in fields:
+        if field not in data and form[field].flags.required:
+            errors.setdefault(field, ['This field is required.'])
+    return errors
+
+
+class Progress(object):
+    """Reports rows read, loaded and rejected, with throughput, through `echo`."""
+
+    def __init__(self, label, echo, clock=time.perf_counter):
+        self.label = label
+        self.echo = echo
+        self.clock = clock
+        self.started = clock()
+        self.read = self.loaded = self.rejected = 0
+
+    def reject(self, number, errors):
+        self.rejected += 1
+        self.echo('%s line %d: %s' % (self.label, number, '; '.join(
+            '%s: %s' % (field, ' '.join(messages)) for field, messages in sorted(errors.items()))))
+
+    def report(self):
+        elapsed = max(self.clock() - self.started, 1e-9)
+        self.echo('%s: %d read, %d loaded, %d rejected, %.0f rows/s' % (
+            self.label, self.read, self.loaded, self.rejected, self.read / elapsed))
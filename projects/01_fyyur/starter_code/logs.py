@@ -0,0 +1,147 @@
+# ----------------------------------------------------------------------------#
+# Logging pipeline.
+#
+# Request threads only put records on a bounded in-memory queue; a
+# QueueListener thread formats them, as JSON lines or plain text, and writes
+# them to a rotating file. When the queue is full, records are dropped and
+# counted rather than blocking the request on the disk. Records below
+# WARNING can be sampled to thin out high-volume info logging.
+# ----------------------------------------------------------------------------#
+
+import atexit
+import copy
+import datetime
+import json
+import logging
+import queue
+import random
+import threading
+from collections import Counter
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record, with the traceback as a string under 'exception'."""
+
+    def format(self, record):
+        data = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName,
+        }
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Passes records below WARNING with probability `rate`, and every other record."""
+
+    def __init__(self, rate, random=random.random):
+        super(SamplingFilter, self).__init__()
+        self.rate = rate
+        self.random = random
+        self.sampled_out = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1 or self.random() < self.rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class BoundedQueueHandler(QueueHandler):
+    """QueueHandler that drops and counts records while its queue is full instead of blocking."""
+
+    def __init__(self, maxsize):
+        super(BoundedQueueHandler, self).__init__(queue.Queue(maxsize))
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.dropped = Counter()
+
+    def prepare(self, record):
+        # Only the message and traceback are rendered here, on the logging thread, since the
+        # arguments may change once it returns; the listener does the formatting proper
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped[record.levelname] += 1
+        else:
+            with self._lock:
+                self.queued += 1
+
+
+class LogPipeline(object):
+    """A BoundedQueueHandler feeding `handler` from a listener thread."""
+
+    def __init__(self, handler, queue_size=10000, sample_rate=1.0):
+        self.handler = handler
+        self.queue_handler = BoundedQueueHandler(queue_size)
+        self.sampling = SamplingFilter(sample_rate)
+        self.queue_handler.addFilter(self.sampling)
+        self.listener = QueueListener(self.queue_handler.queue, handler, respect_handler_level=True)
+        self.running = False
+
+    def start(self):
+        if not self.running:
+            self.listener.start()
+            self.running = True
+
+    def stop(self):
+        # Writes out whatever is still queued
+        if self.running:
+            self.listener.stop()
+            self.running = False
+        self.handler.close()
+
+    def stats(self):
+        with self.queue_handler._lock:
+            return {
+                'queued': self.queue_handler.queued,
+                'dropped': dict(self.queue_handler.dropped),
+                'sampled_out': self.sampling.sampled_out,
+                'pending': self.queue_handler.queue.qsize(),
+            }
+
+
+def file_handler(config):
+    """Handler rotating LOG_FILE at LOG_ROTATE_WHEN when set, else once it reaches LOG_MAX_BYTES."""
+    if config['LOG_ROTATE_WHEN']:
+        handler = TimedRotatingFileHandler(config['LOG_FILE'], when=config['LOG_ROTATE_WHEN'],
+                                           backupCount=config['LOG_BACKUP_COUNT'], utc=True, delay=True)
+    else:
+        handler = RotatingFileHandler(config['LOG_FILE'], maxBytes=config['LOG_MAX_BYTES'],
+                                      backupCount=config['LOG_BACKUP_COUNT'], delay=True)
+    handler.setFormatter(JSONFormatter() if config['LOG_FORMAT'] == 'json' else logging.Formatter(TEXT_FORMAT))
+    return handler
+
+
+def init_app(app):
+    """Sends the app's log records to LOG_FILE through a LogPipeline, outside of debug mode."""
+    if app.debug or not app.config['LOG_FILE']:
+        return None
+    config = app.config
+    pipeline = LogPipeline(file_handler(config), config['LOG_QUEUE_SIZE'], config['LOG_INFO_SAMPLE_RATE'])
+    app.logger.setLevel(config['LOG_LEVEL'])
+    app.logger.addHandler(pipeline.queue_handler)
+    pipeline.start()
+    atexit.register(pipeline.stop)
+    return pipeline
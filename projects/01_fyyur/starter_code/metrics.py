@@ -0,0 +1,172 @@
+# ----------------------------------------------------------------------------#
+# Request metrics.
+#
+# init_app times every request and splits it into database time, template
+# rendering and the rest, the view's own Python code, then records the
+# figures in histograms labelled by route. render() writes them out in the
+# Prometheus text format. Requests slower than SLOW_REQUEST_MS are logged
+# with their parameters and the statements that took the most time.
+#
+# Figures are kept per process; with several workers, each must be scraped.
+# The body of a streamed response is produced after the request is recorded
+# and does not count towards it.
+# ----------------------------------------------------------------------------#
+
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, has_request_context, request
+from jinja2 import Template
+
+import profiler
+
+# Upper bounds in seconds, from 1 ms up to 10 s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+    """Thread-safe Prometheus histogram with one series per combination of label values."""
+
+    def __init__(self, name, help, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def lines(self):
+        yield '# HELP %s %s' % (self.name, self.help)
+        yield '# TYPE %s histogram' % self.name
+        with self._lock:
+            series = sorted((labels, list(counts), total, count) for labels, (counts, total, count)
+                            in self._series.items())
+        for labels, counts, total, count in series:
+            pairs = ['%s="%s"' % (name, _escape(value)) for name, value in zip(self.labelnames, labels)]
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield '%s_bucket{%s} %d' % (self.name, ','.join(pairs + ['le="%g"' % bound]), cumulative)
+            yield '%s_bucket{%s} %d' % (self.name, ','.join(pairs + ['le="+Inf"']), count)
+            yield '%s_sum{%s} %.6f' % (self.name, ','.join(pairs), total)
+            yield '%s_count{%s} %d' % (self.name, ','.join(pairs), count)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+request_duration = Histogram(
+    'fyyur_request_duration_seconds', 'Time from the first before_request hook to the response.',
+    ('route', 'method', 'status'))
+request_phase = Histogram(
+    'fyyur_request_phase_seconds', 'Request time spent in SQL statements (db), rendering templates '
+    '(template) and the rest of the Python code (view).', ('route', 'phase'))
+request_statements = Histogram(
+    'fyyur_request_sql_statements', 'SQL statements run per request.', ('route',),
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100))
+
+REGISTRY = [request_duration, request_phase, request_statements]
+
+
+def render():
+    """All histograms in the Prometheus text exposition format."""
+    return '\n'.join(line for histogram in REGISTRY for line in histogram.lines()) + '\n'
+
+
+def clear():
+    for histogram in REGISTRY:
+        histogram.clear()
+
+
+class TimedTemplate(Template):
+    """Template adding its render time, less the SQL run meanwhile, to the request's template time.
+
+    Only top-level renders go through render(); extended and included templates are
+    counted as part of the template that uses them.
+    """
+
+    def render(self, *args, **kwargs):
+        timing = has_request_context() and g.get('request_timing')
+        if not timing:
+            return super(TimedTemplate, self).render(*args, **kwargs)
+        start, db_start = time.perf_counter(), timing.profile.db_time
+        try:
+            return super(TimedTemplate, self).render(*args, **kwargs)
+        finally:
+            timing.template += time.perf_counter() - start - (timing.profile.db_time - db_start)
+
+
+class RequestTiming(object):
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.profile = profiler.start()
+        self.template = 0.0
+
+
+def route_name():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def slow_request_message(timing, total, response, top):
+    lines = ['Slow request %s %s %s: %.1f ms (db %.1f ms in %d statements, template %.1f ms)' % (
+        request.method, route_name(), response.status_code, total * 1000, timing.profile.db_time * 1000,
+        timing.profile.count, timing.template * 1000)]
+    if request.view_args:
+        lines.append('  view args: %r' % (request.view_args,))
+    if request.args:
+        lines.append('  query: %s' % request.query_string.decode('utf-8', 'replace'))
+    for count, seconds, text in timing.profile.slowest_shapes(top):
+        lines.append('  %.1f ms in %d x %s' % (seconds * 1000, count, text[:300]))
+    return '\n'.join(lines)
+
+
+def init_app(app):
+    app.jinja_env.template_class = TimedTemplate
+
+    @app.before_request
+    def start_request_timing():
+        g.request_timing = RequestTiming()
+
+    @app.after_request
+    def record_request_timing(response):
+        timing = g.pop('request_timing', None)
+        if timing is None:
+            return response
+        profiler.stop(timing.profile)
+        total = time.perf_counter() - timing.start
+        route = route_name()
+        db_time = timing.profile.db_time
+        request_duration.observe((route, request.method, str(response.status_code)), total)
+        request_phase.observe((route, 'db'), db_time)
+        request_phase.observe((route, 'template'), timing.template)
+        request_phase.observe((route, 'view'), max(total - db_time - timing.template, 0.0))
+        request_statements.observe((route,), timing.profile.count)
+        slow = app.config['SLOW_REQUEST_MS']
+        if slow and total * 1000 >= slow:
+            app.logger.warning(slow_request_message(
+                timing, total, response, app.config['SLOW_REQUEST_TOP_QUERIES']))
+        return response
+
+    @app.teardown_request
+    def drop_request_timing(error=None):
+        timing = g.pop('request_timing', None)
+        if timing is not None:
+            profiler.stop(timing.profile)
@@ -0,0 +1,24 @@
+"""index shows by start date, time and id
+
+Revision ID: 5c1e8a7d3f20
+Revises: 2e6b4005b1c2
+Create Date: 2026-10-18 09:12:04.118260
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1e8a7d3f20'
+down_revision = '2e6b4005b1c2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_shows_start', 'shows', ['start_date', 'start_time', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_shows_start', table_name='shows')
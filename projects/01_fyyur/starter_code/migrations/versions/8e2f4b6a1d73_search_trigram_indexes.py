@@ -0,0 +1,40 @@
+"""trigram search indexes for venues and artists
+
+Revision ID: 8e2f4b6a1d73
+Revises: 5c1e8a7d3f20
+Create Date: 2026-10-18 10:02:41.550913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e2f4b6a1d73'
+down_revision = '5c1e8a7d3f20'
+branch_labels = None
+depends_on = None
+
+# Must match search.search_document() for the planner to use the indexes
+SEARCH_DOCUMENT = "lower(coalesce(name, '') || ' ' || coalesce(city, '') || ' ' || " \
+                  "coalesce(state, '') || ' ' || coalesce(genres, ''))"
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        # Other databases search through the in-process fallback index
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table in ('Venue', 'Artist'):
+        op.execute('CREATE INDEX ix_{0}_search_trgm ON "{1}" USING gin ({2} gin_trgm_ops)'.format(
+            table.lower(), table, SEARCH_DOCUMENT))
+        op.execute('CREATE INDEX ix_{0}_name_trgm ON "{1}" USING gin (lower(name) gin_trgm_ops)'.format(
+            table.lower(), table))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in ('Venue', 'Artist'):
+        op.drop_index('ix_{0}_search_trgm'.format(table.lower()), table_name=table)
+        op.drop_index('ix_{0}_name_trgm'.format(table.lower()), table_name=table)
@@ -0,0 +1,34 @@
+"""venue and artist locations with a geohash index for radius searches
+
+Revision ID: a7d3e9c5b214
+Revises: f3a9d2c6b817
+Create Date: 2026-10-18 19:04:51.220386
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d3e9c5b214'
+down_revision = 'f3a9d2c6b817'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled in afterwards by `flask geocode`
+    for table in ('Venue', 'Artist'):
+        op.add_column(table, sa.Column('latitude', sa.Float(), nullable=True))
+        op.add_column(table, sa.Column('longitude', sa.Float(), nullable=True))
+        op.add_column(table, sa.Column('geohash', sa.String(length=12), nullable=True))
+        op.create_index('ix_{0}_geohash'.format(table), table, ['geohash'], unique=False)
+
+
+def downgrade():
+    for table in ('Venue', 'Artist'):
+        op.drop_index('ix_{0}_geohash'.format(table), table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('geohash')
+            batch_op.drop_column('longitude')
+            batch_op.drop_column('latitude')
@@ -0,0 +1,87 @@
+"""move genres into a genres table with venue and artist associations
+
+Revision ID: b71d09c4e5a2
+Revises: 8e2f4b6a1d73
+Create Date: 2026-10-18 11:20:57.034118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b71d09c4e5a2'
+down_revision = '8e2f4b6a1d73'
+branch_labels = None
+depends_on = None
+
+# Must match search.search_document() for the planner to use the indexes
+OLD_SEARCH_DOCUMENT = "lower(coalesce(name, '') || ' ' || coalesce(city, '') || ' ' || " \
+                      "coalesce(state, '') || ' ' || coalesce(genres, ''))"
+SEARCH_DOCUMENT = "lower(coalesce(name, '') || ' ' || coalesce(city, '') || ' ' || coalesce(state, ''))"
+
+OWNERS = (('Venue', 'venue_genres', 'venue_id'), ('Artist', 'artist_genres', 'artist_id'))
+
+
+def create_search_index(table, document):
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_{0}_search_trgm'.format(table.lower()))
+        op.execute('CREATE INDEX ix_{0}_search_trgm ON "{1}" USING gin ({2} gin_trgm_ops)'.format(
+            table.lower(), table, document))
+
+
+def upgrade():
+    genres = op.create_table('genres',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    for table, association, owner_id in OWNERS:
+        op.create_table(association,
+        sa.Column('genre_id', sa.Integer(), nullable=False),
+        sa.Column(owner_id, sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['genre_id'], ['genres.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint([owner_id], [table + '.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('genre_id', owner_id)
+        )
+        op.create_index('ix_{0}_{1}'.format(association, owner_id), association, [owner_id], unique=False)
+
+    # Backfill from the comma-joined strings
+    conn = op.get_bind()
+    split = {}
+    for table, association, owner_id in OWNERS:
+        rows = conn.execute(sa.text('SELECT id, genres FROM "{0}" WHERE genres IS NOT NULL'.format(table)))
+        split[table] = [(row_id, [g.strip() for g in value.split(',') if g.strip()]) for row_id, value in rows]
+    names = sorted({name for rows in split.values() for _, row_genres in rows for name in row_genres})
+    if names:
+        op.bulk_insert(genres, [{'name': name} for name in names])
+    genre_ids = dict((name, genre_id) for genre_id, name in conn.execute(sa.text('SELECT id, name FROM genres')))
+    for table, association, owner_id in OWNERS:
+        links = {(genre_ids[name], row_id) for row_id, row_genres in split[table] for name in row_genres}
+        if links:
+            op.bulk_insert(sa.table(association, sa.column('genre_id'), sa.column(owner_id)),
+                           [{'genre_id': genre_id, owner_id: row_id} for genre_id, row_id in sorted(links)])
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('genres')
+        create_search_index(table, SEARCH_DOCUMENT)
+
+
+def downgrade():
+    conn = op.get_bind()
+    op.add_column('Venue', sa.Column('genres', sa.String(length=500), nullable=True))
+    op.add_column('Artist', sa.Column('genres', sa.String(length=120), nullable=True))
+    for table, association, owner_id in OWNERS:
+        rows = conn.execute(sa.text(
+            'SELECT a.{0}, g.name FROM {1} a JOIN genres g ON g.id = a.genre_id ORDER BY a.{0}, g.name'.format(
+                owner_id, association)))
+        joined = {}
+        for row_id, name in rows:
+            joined.setdefault(row_id, []).append(name)
+        for row_id, row_genres in joined.items():
+            conn.execute(sa.text('UPDATE "{0}" SET genres = :genres WHERE id = :id'.format(table)),
+                         genres=','.join(row_genres), id=row_id)
+        create_search_index(table, OLD_SEARCH_DOCUMENT)
+        op.drop_index('ix_{0}_{1}'.format(association, owner_id), table_name=association)
+        op.drop_table(association)
+    op.drop_table('genres')
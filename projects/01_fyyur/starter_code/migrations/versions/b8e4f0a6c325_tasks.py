@@ -0,0 +1,42 @@
+"""background task queue
+
+Revision ID: b8e4f0a6c325
+Revises: a7d3e9c5b214
+Create Date: 2026-10-18 21:37:12.604118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8e4f0a6c325'
+down_revision = 'a7d3e9c5b214'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'tasks',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=120), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('idempotency_key', sa.String(length=200), nullable=True),
+        sa.Column('status', sa.String(length=10), nullable=False),
+        sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('max_attempts', sa.Integer(), nullable=False),
+        sa.Column('run_at', sa.DateTime(), nullable=False),
+        sa.Column('locked_until', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('idempotency_key')
+    )
+    op.create_index('ix_tasks_status_run_at', 'tasks', ['status', 'run_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_tasks_status_run_at', table_name='tasks')
+    op.drop_table('tasks')
@@ -0,0 +1,29 @@
+"""one calender row per artist and date
+
+Revision ID: c3a5f8e21b6d
+Revises: b71d09c4e5a2
+Create Date: 2026-10-18 12:41:09.662480
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a5f8e21b6d'
+down_revision = 'b71d09c4e5a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep the oldest row of any duplicated (artist_id, date) pair
+    op.execute('DELETE FROM calender WHERE id NOT IN '
+               '(SELECT min(id) FROM calender GROUP BY artist_id, date)')
+    with op.batch_alter_table('calender') as batch_op:
+        batch_op.create_unique_constraint('uq_calender_artist_date', ['artist_id', 'date'])
+
+
+def downgrade():
+    with op.batch_alter_table('calender') as batch_op:
+        batch_op.drop_constraint('uq_calender_artist_date', type_='unique')
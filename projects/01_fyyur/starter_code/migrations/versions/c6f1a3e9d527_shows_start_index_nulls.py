@@ -0,0 +1,29 @@
+"""order shows without a date or time in the shows feed index
+
+Revision ID: c6f1a3e9d527
+Revises: b8e4f0a6c325
+Create Date: 2026-10-18 23:05:41.337902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6f1a3e9d527'
+down_revision = 'b8e4f0a6c325'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_index('ix_shows_start', table_name='shows')
+    op.create_index('ix_shows_start', 'shows', [
+        sa.text("coalesce(start_date, '9999-12-31')"),
+        sa.text("coalesce(start_time, '00:00:00.000000')"),
+        'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_shows_start', table_name='shows')
+    op.create_index('ix_shows_start', 'shows', ['start_date', 'start_time', 'id'], unique=False)
@@ -0,0 +1,25 @@
+"""index shows by venue and start for the double-booking check
+
+Revision ID: d94e7b3c0f18
+Revises: c3a5f8e21b6d
+Create Date: 2026-10-18 13:27:45.918302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd94e7b3c0f18'
+down_revision = 'c3a5f8e21b6d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Availability lookups use the unique (artist_id, date) index on calender
+    op.create_index('ix_shows_venue_start', 'shows', ['venue_id', 'start_date', 'start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_shows_venue_start', table_name='shows')
@@ -0,0 +1,42 @@
+"""materialized upcoming/past show counters on venues and artists
+
+Revision ID: e2b6c4d81a95
+Revises: d94e7b3c0f18
+Create Date: 2026-10-18 14:48:13.370254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b6c4d81a95'
+down_revision = 'd94e7b3c0f18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('show_counts_state',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('counted_on', sa.Date(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    for table, owner_id in (('Venue', 'venue_id'), ('Artist', 'artist_id')):
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.execute(
+            'UPDATE "{0}" SET '
+            'upcoming_shows_count = (SELECT count(*) FROM shows WHERE shows.{1} = "{0}".id '
+            'AND shows.start_date >= CURRENT_DATE), '
+            'past_shows_count = (SELECT count(*) FROM shows WHERE shows.{1} = "{0}".id '
+            'AND shows.start_date < CURRENT_DATE)'.format(table, owner_id))
+    op.execute('INSERT INTO show_counts_state (id, counted_on) VALUES (1, CURRENT_DATE)')
+
+
+def downgrade():
+    for table in ('Venue', 'Artist'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('past_shows_count')
+            batch_op.drop_column('upcoming_shows_count')
+    op.drop_table('show_counts_state')
@@ -0,0 +1,33 @@
+"""row version and updated_at columns for the JSON API ETags
+
+Revision ID: f3a9d2c6b817
+Revises: e2b6c4d81a95
+Create Date: 2026-10-18 15:32:07.518843
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9d2c6b817'
+down_revision = 'e2b6c4d81a95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('Venue', 'Artist', 'shows'):
+        op.add_column(table, sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+        # Added nullable and backfilled, as not every database accepts a non-constant default here
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.execute('UPDATE "{0}" SET updated_at = CURRENT_TIMESTAMP'.format(table))
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    for table in ('Venue', 'Artist', 'shows'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
+            batch_op.drop_column('version')
@@ -0,0 +1,204 @@
+# ----------------------------------------------------------------------------#
+# SQL profiler.
+#
+# Records the statements run while a Profile is active through SQLAlchemy's
+# engine events, on every engine. With SQL_PROFILER on, init_app profiles
+# each request: it logs a summary line with the statement count, database
+# time, duplicated statements and statement shapes repeated often enough to
+# suggest an N+1 pattern, and checks the request against its query budget.
+# Statements run while a streamed response body is generated are not counted.
+#
+# Loaded as a pytest plugin (pytest -p profiler --query-budget N) it turns
+# budget overruns into errors, failing the tests that cause them.
+# ----------------------------------------------------------------------------#
+
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_local = threading.local()
+_installed = []
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\bIN \((?:\s*\?\s*,)*\s*\?\s*\)', re.IGNORECASE)
+_SPACES = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def shape(statement):
+    """The statement with literals and IN lists abstracted, to group queries differing only in values."""
+    statement = _LITERALS.sub('?', statement)
+    statement = _IN_LISTS.sub('IN (?...)', statement)
+    return _SPACES.sub(' ', statement).strip()
+
+
+class Profile(object):
+    """Statements recorded while active, as (statement, parameters, seconds) triples."""
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def db_time(self):
+        return sum(seconds for _, _, seconds in self.statements)
+
+    def duplicates(self):
+        """Number of statements that repeated an earlier one with the same parameters."""
+        seen = Counter((statement, repr(parameters)) for statement, parameters, _ in self.statements)
+        return sum(count - 1 for count in seen.values())
+
+    def repeated_shapes(self, threshold):
+        """(count, shape) of the statement shapes run at least `threshold` times, most frequent first."""
+        shapes = Counter(shape(statement) for statement, _, _ in self.statements)
+        return sorted(((count, text) for text, count in shapes.items() if count >= threshold), reverse=True)
+
+    def slowest_shapes(self, limit):
+        """(count, seconds, shape) of the `limit` statement shapes that took the most time in total."""
+        shapes = {}
+        for statement, _, seconds in self.statements:
+            entry = shapes.setdefault(shape(statement), [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+        return sorted(((count, seconds, text) for text, (count, seconds) in shapes.items()),
+                      key=lambda item: item[1], reverse=True)[:limit]
+
+    def summary(self, threshold):
+        text = '%d statements in %.1f ms, %d duplicated' % (self.count, self.db_time * 1000, self.duplicates())
+        for count, text_shape in self.repeated_shapes(threshold):
+            text += '; possible N+1: %d x %s' % (count, text_shape[:200])
+        return text
+
+    def report(self):
+        return '\n'.join(statement for statement, _, _ in self.statements)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, 'profiles', None):
+        _local.started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profiles = getattr(_local, 'profiles', None)
+    if profiles:
+        seconds = time.perf_counter() - getattr(_local, 'started', time.perf_counter())
+        for profile in profiles:
+            profile.statements.append((statement, parameters, seconds))
+
+
+def install():
+    # The listeners cost a thread-local lookup per statement, so they are only added once needed
+    if not _installed:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _installed.append(True)
+
+
+def start():
+    install()
+    profile = Profile()
+    if not hasattr(_local, 'profiles'):
+        _local.profiles = []
+    _local.profiles.append(profile)
+    return profile
+
+
+def stop(profile):
+    if profile in getattr(_local, 'profiles', ()):
+        _local.profiles.remove(profile)
+    return profile
+
+
+@contextmanager
+def capture():
+    """Records the statements run in the block on this thread."""
+    profile = start()
+    try:
+        yield profile
+    finally:
+        stop(profile)
+
+
+@contextmanager
+def ignored():
+    """Leaves the statements run in the block out of the active profiles, for once-a-day
+    housekeeping that would otherwise count against whichever request triggered it."""
+    profiles = getattr(_local, 'profiles', [])
+    _local.profiles = []
+    try:
+        yield
+    finally:
+        _local.profiles = profiles
+
+
+def query_budget(limit):
+    """Sets the most statements a view may run per request, overriding SQL_QUERY_BUDGET."""
+    def decorate(view):
+        view.query_budget = limit
+        return view
+    return decorate
+
+
+def init_app(app):
+    @app.before_request
+    def start_request_profile():
+        if app.config['SQL_PROFILER']:
+            g.sql_profile = start()
+
+    @app.after_request
+    def end_request_profile(response):
+        profile = g.pop('sql_profile', None)
+        if profile is None:
+            return response
+        stop(profile)
+        app.logger.info('SQL %s %s %s: %s', request.method, request.path, response.status_code,
+                        profile.summary(app.config['SQL_PROFILER_REPEAT_THRESHOLD']))
+        view = app.view_functions.get(request.endpoint)
+        # A view's own budget of 0 allows no statements; SQL_QUERY_BUDGET 0 checks nothing
+        budget = getattr(view, 'query_budget', None)
+        if budget is None:
+            budget = app.config['SQL_QUERY_BUDGET'] or None
+        if budget is not None and profile.count > budget:
+            message = '%s %s ran %d SQL statements, over its budget of %d:\n%s' % (
+                request.method, request.path, profile.count, budget, profile.report())
+            if app.config['SQL_PROFILER_STRICT']:
+                raise QueryBudgetExceeded(message)
+            app.logger.warning(message)
+        return response
+
+    @app.teardown_request
+    def drop_request_profile(error=None):
+        # after_request is skipped when the view raised
+        stop(g.pop('sql_profile', None))
+
+
+# ----------------------------------------------------------------------------#
+# pytest plugin.
+# ----------------------------------------------------------------------------#
+
+
+def pytest_addoption(parser):
+    parser.getgroup('fyyur').addoption(
+        '--query-budget', type=int, default=None, metavar='N',
+        help='Fail requests running more than N SQL statements, or more than their view\'s own '
+             '@query_budget; 0 checks the views\' own budgets only.')
+
+
+def pytest_configure(config):
+    budget = config.getoption('query_budget', None)
+    if budget is not None:
+        # Read by config.py when the app is imported
+        os.environ.update(SQL_PROFILER='1', SQL_PROFILER_STRICT='1', SQL_QUERY_BUDGET=str(budget))
@@ -0,0 +1,145 @@
+# ----------------------------------------------------------------------------#
+# Search for venues and artists.
+#
+# On PostgreSQL the query runs against trigram GIN indexes (see the
+# search indexes migration), also matches the names of related tags
+# (genres), and returns the total count together with the requested page
+# through a window function. Other databases, SQLite in tests,
+# use an in-process trigram index that is rebuilt after writes.
+# ----------------------------------------------------------------------------#
+
+import threading
+from collections import defaultdict, namedtuple
+
+from sqlalchemy import func, case, or_, literal_column
+
+SearchResult = namedtuple('SearchResult', ['count', 'data', 'page', 'per_page'])
+
+
+def search(session, model, term, fields, tags=None, page=1, per_page=20):
+    """Returns the `page` of `model` rows matching `term` in any of `fields` or the names
+    of the `tags` relationship, best matches first."""
+    term = term.strip().lower()
+    page = max(page, 1)
+    if session.get_bind().dialect.name == 'postgresql':
+        return _search_postgresql(session, model, term, fields, tags, page, per_page)
+    return _search_fallback(session, model, term, fields, tags, page, per_page)
+
+
+def search_document(model, fields):
+    # Must render exactly like the indexed expression in the search indexes migration,
+    # hence literal columns rather than bound parameters
+    empty, space = literal_column("''"), literal_column("' '")
+    document = func.coalesce(getattr(model, fields[0]), empty)
+    for field in fields[1:]:
+        document = document.op('||')(space).op('||')(func.coalesce(getattr(model, field), empty))
+    return func.lower(document)
+
+
+def _search_postgresql(session, model, term, fields, tags, page, per_page):
+    name = func.lower(model.name)
+    name_match = case([(name.startswith(term, autoescape=True), 2),
+                       (name.contains(term, autoescape=True), 1)], else_=0)
+    condition = search_document(model, fields).contains(term, autoescape=True)
+    if tags is not None:
+        tag = tags.property.mapper.class_
+        condition = or_(condition, tags.any(func.lower(tag.name).contains(term, autoescape=True)))
+    query = session.query(model, func.count().over().label('total')) \
+        .filter(condition) \
+        .order_by(name_match.desc(), func.similarity(name, term).desc(), model.name, model.id) \
+        .offset((page - 1) * per_page).limit(per_page)
+    rows = query.all()
+    if rows:
+        count = rows[0].total
+    elif page > 1:
+        # Paged past the end, the window count is not available without rows
+        count = session.query(func.count(model.id)).filter(condition).scalar()
+    else:
+        count = 0
+    return SearchResult(count, [row[0] for row in rows], page, per_page)
+
+
+def _search_fallback(session, model, term, fields, tags, page, per_page):
+    ids = _fallback_index(session, model, fields, tags).search(term)
+    page_ids = ids[(page - 1) * per_page:page * per_page]
+    data = []
+    if page_ids:
+        by_id = {row.id: row for row in session.query(model).filter(model.id.in_(page_ids))}
+        data = [by_id[i] for i in page_ids if i in by_id]
+    return SearchResult(len(ids), data, page, per_page)
+
+
+# ----------------------------------------------------------------------------#
+# In-process fallback index.
+# ----------------------------------------------------------------------------#
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex(object):
+    """Maps every trigram of a row's search document to the ids of rows containing it."""
+
+    def __init__(self, rows, tags=()):
+        # rows: iterable of (id, name, *other fields), tags: iterable of (id, tag name)
+        tag_names = defaultdict(list)
+        for row_id, tag_name in tags:
+            tag_names[row_id].append(tag_name)
+        self.names = {}
+        self.documents = {}
+        self.postings = defaultdict(set)
+        for row in rows:
+            row_id, name = row[0], (row[1] or '').lower()
+            document = ' '.join([value or '' for value in row[1:]] + tag_names[row_id]).lower()
+            self.names[row_id] = name
+            self.documents[row_id] = document
+            for gram in trigrams(document):
+                self.postings[gram].add(row_id)
+
+    def search(self, term):
+        """Returns the ids of matching rows, name prefix matches first, then name matches, then the rest."""
+        grams = trigrams(term)
+        if grams:
+            postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+            candidates = set.intersection(*postings)
+        else:
+            candidates = self.documents.keys()
+        hits = []
+        for row_id in candidates:
+            if term in self.documents[row_id]:
+                name = self.names[row_id]
+                rank = 2 if name.startswith(term) else 1 if term in name else 0
+                hits.append((-rank, name, row_id))
+        hits.sort()
+        return [row_id for _, _, row_id in hits]
+
+
+_indexes = {}
+_generations = defaultdict(int)
+_lock = threading.Lock()
+
+
+def _fallback_index(session, model, fields, tags):
+    key = (model, str(session.get_bind().url))
+    index = _indexes.get(key)
+    if index is None:
+        generation = _generations[model]
+        columns = [model.id] + [getattr(model, field) for field in fields]
+        tag_rows = ()
+        if tags is not None:
+            tag_rows = session.query(model.id, tags.property.mapper.class_.name).join(tags)
+        index = TrigramIndex(session.query(*columns), tag_rows)
+        with _lock:
+            # A write that landed while building makes this index stale; keep it for this search only
+            if _generations[model] == generation:
+                _indexes[key] = index
+    return index
+
+
+def invalidate(model):
+    """Drops the fallback indexes of `model`; they are rebuilt on the next search."""
+    with _lock:
+        _generations[model] += 1
+        for key in [key for key in _indexes if key[0] is model]:
+            del _indexes[key]
@@ -0,0 +1,202 @@
+# ----------------------------------------------------------------------------#
+# Background tasks, with the application database as the broker.
+#
+# enqueue() inserts a row into the tasks table within the caller's
+# transaction, so a task exists exactly when the write asking for it was
+# committed. Workers, `flask worker` or threads started in the web process,
+# claim due rows by moving them to 'running' under a lease and run the
+# registered function; its writes and the 'done' mark are committed
+# together. A failing task is retried with exponential backoff until it has
+# made max_attempts attempts, and the task of a worker that died is claimed
+# again once its lease expires. A task enqueued with an idempotency key is
+# only enqueued once per key.
+#
+# On PostgreSQL, workers claim with SELECT ... FOR UPDATE SKIP LOCKED and
+# never wait on each other; elsewhere each claim is an UPDATE conditional on
+# the row being unchanged since it was read. A task can still run twice, when
+# its lease runs out while it is running, so tasks should be idempotent.
+# ----------------------------------------------------------------------------#
+
+import datetime
+import json
+import threading
+import traceback
+from collections import Counter
+
+from sqlalchemy import and_, or_, select, func
+
+from database import insert_ignoring_conflicts
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+def retry_delay(attempts, base, cap):
+    """Seconds to wait before the next attempt, after `attempts` failed ones."""
+    return min(base * 2 ** (attempts - 1), cap)
+
+
+class TaskQueue(object):
+    """Queue of the rows of `model` in `db`, running the functions registered with task()."""
+
+    def __init__(self, app, db, model, now=datetime.datetime.utcnow):
+        self.app = app
+        self.db = db
+        self.table = model.__table__
+        self.now = now
+        self.functions = {}
+        self._thread = None
+        self._threads = 0
+        self._stop = threading.Event()
+
+    @property
+    def config(self):
+        return self.app.config
+
+    def task(self, name=None):
+        """Registers the decorated function as the task `name`, by default its own name.
+
+        The function is called with the payload as keyword arguments. Its writes
+        go through db.session and are committed by the queue, not by the function.
+        """
+        def register(function):
+            self.functions[name or function.__name__] = function
+            return function
+        return register
+
+    def enqueue(self, name, key=None, delay=0, **payload):
+        """Adds a task to the session's transaction; False when a task with the same key exists."""
+        if name not in self.functions:
+            raise LookupError('No task named %r' % name)
+        session = self.db.session
+        statement = insert_ignoring_conflicts(session, self.table) if key else self.table.insert()
+        now = self.now()
+        result = session.execute(statement.values(
+            name=name, payload=json.dumps(payload), idempotency_key=key, status=QUEUED, attempts=0,
+            max_attempts=self.config['TASKS_MAX_ATTEMPTS'], run_at=now + datetime.timedelta(seconds=delay),
+            created_at=now))
+        return result.rowcount == 1
+
+    def claim(self, limit):
+        """Moves up to `limit` due tasks to 'running' under a lease and returns their rows."""
+        table, session, now = self.table, self.db.session, self.now()
+        # Tasks whose worker died during their last attempt are not tried again
+        session.execute(table.update().where(and_(
+            table.c.status == RUNNING, table.c.locked_until < now, table.c.attempts >= table.c.max_attempts,
+        )).values(status=FAILED, finished_at=now, locked_until=None, last_error='Lease expired'))
+        due = or_(and_(table.c.status == QUEUED, table.c.run_at <= now),
+                  and_(table.c.status == RUNNING, table.c.locked_until < now))
+        values = {'status': RUNNING, 'attempts': table.c.attempts + 1,
+                  'locked_until': now + datetime.timedelta(seconds=self.config['TASKS_LEASE_SECONDS'])}
+        candidates = select([table.c.id, table.c.attempts]).where(due).order_by(table.c.run_at, table.c.id) \
+            .limit(limit)
+        if session.get_bind().dialect.name == 'postgresql':
+            ids = candidates.with_only_columns([table.c.id]).with_for_update(skip_locked=True)
+            rows = session.execute(table.update().where(table.c.id.in_(ids)).values(**values)
+                                   .returning(*table.c)).fetchall()
+        else:
+            # A claim bumps attempts, so a row claimed by another worker meanwhile no longer matches
+            claimed = [row.id for row in session.execute(candidates).fetchall()
+                       if session.execute(table.update().where(and_(
+                           table.c.id == row.id, table.c.attempts == row.attempts, due)).values(**values)).rowcount]
+            rows = session.execute(table.select().where(table.c.id.in_(claimed))).fetchall() if claimed else []
+        session.commit()
+        return sorted(rows, key=lambda row: (row.run_at, row.id))
+
+    def run(self, task):
+        """Runs a claimed task; returns the status it ends up in."""
+        table, session = self.table, self.db.session
+        # Nothing is written when the task has been claimed again meanwhile
+        mine = and_(table.c.id == task.id, table.c.attempts == task.attempts)
+        try:
+            function = self.functions.get(task.name)
+            if function is None:
+                raise LookupError('No task named %r' % task.name)
+            function(**json.loads(task.payload))
+            session.execute(table.update().where(mine).values(
+                status=DONE, finished_at=self.now(), locked_until=None, last_error=None))
+            session.commit()
+            return DONE
+        except Exception:
+            session.rollback()
+            error = traceback.format_exc()
+        self.app.logger.warning('Task %s %d failed, attempt %d of %d:\n%s', task.name, task.id,
+                                task.attempts, task.max_attempts, error)
+        now = self.now()
+        if task.attempts >= task.max_attempts:
+            status, values = FAILED, {'finished_at': now}
+        else:
+            delay = retry_delay(task.attempts, self.config['TASKS_RETRY_BASE_SECONDS'],
+                                self.config['TASKS_RETRY_MAX_SECONDS'])
+            status, values = QUEUED, {'run_at': now + datetime.timedelta(seconds=delay)}
+        session.execute(table.update().where(mine).values(status=status, locked_until=None, last_error=error,
+                                                         **values))
+        session.commit()
+        return status
+
+    def work(self, burst=False, threads=1, batch_size=None, poll_seconds=None, stop=None):
+        """Runs tasks on `threads` threads until `stop` is set, or no task is due with `burst`.
+
+        Returns how many tasks ended up in each status.
+        """
+        stop = stop or threading.Event()
+        batch_size = batch_size or self.config['TASKS_BATCH_SIZE']
+        poll_seconds = self.config['TASKS_POLL_SECONDS'] if poll_seconds is None else poll_seconds
+        stats, lock = Counter(), threading.Lock()
+
+        def loop():
+            with self.app.app_context():
+                while not stop.is_set():
+                    claimed = self.claim(batch_size)
+                    if not claimed:
+                        if burst:
+                            return
+                        stop.wait(poll_seconds)
+                    for task in claimed:
+                        status = self.run(task)
+                        with lock:
+                            stats[status] += 1
+
+        workers = [threading.Thread(target=loop, name='task-worker-%d' % i, daemon=True) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                while worker.is_alive():
+                    worker.join(0.5)
+        except KeyboardInterrupt:
+            # Lets the tasks being run finish
+            stop.set()
+            for worker in workers:
+                worker.join()
+        return dict(stats)
+
+    def start(self, threads):
+        """Runs tasks on `threads` daemon threads of this process until stop()."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._threads = threads
+        self._thread = threading.Thread(target=self.work, kwargs={'threads': threads, 'stop': self._stop},
+                                        name='task-queue', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread, self._threads = None, 0
+
+    def purge(self, before):
+        """Deletes the tasks done or failed before `before`; returns how many."""
+        table, session = self.table, self.db.session
+        result = session.execute(table.delete().where(and_(
+            table.c.status.in_((DONE, FAILED)), table.c.finished_at < before)))
+        session.commit()
+        return result.rowcount
+
+    def stats(self):
+        table = self.table
+        counts = dict(self.db.session.execute(
+            select([table.c.status, func.count()]).group_by(table.c.status)).fetchall())
+        return dict({status: 0 for status in (QUEUED, RUNNING, DONE, FAILED)}, **counts,
+                    threads=self._threads)
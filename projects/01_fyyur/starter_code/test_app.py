@@ -0,0 +1,1142 @@
+import datetime
+import io
+import json
+import logging
+import math
+import os
+import shutil
+import re
+import struct
+import tempfile
+import threading
+import unittest
+import zlib
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from PIL import Image
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import NullPool
+
+import app as fyyur
+from app import app, db, cache, fragments, Venue, Artist, Show, ArtistCalender, genres_by_name, format_datetime
+import geo
+import importer
+import logs
+import metrics
+import profiler
+import thumbnails
+from caching import Cache, DiskBackend, MemoryBackend, MISSING
+from database import engine_options, InstrumentedQueuePool
+from conflicts import ScheduleIndex
+from availability import AvailabilityIndex
+from clock import FixedClock
+
+
+def png_image(width=1, height=1):
+    """A valid red PNG image."""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    rows = b''.join(b'\x00' + b'\xff\x00\x00' * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+class FyyurTestCase(unittest.TestCase):
+    """This class represents the fyyur test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        self.db_fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + self.db_path
+        self.client = app.test_client()
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+        cache.clear()
+        fragments.clear()
+        self.real_clock = fyyur.clock
+        self.clock = fyyur.clock = FixedClock(datetime.datetime.combine(datetime.date.today(), datetime.time(12, 0)))
+        # Settle the daily show counter rollover outside of any measured request
+        fyyur.roll_show_counts(self.clock.today())
+        fyyur.show_counts_day = self.clock.today()
+
+    def tearDown(self):
+        """Executed after reach test"""
+        fyyur.clock = self.real_clock
+        db.session.remove()
+        db.drop_all()
+        db.get_engine(app).dispose()
+        self.ctx.pop()
+        os.close(self.db_fd)
+        os.unlink(self.db_path)
+
+    @contextmanager
+    def assertMaxQueries(self, limit):
+        """Fails when the block issues more than `limit` SQL statements."""
+        with profiler.capture() as profile:
+            yield profile
+        self.assertLessEqual(profile.count, limit, profile.report())
+
+    def add_venue(self, name, city='San Francisco', state='CA', genres=('Jazz', 'Folk')):
+        venue = Venue(name=name, city=city, state=state, genres=genres_by_name(genres))
+        db.session.add(venue)
+        db.session.commit()
+        return venue.id
+
+    def add_artist(self, name, city='San Francisco', state='CA', genres=('Rock n Roll',)):
+        artist = Artist(name=name, city=city, state=state, genres=genres_by_name(genres))
+        db.session.add(artist)
+        db.session.commit()
+        return artist.id
+
+    def add_show(self, artist_id, venue_id, days_from_today, start_time=datetime.time(20, 0)):
+        show = Show(artist_id=artist_id, venue_id=venue_id, start_time=start_time,
+                    start_date=self.clock.today() + datetime.timedelta(days=days_from_today))
+        db.session.add(show)
+        db.session.commit()
+        return show.id
+
+    def test_venues_grouped_by_area(self):
+        self.add_venue('The Musical Hop')
+        self.add_venue('Park Square Live', city='New York', state='NY')
+        self.add_venue('The Dueling Pianos Bar')
+        res = self.client.get('/venues')
+        body = res.get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(body.count('San Francisco, CA'), 1)
+        self.assertEqual(body.count('New York, NY'), 1)
+        self.assertIn('The Dueling Pianos Bar', body)
+
+    def test_show_venue_loads_shows_and_genres_in_two_queries(self):
+        venue_id = self.add_venue('The Musical Hop')
+        artists = [self.add_artist('Guns N Petals %d' % i) for i in range(5)]
+        for days in range(-10, 10):
+            self.add_show(artists[days % 5], venue_id, days)
+        db.session.remove()
+
+        with self.assertMaxQueries(2):
+            res = self.client.get('/venues/%d' % venue_id)
+        body = res.get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('10 Upcoming Shows', body)
+        self.assertIn('10 Past Shows', body)
+        self.assertIn('Guns N Petals 4', body)
+        self.assertIn('>Folk</a>', body)
+
+    def test_show_artist_loads_shows_and_genres_in_two_queries(self):
+        artist_id = self.add_artist('Matt Quevedo')
+        venues = [self.add_venue('Park Square Live %d' % i) for i in range(3)]
+        for days in range(-3, 6):
+            self.add_show(artist_id, venues[days % 3], days)
+        db.session.remove()
+
+        with self.assertMaxQueries(2):
+            res = self.client.get('/artists/%d' % artist_id)
+        body = res.get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('6 Upcoming Shows', body)
+        self.assertIn('3 Past Shows', body)
+        self.assertIn('Park Square Live 2', body)
+
+    def test_show_partitions_cached_for_the_day(self):
+        venue_id = self.add_venue('The Musical Hop')
+        artist_id = self.add_artist('Guns N Petals')
+        self.add_show(artist_id, venue_id, 0)
+        self.client.get('/venues/%d' % venue_id)
+
+        with self.assertMaxQueries(1):
+            body = self.client.get('/venues/%d' % venue_id).get_data(as_text=True)
+        self.assertIn('1 Upcoming Show', body)
+
+        # A show write replaces every cached partition
+        self.add_show(artist_id, venue_id, 1)
+        body = self.client.get('/venues/%d' % venue_id).get_data(as_text=True)
+        self.assertIn('2 Upcoming Shows', body)
+
+        # At midnight today's show moves to the past without a restart or a write
+        self.clock.advance(days=1)
+        body = self.client.get('/artists/%d' % artist_id).get_data(as_text=True)
+        self.assertIn('1 Upcoming Show', body)
+        self.assertIn('1 Past Show', body)
+        self.assertEqual(Artist.query.get(artist_id).past_shows_count, 1)
+
+    def test_invalidated_entries_kept_briefly_without_a_shared_cache(self):
+        # Other processes do not see this process replace a version in the in-process cache
+        venue_id = self.add_venue('The Musical Hop')
+        self.client.get('/venues/%d' % venue_id)
+        for backend, prefix in ((cache.backend, 'shows:venue:'), (fragments.backend, 'fragment:venue:')):
+            expiries = [expires for key, (_, expires, _) in backend._entries.items() if key.startswith(prefix)]
+            self.assertTrue(expiries)
+            self.assertLessEqual(max(expiries) - backend.clock(), app.config['CACHE_DEFAULT_TTL'])
+
+        cache.backend.shared = True
+        self.addCleanup(delattr, cache.backend, 'shared')
+        self.assertTrue(cache.shared)
+        self.assertEqual(fyyur.versioned_ttl(3600), 3600)
+
+    def test_detail_fragments_cached_until_a_write_shows_on_the_page(self):
+        venue_id = self.add_venue('The Musical Hop')
+        other_venue_id = self.add_venue('Park Square Live')
+        artist_id = self.add_artist('Guns N Petals')
+        self.add_show(artist_id, venue_id, 1)
+        self.client.get('/venues/%d' % venue_id)
+        self.client.get('/venues/%d' % other_venue_id)
+
+        with self.assertMaxQueries(0):
+            body = self.client.get('/venues/%d' % venue_id).get_data(as_text=True)
+        self.assertIn('Guns N Petals', body)
+
+        # Renaming the artist replaces the stamp of the venue it plays at only
+        self.client.post('/artists/%d/edit' % artist_id, data={
+            'name': 'The Wild Sax Band', 'city': 'San Francisco', 'state': 'CA', 'genres': 'Jazz',
+            'seeking_venue': 'False'})
+        with self.assertMaxQueries(0):
+            body = self.client.get('/venues/%d' % other_venue_id).get_data(as_text=True)
+        # The layout is still rendered per request, with the flashed message of the edit
+        self.assertIn('was successfully updated!', body)
+        body = self.client.get('/venues/%d' % venue_id).get_data(as_text=True)
+        self.assertIn('The Wild Sax Band', body)
+        self.assertNotIn('was successfully updated!', body)
+
+        self.client.post('/shows/create', data={'venue_id': other_venue_id, 'artist_id': artist_id,
+                                                'start_date': (self.clock.today() + datetime.timedelta(days=2)).isoformat(),
+                                                'start_time': '20:00'})
+        self.assertIn('1 Upcoming Show', self.client.get('/venues/%d' % other_venue_id).get_data(as_text=True))
+        self.assertIn('2 Upcoming Shows', self.client.get('/artists/%d' % artist_id).get_data(as_text=True))
+
+        self.client.delete('/venues/%d' % venue_id)
+        self.assertIn('1 Upcoming Show', self.client.get('/artists/%d' % artist_id).get_data(as_text=True))
+        self.assertEqual(self.client.get('/venues/%d' % venue_id).status_code, 404)
+
+    def test_show_venue_not_found(self):
+        res = self.client.get('/venues/1000')
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_shows_keyset_pagination(self):
+        venue_id = self.add_venue('The Musical Hop')
+        artist_id = self.add_artist('Guns N Petals')
+        for days in range(5):
+            self.add_show(artist_id, venue_id, days, start_time=datetime.time(18, 0))
+            self.add_show(artist_id, venue_id, days, start_time=datetime.time(21, 0))
+        # Shows without a time come first on their day, shows without a date last
+        untimed_id = self.add_show(artist_id, venue_id, 2, start_time=None)
+        db.session.add(Show(artist_id=artist_id, venue_id=venue_id))
+        db.session.commit()
+        db.session.remove()
+
+        with self.assertMaxQueries(1):
+            res = self.client.get('/shows?limit=4')
+            body = res.get_data(as_text=True)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(body.count('tile-show'), 4)
+        self.assertIn('after=', body)
+
+        seen = body.count('tile-show')
+        cursor = body.split('after=')[1].split('&')[0]
+        while cursor:
+            body = self.client.get('/shows?limit=4&after=' + cursor).get_data(as_text=True)
+            seen += body.count('tile-show')
+            cursor = body.split('after=')[1].split('&')[0] if 'after=' in body else None
+        self.assertEqual(seen, 12)
+        self.assertIn('Date to be announced', body)
+
+        ids = []
+        url = '/api/v1/shows?limit=3'
+        while url:
+            page = self.client.get(url).get_json()
+            ids += [show['id'] for show in page['data']]
+            url = page['next']
+        self.assertEqual(len(ids), 12)
+        self.assertEqual(ids[4], untimed_id)
+        self.assertIsNone(Show.query.get(ids[-1]).start_date)
+
+    def test_shows_rejects_bad_cursor(self):
+        res = self.client.get('/shows?after=yesterday')
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_search_venues_matches_name_and_city(self):
+        self.add_venue('The Musical Hop')
+        self.add_venue('Park Square Live Music & Coffee', city='New York', state='NY')
+        self.add_venue('The Dueling Pianos Bar', city='Musicville')
+        res = self.client.post('/venues/search', data={'search_term': 'Music'})
+        body = res.get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(': 3</h3>', body)
+        self.assertLess(body.index('The Musical Hop'), body.index('The Dueling Pianos Bar'))
+
+    def test_search_artists_paginates(self):
+        app.config['SEARCH_PAGE_SIZE'] = 2
+        for i in range(5):
+            self.add_artist('Guns N Petals %d' % i)
+        self.add_artist('Matt Quevedo')
+        res = self.client.post('/artists/search', data={'search_term': 'petals', 'page': 3})
+        body = res.get_data(as_text=True)
+        app.config['SEARCH_PAGE_SIZE'] = 20
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(': 5</h3>', body)
+        self.assertIn('Guns N Petals 4', body)
+        self.assertNotIn('Guns N Petals 3', body)
+        self.assertNotIn('Matt Quevedo', body)
+
+    def test_search_index_sees_new_rows(self):
+        self.client.post('/artists/search', data={'search_term': 'quevedo'})
+        self.add_artist('Matt Quevedo')
+        res = self.client.post('/artists/search', data={'search_term': 'quevedo'})
+
+        self.assertIn('Matt Quevedo', res.get_data(as_text=True))
+
+    def test_venues_filtered_by_genre(self):
+        self.add_venue('The Musical Hop', genres=['Jazz', 'Reggae'])
+        self.add_venue('Park Square Live', city='New York', state='NY', genres=['Folk'])
+        self.add_venue('The Dueling Pianos Bar', state='NY', genres=['Jazz'])
+        res = self.client.get('/venues?genre=Jazz')
+        body = res.get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('The Musical Hop', body)
+        self.assertIn('The Dueling Pianos Bar', body)
+        self.assertNotIn('Park Square Live', body)
+
+        body = self.client.get('/venues?genre=Jazz&state=CA').get_data(as_text=True)
+        self.assertIn('The Musical Hop', body)
+        self.assertNotIn('The Dueling Pianos Bar', body)
+
+    def test_edit_artist_replaces_genres(self):
+        artist_id = self.add_artist('Matt Quevedo', genres=['Jazz'])
+        self.client.post('/artists/%d/edit' % artist_id, data={
+            'name': 'Matt Quevedo', 'city': 'New York', 'state': 'NY',
+            'genres': ['Folk', 'Jazz'], 'seeking_venue': 'False'})
+        body = self.client.get('/artists?genre=Folk').get_data(as_text=True)
+
+        self.assertIn('Matt Quevedo', body)
+        self.assertEqual(sorted(g.name for g in Artist.query.get(artist_id).genres), ['Folk', 'Jazz'])
+
+    def test_edit_forms_not_found(self):
+        self.assertEqual(self.client.get('/artists/1000/edit').status_code, 404)
+        self.assertEqual(self.client.get('/venues/1000/edit').status_code, 404)
+
+    def test_search_matches_genre(self):
+        self.add_artist('Matt Quevedo', genres=['Jazz'])
+        self.add_artist('Guns N Petals')
+        body = self.client.post('/artists/search', data={'search_term': 'jazz'}).get_data(as_text=True)
+
+        self.assertIn('Matt Quevedo', body)
+        self.assertNotIn('Guns N Petals', body)
+
+    def test_home_panels_cached_until_write(self):
+        before = self.client.get('/cache/stats').get_json()
+        self.add_artist('Guns N Petals')
+        self.client.get('/')
+        with self.assertMaxQueries(0):
+            res = self.client.get('/')
+        self.assertIn('Guns N Petals', res.get_data(as_text=True))
+
+        self.client.post('/venues/create', data={
+            'name': 'The Musical Hop', 'city': 'San Francisco', 'state': 'CA', 'genres': ['Jazz']})
+        body = self.client.get('/').get_data(as_text=True)
+        self.assertIn('The Musical Hop', body)
+
+        stats = self.client.get('/cache/stats').get_json()
+        self.assertEqual(stats['hits'] - before['hits'], 5)
+        self.assertEqual(stats['misses'] - before['misses'], 3)
+
+    def test_memory_backend_expires_and_evicts(self):
+        now = [0]
+        backend = MemoryBackend(max_entries=2, clock=lambda: now[0])
+        backend.set('a', 1, ttl=10)
+        backend.set('b', 2)
+        backend.set('c', 3)
+        self.assertIs(backend.get('a'), MISSING)
+        self.assertEqual(backend.get('b'), 2)
+
+        backend.set('d', 4, ttl=10)
+        now[0] = 11
+        self.assertIs(backend.get('d'), MISSING)
+        self.assertEqual(backend.stats()['evictions'], 2)
+
+    def test_memory_backend_bounds_bytes(self):
+        backend = MemoryBackend(max_entries=10, max_bytes=10)
+        backend.set('a', 'x' * 4)
+        backend.set('b', 'x' * 4)
+        backend.set('a', 'x' * 5)
+        backend.set('c', 'x' * 4)
+        self.assertIs(backend.get('b'), MISSING)
+        self.assertEqual(backend.get('c'), 'xxxx')
+        self.assertEqual(backend.stats(), {'entries': 2, 'evictions': 1, 'bytes': 9})
+
+        # A value over the cap is not kept, and does not evict the others
+        backend.set('c', 'x' * 11)
+        self.assertIs(backend.get('c'), MISSING)
+        self.assertEqual(backend.stats(), {'entries': 1, 'evictions': 1, 'bytes': 5})
+
+    def test_disk_backend_evicts_least_recently_used_and_shares_content(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        backend = DiskBackend(directory, max_entries=10, max_bytes=12)
+        backend.set('a', b'12345')
+        backend.set('b', b'12345')
+        backend.set('c', b'abcdef')
+        self.assertEqual(backend.stats(), {'entries': 3, 'evictions': 0, 'bytes': 11})
+        self.assertEqual(sum(len(files) for _, _, files in os.walk(os.path.join(directory, 'objects'))), 2)
+
+        # 'b' and 'c' are the least recently used; dropping 'b' alone frees nothing as 'a' shares its file
+        self.assertEqual(backend.get('a'), b'12345')
+        backend.set('d', b'xy')
+        self.assertEqual([backend.get(key) for key in 'abcd'], [b'12345', MISSING, MISSING, b'xy'])
+        self.assertEqual(backend.stats(), {'entries': 2, 'evictions': 2, 'bytes': 7})
+
+        # A value over the cap is not stored, and does not evict the others
+        backend.set('d', b'x' * 13)
+        self.assertEqual([backend.get(key) for key in 'ad'], [b'12345', MISSING])
+        self.assertEqual(backend.stats(), {'entries': 1, 'evictions': 2, 'bytes': 5})
+
+        # Another process sees the same entries, and they see its writes
+        other = DiskBackend(directory, max_entries=10, max_bytes=12)
+        self.assertEqual(other.stats()['entries'], 1)
+        other.set('e', b'zz')
+        self.assertEqual(backend.get('e'), b'zz')
+        backend.clear()
+        self.assertEqual(backend.get('a'), MISSING)
+
+    def test_get_or_set_single_flight(self):
+        calls, started, release = [], threading.Event(), threading.Event()
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            cache.get_or_set('slow', compute, single_flight=True))) for _ in range(4)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((len(calls), results), (1, ['value'] * 4))
+
+    def test_create_calender_inserts_in_bulk(self):
+        artist_id = self.add_artist('Matt Quevedo')
+        db.session.add(ArtistCalender(artist_id=artist_id, date=datetime.date(2035, 6, 2)))
+        db.session.commit()
+        # The calender form posts ISO timestamps of the day before
+        dates = ['2035-%02d-%02dT23:00:00.000Z' % (month, day) for month in (6, 7, 8) for day in range(1, 29)]
+
+        with self.assertMaxQueries(2):
+            res = self.client.post('/create_calender', json={'artist_id': artist_id, 'dates': dates + dates[:10]})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(ArtistCalender.query.filter_by(artist_id=artist_id).count(), 84)
+
+    def test_availability_index_queries(self):
+        index = AvailabilityIndex()
+        index.load([(1, datetime.date(2035, 12, 30)), (1, datetime.date(2035, 12, 31)),
+                    (1, datetime.date(2036, 1, 1)), (2, datetime.date(2036, 12, 31)), (2, None)])
+        self.assertTrue(index.available(1, datetime.date(2035, 12, 31)))
+        self.assertFalse(index.available(1, datetime.date(2036, 1, 2)))
+        # Artists without a calender are available on every date
+        self.assertTrue(index.available(3, datetime.date(2036, 1, 2)))
+        self.assertTrue(index.available_between(1, datetime.date(2035, 12, 30), datetime.date(2036, 1, 1)))
+        self.assertFalse(index.available_between(1, datetime.date(2035, 12, 29), datetime.date(2036, 1, 1)))
+        self.assertTrue(index.listed(2, datetime.date(2036, 12, 31)))
+        self.assertEqual(index.free_on([1, 2, 3], datetime.date(2036, 1, 1)), [1, 3])
+
+        index.remove(2, datetime.date(2036, 12, 31))
+        self.assertFalse(index.has_calender(2))
+        self.assertEqual(index.stats(), {'artists': 1, 'dates': 3, 'bytes': 92})
+
+    def test_available_artists_follow_calender_writes(self):
+        calender_id = self.add_artist('Matt Quevedo')
+        self.add_artist('Guns N Petals')
+        self.add_artist('The Wild Sax Band', city='New York', state='NY')
+        db.session.add(ArtistCalender(artist_id=calender_id, date=datetime.date(2035, 6, 2)))
+        db.session.commit()
+
+        def available(query):
+            return [artist['name'] for artist in self.client.get('/api/v1/artists/available?' + query).get_json()['data']]
+
+        self.assertEqual(available('date=2035-06-02&city=san+francisco'), ['Matt Quevedo', 'Guns N Petals'])
+        self.assertEqual(available('date=2035-06-03'), ['Guns N Petals', 'The Wild Sax Band'])
+        self.assertEqual(self.client.get('/api/v1/artists/available?date=June').status_code, 400)
+
+        # This process's writes are applied to its index in place
+        version = fyyur.availability_index.version
+        self.client.post('/create_calender', json={'artist_id': calender_id, 'dates': ['2035-06-02T23:00:00.000Z']})
+        self.assertNotEqual(fyyur.availability_index.version, version)
+        self.assertEqual(fyyur.availability_index.version, cache.get(fyyur.AVAILABILITY_VERSION_KEY))
+        with self.assertMaxQueries(1):
+            self.assertIn('Matt Quevedo', available('date=2035-06-02&until=2035-06-03'))
+
+        entry = ArtistCalender.query.filter_by(date=datetime.date(2035, 6, 2)).one()
+        self.client.delete('/del_calender/%d' % entry.id)
+        self.assertEqual(available('date=2035-06-02&city=San Francisco'), ['Guns N Petals'])
+
+        # Another process's write only shows as a new version, and the index is rebuilt
+        db.engine.execute(ArtistCalender.__table__.insert(), artist_id=calender_id, date=datetime.date(2035, 6, 4))
+        cache.set(fyyur.AVAILABILITY_VERSION_KEY, 'elsewhere', ttl=0)
+        self.assertEqual(available('date=2035-06-04&city=San Francisco'), ['Matt Quevedo', 'Guns N Petals'])
+
+    def post_show(self, artist_id, venue_id, start_date, start_time='20:00'):
+        return self.client.post('/shows/create', data={
+            'artist_id': artist_id, 'venue_id': venue_id, 'start_date': start_date, 'start_time': start_time})
+
+    def test_create_show_checks_availability_in_one_query(self):
+        artist_id = self.add_artist('Matt Quevedo')
+        venue_id = self.add_venue('The Musical Hop')
+        db.session.add(ArtistCalender(artist_id=artist_id, date=datetime.date(2035, 6, 2)))
+        db.session.commit()
+
+        with self.assertMaxQueries(1):
+            res = self.post_show(artist_id, venue_id, '2035-06-03')
+        self.assertIn('Artist is not available on the selected date!', res.get_data(as_text=True))
+
+        self.post_show(artist_id, venue_id, '2035-06-02')
+        self.assertEqual(Show.query.count(), 1)
+
+    def test_create_show_rejects_double_booking(self):
+        venue_id = self.add_venue('The Musical Hop')
+        self.post_show(self.add_artist('Matt Quevedo'), venue_id, '2035-06-02')
+        res = self.post_show(self.add_artist('Guns N Petals'), venue_id, '2035-06-02')
+
+        self.assertIn('Venue already has a show at the selected time!', res.get_data(as_text=True))
+        self.assertEqual(Show.query.count(), 1)
+
+        # Shows last SHOW_DURATION_MINUTES, across midnight too, as in /shows/validate
+        artist_id = self.add_artist('The Wild Sax Band')
+        res = self.post_show(artist_id, venue_id, '2035-06-02', '22:30')
+        self.assertIn('Venue already has a show at the selected time!', res.get_data(as_text=True))
+        self.post_show(artist_id, venue_id, '2035-06-02', '23:00')
+        res = self.post_show(artist_id, self.add_venue('Park Square Live'), '2035-06-03', '01:30')
+        self.assertIn('Artist already has a show at the selected time!', res.get_data(as_text=True))
+        self.post_show(artist_id, venue_id, '2035-06-03', '02:00')
+        self.assertEqual(Show.query.count(), 3)
+
+    def test_validate_shows_reports_conflicts(self):
+        venue_id = self.add_venue('The Musical Hop')
+        other_venue_id = self.add_venue('Park Square Live')
+        artist_id = self.add_artist('Matt Quevedo')
+        busy_artist_id = self.add_artist('Guns N Petals')
+        show_id = self.add_show(busy_artist_id, other_venue_id, 30, start_time=datetime.time(20, 0))
+        start_date = (datetime.date.today() + datetime.timedelta(days=30)).isoformat()
+        calender_artist_id = self.add_artist('The Wild Sax Band')
+        db.session.add(ArtistCalender(artist_id=calender_artist_id, date=datetime.date(2035, 1, 1)))
+        db.session.commit()
+
+        with self.assertMaxQueries(3):
+            res = self.client.post('/shows/validate', json={'shows': [
+                {'venue_id': venue_id, 'artist_id': artist_id, 'start_date': start_date, 'start_time': '19:00'},
+                {'venue_id': venue_id, 'artist_id': artist_id, 'start_date': start_date, 'start_time': '23:00'},
+                {'venue_id': venue_id, 'artist_id': busy_artist_id, 'start_date': start_date, 'start_time': '21:00'},
+                {'venue_id': other_venue_id, 'artist_id': calender_artist_id,
+                 'start_date': start_date, 'start_time': '10:00'},
+            ]})
+        data = res.get_json()
+
+        self.assertFalse(data['valid'])
+        self.assertEqual(data['conflicts'], [
+            {'row': 2, 'kind': 'venue', 'conflicts_with': {'row': 1}},
+            {'row': 2, 'kind': 'artist', 'conflicts_with': {'show_id': show_id}},
+            {'row': 3, 'kind': 'unavailable', 'conflicts_with': None},
+        ])
+
+    def test_schedule_index_neighbours(self):
+        index = ScheduleIndex(datetime.timedelta(hours=3))
+        base = datetime.datetime(2035, 6, 1, 12, 0)
+        for hours, ref in ((0, 'a'), (6, 'b'), (12, 'c')):
+            index.add('venue', base + datetime.timedelta(hours=hours), ref)
+
+        self.assertEqual(index.overlapping('venue', base + datetime.timedelta(hours=8)), 'b')
+        self.assertEqual(index.overlapping('venue', base + datetime.timedelta(hours=4)), 'b')
+        self.assertIsNone(index.overlapping('venue', base + datetime.timedelta(hours=3)))
+        self.assertIsNone(index.overlapping('venue', base + datetime.timedelta(hours=9)))
+        self.assertIsNone(index.overlapping('artist', base))
+
+    def test_format_datetime(self):
+        self.assertEqual(format_datetime(datetime.date(2035, 6, 1), datetime.time(20, 0), 'full'),
+                         'Friday June, 1, 2035 at 8:00PM')
+        self.assertEqual(format_datetime('2035-06-01', '20:00:00', 'small'), 'Fri 06, 01, 2035')
+
+    def test_show_counts_follow_writes_and_rollover(self):
+        venue_id = self.add_venue('The Musical Hop')
+        artist_id = self.add_artist('Guns N Petals')
+        self.add_show(artist_id, venue_id, -1)
+        self.add_show(artist_id, venue_id, 0)
+        show_id = self.add_show(artist_id, venue_id, 1)
+        self.add_show(self.add_artist('Matt Quevedo'), venue_id, 2)
+        db.session.delete(Show.query.get(show_id))
+        db.session.commit()
+
+        venue = Venue.query.get(venue_id)
+        self.assertEqual((venue.upcoming_shows_count, venue.past_shows_count), (2, 1))
+
+        fyyur.roll_show_counts(datetime.date.today() + datetime.timedelta(days=1))
+        fyyur.roll_show_counts(datetime.date.today() + datetime.timedelta(days=1))
+        venue, artist = Venue.query.get(venue_id), Artist.query.get(artist_id)
+        self.assertEqual((venue.upcoming_shows_count, venue.past_shows_count), (1, 2))
+        self.assertEqual((artist.upcoming_shows_count, artist.past_shows_count), (0, 2))
+
+    def test_artists_sorted_by_upcoming_shows(self):
+        venue_id = self.add_venue('The Musical Hop')
+        self.add_artist('Guns N Petals')
+        busy_id = self.add_artist('Matt Quevedo')
+        self.add_show(busy_id, venue_id, 3)
+
+        with self.assertMaxQueries(1):
+            body = self.client.get('/artists?sort=upcoming').get_data(as_text=True)
+
+        self.assertLess(body.index('Matt Quevedo'), body.index('Guns N Petals'))
+        self.assertIn('1 upcoming show', body)
+
+    def test_delete_venue_cascades_shows(self):
+        venue_id = self.add_venue('The Musical Hop')
+        artist_id = self.add_artist('Guns N Petals')
+        self.add_show(artist_id, venue_id, 3)
+        self.client.delete('/venues/%d' % venue_id)
+
+        self.assertEqual(Show.query.count(), 0)
+        self.assertEqual(Artist.query.get(artist_id).upcoming_shows_count, 0)
+
+    def test_api_venues_fields_and_pages(self):
+        for i in range(3):
+            self.add_venue('The Musical Hop %d' % i)
+        res = self.client.get('/api/v1/venues?fields=name,genres&limit=2')
+        payload = res.get_json()
+
+        self.assertEqual(payload['data'][0], {'name': 'The Musical Hop 0', 'genres': ['Folk', 'Jazz']})
+        self.assertEqual(len(payload['data']), 2)
+        payload = self.client.get(payload['next']).get_json()
+        self.assertEqual([venue['name'] for venue in payload['data']], ['The Musical Hop 2'])
+        self.assertIsNone(payload['next'])
+        self.assertEqual(self.client.get('/api/v1/venues?fields=nope').status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/venues/99').get_json(), {'error': 'Venue 99 not found'})
+
+    def test_api_conditional_get(self):
+        venue_id = self.add_venue('The Musical Hop')
+        artist_id = self.add_artist('Guns N Petals')
+        res = self.client.get('/api/v1/artists/%d' % artist_id)
+        etag = res.headers['ETag']
+
+        with self.assertMaxQueries(1):
+            res = self.client.get('/api/v1/artists/%d' % artist_id, headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers['ETag'], etag)
+
+        # Booking a show changes the artist's counters and therefore its version
+        self.add_show(artist_id, venue_id, 3)
+        res = self.client.get('/api/v1/artists/%d' % artist_id, headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()['upcoming_shows_count'], 1)
+
+        # So does a change to its genres alone
+        etag = res.headers['ETag']
+        Artist.query.get(artist_id).genres = genres_by_name(['Jazz'])
+        db.session.commit()
+        res = self.client.get('/api/v1/artists/%d' % artist_id, headers={'If-None-Match': etag})
+        self.assertEqual(res.get_json()['genres'], ['Jazz'])
+
+    def test_api_shows(self):
+        venue_id = self.add_venue('The Musical Hop')
+        artist_id = self.add_artist('Guns N Petals')
+        show_id = self.add_show(artist_id, venue_id, 1)
+        self.add_show(self.add_artist('Matt Quevedo'), venue_id, 2)
+
+        res = self.client.get('/api/v1/shows?artist_id=%d&fields=id,venue_name,start_date' % artist_id)
+        self.assertEqual(res.get_json()['data'], [{
+            'id': show_id, 'venue_name': 'The Musical Hop',
+            'start_date': (self.clock.today() + datetime.timedelta(days=1)).isoformat()}])
+        res = self.client.get('/api/v1/shows?limit=1')
+        self.assertEqual(len(res.get_json()['data']), 1)
+        etag = res.headers['ETag']
+        self.assertEqual(self.client.get('/api/v1/shows?limit=1', headers={'If-None-Match': etag}).status_code, 304)
+
+        # Renaming the venue changes the shows listing it
+        Venue.query.get(venue_id).name = 'The Musical Hop Hall'
+        db.session.commit()
+        res = self.client.get('/api/v1/shows/%d' % show_id, headers={'If-None-Match': etag})
+        self.assertEqual(res.get_json()['venue_name'], 'The Musical Hop Hall')
+        self.assertEqual(self.client.get('/api/v1/shows?after=bad').status_code, 400)
+        res = self.client.get('/api/v1/shows?venue_id=abc')
+        self.assertEqual((res.status_code, res.get_json()['error']), (400, 'venue_id must be an integer'))
+
+    def write_file(self, suffix, content):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(content)
+        self.addCleanup(os.unlink, path)
+        return path
+
+    def test_import_venues_and_shows(self):
+        venues = self.write_file('.csv', (
+            'name,city,state,address,genres,facebook_link\n'
+            'The Musical Hop,San Francisco,CA,1015 Folsom Street,"Jazz, Reggae,Jazz",https://www.facebook.com/TheMusicalHop\n'
+            'Park Square Live,New York,NY,34 Whiskey Moore Ave,Folk,not a link\n'
+            'The Dueling Pianos Bar,New York,XX,335 Delancey Street,Classical,\n'))
+        result = app.test_cli_runner().invoke(args=['import-data', 'venues', venues])
+
+        self.assertIn('line 3: facebook_link: Invalid URL.', result.output)
+        self.assertIn('line 4: state: Not a valid choice', result.output)
+        self.assertIn('venues: 3 read, 1 loaded, 2 rejected', result.output)
+        venue = Venue.query.filter_by(name='The Musical Hop').one()
+        self.assertEqual([genre.name for genre in venue.genres], ['Jazz', 'Reggae'])
+        venue_id = venue.id
+
+        artist_id = self.add_artist('Guns N Petals')
+        start_date = (self.clock.today() + datetime.timedelta(days=2)).isoformat()
+        shows = self.write_file('.json', json.dumps([
+            {'artist_id': artist_id, 'venue_name': 'The Musical Hop', 'start_date': start_date, 'start_time': '20:00'},
+            {'artist_id': artist_id, 'venue_name': 'The Musical Hop', 'start_date': start_date, 'start_time': '21:00'},
+            {'artist_id': 99, 'venue_name': 'Nowhere', 'start_date': start_date, 'start_time': '20:00'},
+            {'artist_id': artist_id, 'venue_id': venue_id, 'start_time': '20:00'},
+        ]))
+        result = app.test_cli_runner().invoke(args=['import-data', 'shows', shows])
+
+        self.assertIn('line 2: start_time: Conflicts with another venue booking. Conflicts with another artist booking.',
+                      result.output)
+        self.assertIn('line 3: artist_id: No artist with id 99.; venue_name: 0 venues named', result.output)
+        self.assertIn('line 4: start_date: This field is required.', result.output)
+        self.assertEqual(Show.query.count(), 1)
+        self.assertEqual(Venue.query.get(venue_id).upcoming_shows_count, 1)
+
+    def test_import_ignores_repeated_genres(self):
+        record = {'name': 'The Musical Hop', 'city': 'San Francisco', 'state': 'CA', 'address': '1015 Folsom Street',
+                  'genres': ['Jazz', ' Jazz', 'Folk', '']}
+        progress = fyyur.import_records('venues', iter([(1, record)]), echo=lambda *args: None)
+        self.assertEqual(progress.loaded, 1)
+        self.assertEqual([genre.name for genre in Venue.query.one().genres], ['Folk', 'Jazz'])
+
+    def test_read_records_streams_json_arrays(self):
+        path = self.write_file('.json', json.dumps([{'name': 'x' * 100, 'n': i} for i in range(500)]))
+        records = list(importer.read_records(path))
+        self.assertEqual(len(records), 500)
+        self.assertEqual(records[-1], (500, {'name': 'x' * 100, 'n': 499}))
+        self.assertEqual(list(importer.iter_json_array(io.StringIO('[1.5, -2e3, "]"]'), chunk_size=2)),
+                         [1.5, -2e3, ']'])
+
+    def test_geohash_cells(self):
+        self.assertEqual(geo.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(geo.prefix_range('9qz'), ('9qz', '9r'))
+        self.assertEqual(geo.prefix_range('zz'), ('zz', None))
+        # Every point within the radius falls in one of the cells, also across the antimeridian
+        for latitude, longitude, miles in ((37.7749, -122.4194, 50), (-16.5, 179.9, 100), (89.9, 0, 10)):
+            cells = geo.covering_cells(latitude, longitude, miles)
+            self.assertLessEqual(len(cells), 16)
+            for bearing in range(0, 360, 15):
+                point = (latitude + miles / 69.2 * math.cos(math.radians(bearing)),
+                         longitude + miles / 69.2 * math.sin(math.radians(bearing)) / max(math.cos(math.radians(latitude)), 0.01))
+                if abs(point[0]) < 90 and geo.distance_miles(latitude, longitude, *point) <= miles:
+                    self.assertTrue(any(geo.encode(*point).startswith(cell) for cell in cells), (point, cells))
+
+    def test_nearby_venues(self):
+        self.add_venue('The Musical Hop')
+        self.add_venue('The Fox Theater', city='Oakland')
+        self.add_venue('The Dueling Pianos Bar', city='New York', state='NY')
+        self.add_venue('Nowhere Hall', city='Nowhere', state='NV')
+        artist_id = self.add_artist('Guns N Petals', city='Berkeley')
+
+        result = app.test_cli_runner().invoke(args=['geocode'])
+        self.assertIn('Venue: 3 located, 1 in places missing from the gazetteer: Nowhere, NV', result.output)
+        self.assertIn('Artist: 1 located', result.output)
+
+        with self.assertMaxQueries(2):
+            data = self.client.get('/venues/nearby?artist_id=%d' % artist_id).get_json()
+        self.assertEqual([(venue['name'], venue['distance']) for venue in data['data']],
+                         [('The Fox Theater', 4.6), ('The Musical Hop', 10.4)])
+        data = self.client.get('/venues/nearby?city=Brooklyn&state=NY&radius=10').get_json()
+        self.assertEqual([venue['name'] for venue in data['data']], ['The Dueling Pianos Bar'])
+        data = self.client.get('/artists/nearby?lat=37.7749&lng=-122.4194&radius=5').get_json()
+        self.assertEqual(data['data'], [])
+        self.assertEqual(self.client.get('/venues/nearby?city=Atlantis').status_code, 400)
+        self.assertEqual(self.client.get('/venues/nearby?lat=37&lng=-122&radius=5000').status_code, 400)
+
+        # Moving to another city drops the location until the next geocode run
+        artist = Artist.query.get(artist_id)
+        artist.city = 'San Jose'
+        db.session.commit()
+        self.assertEqual(self.client.get('/venues/nearby?artist_id=%d' % artist_id).status_code, 400)
+
+    def test_task_queue_retries_with_backoff_and_dedupes_keys(self):
+        queue = fyyur.task_queue
+        calls = []
+
+        @queue.task('flaky')
+        def flaky(venue):
+            # The writes of a failed attempt are rolled back
+            calls.append(venue)
+            db.session.add(Venue(name='%s %d' % (venue, len(calls))))
+            if len(calls) < 3:
+                raise RuntimeError('try again')
+        self.addCleanup(queue.functions.pop, 'flaky')
+
+        self.assertTrue(queue.enqueue('flaky', key='flaky:1', venue='The Musical Hop'))
+        self.assertFalse(queue.enqueue('flaky', key='flaky:1', venue='Ignored'))
+        db.session.commit()
+        base = app.config['TASKS_RETRY_BASE_SECONDS']
+        with self.assertLogs(app.logger, 'WARNING') as logs:
+            self.assertEqual(queue.work(burst=True), {'queued': 1})
+            # Not due again until the backoff has passed, which doubles
+            self.assertEqual(queue.work(burst=True), {})
+            self.clock.advance(seconds=base)
+            self.assertEqual(queue.work(burst=True), {'queued': 1})
+            self.clock.advance(seconds=base)
+            self.assertEqual(queue.work(burst=True), {})
+            self.clock.advance(seconds=base)
+            self.assertEqual(queue.work(burst=True), {'done': 1})
+        self.assertIn('Task flaky 1 failed, attempt 1 of 5', logs.output[0])
+        self.assertIn('RuntimeError: try again', logs.output[1])
+
+        self.assertEqual(calls, ['The Musical Hop'] * 3)
+        self.assertEqual([venue.name for venue in Venue.query], ['The Musical Hop 3'])
+        self.assertEqual(self.client.get('/tasks/stats').get_json(),
+                         {'queued': 0, 'running': 0, 'done': 1, 'failed': 0, 'threads': 0})
+
+    def test_task_queue_gives_up_and_reclaims_expired_leases(self):
+        queue = fyyur.task_queue
+        app.config['TASKS_MAX_ATTEMPTS'] = 2
+        self.addCleanup(app.config.__setitem__, 'TASKS_MAX_ATTEMPTS', 5)
+        queue.task('broken')(lambda: 1 / 0)
+        queue.task('noop')(lambda: None)
+        self.addCleanup(queue.functions.pop, 'broken')
+        self.addCleanup(queue.functions.pop, 'noop')
+
+        queue.enqueue('broken')
+        db.session.commit()
+        with self.assertLogs(app.logger, 'WARNING'):
+            self.assertEqual(queue.work(burst=True), {'queued': 1})
+            self.clock.advance(seconds=app.config['TASKS_RETRY_BASE_SECONDS'])
+            self.assertEqual(queue.work(burst=True), {'failed': 1})
+        self.assertIn('ZeroDivisionError', fyyur.Task.query.one().last_error)
+
+        # A worker claims a task and dies; its lease has to run out before another takes over
+        queue.enqueue('noop')
+        db.session.commit()
+        self.assertEqual(len(queue.claim(10)), 1)
+        self.assertEqual(queue.work(burst=True), {})
+        self.clock.advance(seconds=app.config['TASKS_LEASE_SECONDS'] + 1)
+        self.assertEqual(queue.work(burst=True), {'done': 1})
+        self.assertEqual(fyyur.Task.query.filter_by(name='noop').one().attempts, 2)
+
+    def test_written_venues_located_in_the_background(self):
+        self.client.post('/venues/create', data={
+            'name': 'The Musical Hop', 'city': 'San Francisco', 'state': 'CA', 'genres': ['Jazz']})
+        venue = Venue.query.one()
+        venue_id = venue.id
+        self.assertIsNone(venue.latitude)
+
+        result = app.test_cli_runner().invoke(args=['worker', '--burst'])
+        self.assertIn('1 tasks', result.output)
+        self.assertIn('1 done', result.output)
+        self.assertEqual(Venue.query.one().geohash[:4], '9q8y')
+
+        # Edits that keep the location queue nothing, moves queue the row again
+        data = {'name': 'The Musical Hop', 'city': 'San Francisco', 'state': 'CA', 'genres': ['Jazz'],
+                'seeking_talent': 'False'}
+        self.client.post('/venues/%d/edit' % venue_id, data=data)
+        self.client.post('/venues/%d/edit' % venue_id, data=dict(data, city='Oakland'))
+        self.assertEqual(fyyur.Task.query.count(), 2)
+        result = app.test_cli_runner().invoke(args=['worker', '--burst'])
+        self.assertIn('1 done', result.output)
+        self.assertEqual(Venue.query.one().geohash[:4], '9q9p')
+
+        self.clock.advance(days=8)
+        result = app.test_cli_runner().invoke(args=['purge-tasks', '--days', '7'])
+        self.assertIn('2 tasks purged', result.output)
+
+    def test_images_served_as_cached_thumbnails(self):
+        images = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, images)
+        with open(os.path.join(images, 'guns.png'), 'wb') as fp:
+            fp.write(png_image())
+        with open(os.path.join(images, 'notes.txt'), 'w') as fp:
+            fp.write('not an image')
+        fetcher = thumbnails.FileFetcher(images)
+        real_thumbnailer = fyyur.thumbnailer
+        fyyur.thumbnailer = thumbnails.Thumbnailer(fetcher, Cache(DiskBackend(os.path.join(images, 'cache')), 0),
+                                                   app.config['THUMBNAIL_SIZES'])
+        self.addCleanup(setattr, fyyur, 'thumbnailer', real_thumbnailer)
+
+        artist_id = self.add_artist('Guns N Petals')
+        Artist.query.get(artist_id).image_link = 'https://images.example/guns.png'
+        db.session.commit()
+        self.addCleanup(app.config.__setitem__, 'THUMBNAIL_SIGNING_KEY', app.config['THUMBNAIL_SIGNING_KEY'])
+        # Without a configured signing key, pages link to the images themselves
+        app.config['THUMBNAIL_SIGNING_KEY'] = None
+        self.assertIn('src="https://images.example/guns.png"', self.client.get('/artists').get_data(as_text=True))
+        app.config['THUMBNAIL_SIGNING_KEY'] = 'thumbnail-test-key'
+        url = re.search(r'src="(/thumbnails/small/[^"]+)"', self.client.get('/artists').get_data(as_text=True)).group(1)
+        with self.assertMaxQueries(0):
+            res = self.client.get(url)
+        self.assertEqual((res.status_code, res.mimetype, res.data), (200, 'image/png', png_image()))
+        self.assertEqual(res.headers['Cache-Control'], 'public, max-age=%d' % app.config['THUMBNAIL_MAX_AGE'])
+        self.assertEqual(self.client.get(url).data, png_image())
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': res.headers['ETag']}).status_code, 304)
+        self.assertEqual(fetcher.fetched, 1)
+
+        # Larger images are scaled down to fit each size
+        with open(os.path.join(images, 'stage.png'), 'wb') as fp:
+            fp.write(png_image(1000, 400))
+        for size, edge in app.config['THUMBNAIL_SIZES'].items():
+            with app.test_request_context():
+                res = self.client.get(fyyur.thumbnail_url('https://images.example/stage.png', size))
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(Image.open(io.BytesIO(res.data)).size, (edge, edge * 2 // 5))
+
+        self.assertEqual(self.client.get(url.replace('/small/', '/huge/')).status_code, 404)
+        self.assertEqual(self.client.get(url[:-2]).status_code, 404)
+        app.config['THUMBNAIL_SIGNING_KEY'] = 'another-key'
+        self.assertEqual(self.client.get(url).status_code, 404)
+        app.config['THUMBNAIL_SIGNING_KEY'] = 'thumbnail-test-key'
+
+        # Links that are no image fail for a while without being fetched again
+        with app.test_request_context():
+            broken = fyyur.thumbnail_url('https://images.example/notes.txt')
+        self.assertEqual(self.client.get(broken).status_code, 404)
+        self.assertEqual(self.client.get(broken).status_code, 404)
+        self.assertEqual(fetcher.fetched, 5)
+
+        # New links are checked in the background, which makes their thumbnails ahead of the pages
+        self.client.post('/venues/create', data={
+            'name': 'The Musical Hop', 'city': 'Nowhere', 'state': 'NV', 'genres': ['Jazz'],
+            'image_link': 'https://images.example/hop/../guns.png'})
+        self.client.post('/venues/create', data={
+            'name': 'Park Square Live Music & Coffee', 'city': 'Nowhere', 'state': 'NV', 'genres': ['Jazz'],
+            'image_link': 'https://images.example/notes.txt'})
+        with self.assertLogs(app.logger, 'WARNING'):
+            result = app.test_cli_runner().invoke(args=['worker', '--burst'])
+        self.assertIn('3 done, 1 queued', result.output)
+        self.assertEqual(fetcher.fetched, 7)
+        # Guns N Petals, then Park Square and The Musical Hop; only the artist's image is fetched
+        urls = re.findall(r'src="(/thumbnails/medium/[^"]+)"', self.client.get('/').get_data(as_text=True))
+        self.assertEqual([self.client.get(url).status_code for url in urls], [200, 404, 200])
+        self.assertEqual(fetcher.fetched, 8)
+
+    def test_image_links_to_private_addresses_refused(self):
+        class Images(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/guns.png':
+                    self.send_response(200)
+                    self.end_headers()
+                    self.wfile.write(png_image())
+                else:
+                    self.send_response(302)
+                    self.send_header('Location', self.path[len('/redirect'):])
+                    self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Images)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        local = 'http://127.0.0.1:%d' % server.server_port
+
+        fetcher = thumbnails.HTTPFetcher(timeout=5)
+        for link in (local + '/guns.png', 'http://localhost/', 'http://10.0.0.1/', 'http://169.254.169.254/latest/',
+                     'http://[::1]/', 'http://[::ffff:192.168.0.1]/', 'file:///etc/passwd'):
+            with self.assertRaises(thumbnails.ThumbnailError, msg=link):
+                fetcher(link)
+
+        # Allowed to fetch from this server, every redirect is checked again
+        class LocalFetcher(thumbnails.HTTPFetcher):
+            def allowed(self, address):
+                return str(address) == '127.0.0.1'
+
+        fetcher = LocalFetcher(timeout=5, max_redirects=2)
+        self.assertEqual(fetcher(local + '/redirect/guns.png'), png_image())
+        with self.assertRaisesRegex(thumbnails.ThumbnailError, 'not a public address'):
+            fetcher(local + '/redirecthttp://169.254.169.254/latest/')
+        with self.assertRaisesRegex(thumbnails.ThumbnailError, 'redirects'):
+            fetcher(local + '/redirect/redirect/redirect/guns.png')
+
+    def test_export_streams_rows(self):
+        venue_id = self.add_venue('The Musical Hop', genres=('Jazz',))
+        artist_id = self.add_artist('Guns N Petals')
+        for days in range(5):
+            self.add_show(artist_id, venue_id, days)
+        app.config['EXPORT_BATCH_SIZE'] = 2
+        self.addCleanup(app.config.__setitem__, 'EXPORT_BATCH_SIZE', 1000)
+
+        res = self.client.get('/export/shows.csv')
+        self.assertTrue(res.is_streamed)
+        lines = res.get_data(as_text=True).splitlines()
+        self.assertEqual(lines[0], 'id,start_date,start_time,artist_id,artist_name,venue_id,venue_name,venue_city,venue_state')
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[1].endswith(',20:00:00,%d,Guns N Petals,%d,The Musical Hop,San Francisco,CA'
+                                          % (artist_id, venue_id)))
+
+        res = self.client.get('/export/venues.ndjson')
+        record = json.loads(res.get_data(as_text=True))
+        self.assertEqual((record['name'], record['genres'], record['upcoming_shows_count']),
+                         ('The Musical Hop', ['Jazz'], 5))
+        self.assertEqual(self.client.get('/export/genres.csv').status_code, 404)
+
+    def test_pool_stats(self):
+        before = self.client.get('/pool/stats').get_json()
+        self.client.get('/venues')
+        # The test keeps one app context, so the request's session outlives it
+        db.session.remove()
+        stats = self.client.get('/pool/stats').get_json()
+
+        self.assertGreater(stats['checkouts'], before['checkouts'])
+        self.assertEqual(stats['in_use'], 0)
+
+    def test_engine_options_follow_settings(self):
+        config = dict(app.config, DB_POOL_SIZE=20, DB_PGBOUNCER=False, DB_STATEMENT_TIMEOUT_MS=5000)
+        options = engine_options(config, make_url('postgresql://fyyur@localhost/fyyur'))
+        self.assertIs(options['poolclass'], InstrumentedQueuePool)
+        self.assertEqual(options['pool_size'], 20)
+        self.assertEqual(options['connect_args'], {'options': '-c statement_timeout=5000'})
+
+        config['DB_PGBOUNCER'] = True
+        options = engine_options(config, make_url('postgresql://fyyur@localhost:6432/fyyur'))
+        self.assertIs(options['poolclass'], NullPool)
+        self.assertNotIn('connect_args', options)
+        self.assertEqual(engine_options(config, make_url('sqlite:///fyyur.db')), {})
+
+    def use_replica(self):
+        # A second SQLite file stands in for a replica that has not caught up yet
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+        saved = {key: app.config[key] for key in ('SQLALCHEMY_BINDS', 'REPLICA_BINDS', 'REPLICA_STICKY_SECONDS')}
+        self.addCleanup(app.config.update, saved)
+        app.config.update(SQLALCHEMY_BINDS={'replica0': 'sqlite:///' + path}, REPLICA_BINDS=['replica0'])
+        replica = db.get_engine(app, bind='replica0')
+        self.addCleanup(replica.dispose)
+        db.Model.metadata.create_all(bind=replica)
+        return replica
+
+    def test_reads_go_to_replica_until_the_user_writes(self):
+        self.use_replica()
+        venue_id = self.add_venue('The Musical Hop')
+
+        self.assertNotIn('The Musical Hop', self.client.get('/venues').get_data(as_text=True))
+        self.assertEqual(self.client.get('/api/v1/venues/%d' % venue_id).status_code, 404)
+        # Forms that edit a row read it from the primary
+        self.assertIn('The Musical Hop', self.client.get('/venues/%d/edit' % venue_id).get_data(as_text=True))
+        # Searches are read-only POSTs; they read from the replica and do not stick to the primary
+        body = self.client.post('/venues/search', data={'search_term': 'Hop'}).get_data(as_text=True)
+        self.assertNotIn('The Musical Hop', body)
+        self.assertNotIn('The Musical Hop', self.client.get('/venues').get_data(as_text=True))
+
+        self.client.post('/venues/create', data={'name': 'Park Square Live', 'city': 'New York', 'state': 'NY',
+                                                 'address': '34 Whiskey Moore Ave', 'genres': 'Folk'})
+        body = self.client.get('/venues').get_data(as_text=True)
+        self.assertIn('The Musical Hop', body)
+        self.assertIn('Park Square Live', body)
+
+        app.config['REPLICA_STICKY_SECONDS'] = 0
+        self.client.post('/venues/create', data={'name': 'The Dueling Pianos Bar', 'city': 'New York',
+                                                 'state': 'NY', 'address': '335 Delancey Street', 'genres': 'Jazz'})
+        self.assertNotIn('Park Square Live', self.client.get('/venues').get_data(as_text=True))
+        self.assertEqual(Venue.query.count(), 3)
+
+    def test_profiler_flags_repeated_queries(self):
+        for i in range(6):
+            self.add_venue('The Musical Hop %d' % i)
+        db.session.remove()
+
+        with profiler.capture() as profile:
+            # Lazy loading every venue's genres is one query per venue
+            names = [[genre.name for genre in venue.genres] for venue in Venue.query.all()]
+        self.assertEqual(len(names), 6)
+        self.assertEqual(profile.count, 7)
+        self.assertEqual(profile.duplicates(), 0)
+        [(count, shape)] = profile.repeated_shapes(5)
+        self.assertEqual(count, 6)
+        self.assertIn('FROM genres, venue_genres', shape)
+        self.assertEqual(profiler.shape("SELECT * FROM t WHERE a = 'x' AND b IN (?, ?, ?) LIMIT 10"),
+                         'SELECT * FROM t WHERE a = ? AND b IN (?...) LIMIT ?')
+
+    def test_profiler_logs_requests_and_enforces_budgets(self):
+        venue_id = self.add_venue('The Musical Hop')
+        saved = {key: app.config[key] for key in ('SQL_PROFILER', 'SQL_PROFILER_STRICT', 'SQL_QUERY_BUDGET')}
+        self.addCleanup(app.config.update, saved)
+        app.config.update(SQL_PROFILER=True, SQL_PROFILER_STRICT=True, SQL_QUERY_BUDGET=1)
+
+        with self.assertLogs(app.logger, 'INFO') as logs:
+            self.client.get('/venues')
+        self.assertIn('SQL GET /venues 200: 1 statements in', logs.output[0])
+
+        # The view's own budget of two takes precedence
+        self.assertEqual(self.client.get('/venues/%d' % venue_id).status_code, 200)
+        with self.assertRaises(profiler.QueryBudgetExceeded):
+            self.client.get('/api/v1/venues?fields=name,genres')
+
+        # A budget of 0 allows no statements at all
+        view = app.view_functions['venues']
+        self.addCleanup(setattr, view, 'query_budget', view.query_budget)
+        view.query_budget = 0
+        with self.assertRaises(profiler.QueryBudgetExceeded):
+            self.client.get('/venues')
+
+    def test_metrics_split_request_time(self):
+        venue_id = self.add_venue('The Musical Hop')
+        metrics.clear()
+        self.client.get('/venues/%d' % venue_id)
+        self.client.get('/venues/%d' % venue_id)
+
+        text = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('fyyur_request_duration_seconds_count{route="/venues/<int:venue_id>",method="GET",'
+                      'status="200"} 2', text)
+        for phase in ('db', 'template', 'view'):
+            self.assertIn('fyyur_request_phase_seconds_count{route="/venues/<int:venue_id>",phase="%s"} 2'
+                          % phase, text)
+        self.assertIn('fyyur_request_sql_statements_bucket{route="/venues/<int:venue_id>",le="+Inf"} 2', text)
+
+        self.addCleanup(app.config.__setitem__, 'SLOW_REQUEST_MS', app.config['SLOW_REQUEST_MS'])
+        app.config['SLOW_REQUEST_MS'] = 0.001
+        fragments.clear()
+        with self.assertLogs(app.logger, 'WARNING') as logs:
+            self.client.get('/venues/%d?page=2' % venue_id)
+        self.assertIn('Slow request GET /venues/<int:venue_id> 200', logs.output[0])
+        self.assertIn("view args: {'venue_id': %d}" % venue_id, logs.output[0])
+        self.assertIn('query: page=2', logs.output[0])
+        self.assertIn(' x SELECT', logs.output[0])
+
+    def test_log_pipeline_writes_json_and_drops_when_full(self):
+        path = self.write_file('.log', '')
+        config = dict(app.config, LOG_FILE=path, LOG_FORMAT='json', LOG_ROTATE_WHEN='')
+        pipeline = logs.LogPipeline(logs.file_handler(config), queue_size=2, sample_rate=0.0)
+        logger = logging.getLogger('fyyur.test_logs')
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(pipeline.queue_handler)
+        self.addCleanup(logger.removeHandler, pipeline.queue_handler)
+
+        # Until the listener runs nothing is taken off the queue, and info records are sampled out
+        logger.info('sampled out')
+        logger.warning('first %s', 'warning')
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            logger.exception('failed')
+        logger.error('dropped')
+        self.assertEqual(pipeline.stats(), {'queued': 2, 'dropped': {'ERROR': 1}, 'sampled_out': 1,
+                                            'pending': 2})
+
+        pipeline.start()
+        pipeline.stop()
+        with open(path) as log:
+            records = [json.loads(line) for line in log]
+        self.assertEqual([(r['level'], r['message']) for r in records],
+                         [('WARNING', 'first warning'), ('ERROR', 'failed')])
+        self.assertIn('ValueError: boom', records[1]['exception'])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
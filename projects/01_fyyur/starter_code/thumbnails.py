@@ -0,0 +1,201 @@
+# ----------------------------------------------------------------------------#
+# Image thumbnails.
+#
+# Pages show venue and artist images through the app instead of hot-linking
+# the image_link URLs: Thumbnailer fetches an image once, scales it down to
+# each standard size and keeps the results in a cache, normally a
+# caching.DiskBackend. Fetchers are pluggable through the THUMBNAIL_FETCHER
+# setting, 'http' or an import path, so tests and scripts can read local
+# files.
+#
+# Image links are user input, so HTTPFetcher only connects to public
+# addresses: it resolves the host itself, refuses loopback, private,
+# link-local and other non-global addresses, connects to the address it
+# checked, and follows redirects one at a time under the same checks.
+# ----------------------------------------------------------------------------#
+
+import http.client
+import io
+import ipaddress
+import os
+import socket
+from urllib.parse import urljoin, urlparse
+
+from PIL import Image
+from werkzeug.utils import import_string
+
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+
+class ThumbnailError(Exception):
+    """The image could not be fetched or is not an image."""
+
+
+def sniff(data):
+    """MIME type of a JPEG, PNG, GIF or WebP image, None for anything else."""
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, mimetype in SIGNATURES:
+        if data.startswith(signature):
+            return mimetype
+    return None
+
+
+class _PinnedHTTPConnection(http.client.HTTPConnection):
+    # Connects to an address resolved and checked beforehand, not to whatever the host resolves to now
+
+    def __init__(self, host, address, **kwargs):
+        super(_PinnedHTTPConnection, self).__init__(host, **kwargs)
+        self.address = address
+
+    def connect(self):
+        self.sock = socket.create_connection((self.address, self.port), self.timeout)
+
+
+class _PinnedHTTPSConnection(http.client.HTTPSConnection):
+
+    def __init__(self, host, address, **kwargs):
+        super(_PinnedHTTPSConnection, self).__init__(host, **kwargs)
+        self.address = address
+
+    def connect(self):
+        sock = socket.create_connection((self.address, self.port), self.timeout)
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+class HTTPFetcher(object):
+    """Fetches http(s) URLs on public addresses, refusing bodies over `max_bytes`."""
+
+    REDIRECTS = (301, 302, 303, 307, 308)
+
+    def __init__(self, timeout=5, max_bytes=10 * 1024 * 1024, max_redirects=3, user_agent='Fyyur thumbnailer'):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.max_redirects = max_redirects
+        self.user_agent = user_agent
+
+    def allowed(self, address):
+        """Whether connecting to the ipaddress `address` is allowed: only global unicast addresses are."""
+        address = getattr(address, 'ipv4_mapped', None) or address
+        return address.is_global and not address.is_multicast
+
+    def resolve(self, host, port):
+        """An address of `host` to connect to; refuses hosts with any address that is not allowed."""
+        try:
+            found = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except (OSError, UnicodeError) as error:
+            raise ThumbnailError('Cannot resolve %s: %s' % (host, error))
+        addresses = [ipaddress.ip_address(info[4][0]) for info in found]
+        for address in addresses:
+            if not self.allowed(address):
+                raise ThumbnailError('%s resolves to %s, which is not a public address' % (host, address))
+        return str(addresses[0])
+
+    def __call__(self, url):
+        for _ in range(self.max_redirects + 1):
+            parts = urlparse(url)
+            if parts.scheme not in ('http', 'https') or not parts.hostname:
+                raise ThumbnailError('Not an http(s) URL: %s' % url)
+            try:
+                port = parts.port or (443 if parts.scheme == 'https' else 80)
+            except ValueError:
+                raise ThumbnailError('Bad port in %s' % url)
+            address = self.resolve(parts.hostname, port)
+            connection_class = _PinnedHTTPSConnection if parts.scheme == 'https' else _PinnedHTTPConnection
+            connection = connection_class(parts.hostname, address, port=port, timeout=self.timeout)
+            try:
+                connection.request('GET', (parts.path or '/') + ('?' + parts.query if parts.query else ''),
+                                   headers={'User-Agent': self.user_agent, 'Accept': 'image/*'})
+                response = connection.getresponse()
+                if response.status in self.REDIRECTS and response.getheader('Location'):
+                    url = urljoin(url, response.getheader('Location'))
+                    continue
+                if response.status != 200:
+                    raise ThumbnailError('%s answered %d' % (url, response.status))
+                data = response.read(self.max_bytes + 1)
+            except (OSError, http.client.HTTPException) as error:
+                raise ThumbnailError('Cannot fetch %s: %s' % (url, error))
+            finally:
+                connection.close()
+            if len(data) > self.max_bytes:
+                raise ThumbnailError('%s is larger than %d bytes' % (url, self.max_bytes))
+            return data
+        raise ThumbnailError('More than %d redirects from %s' % (self.max_redirects, url))
+
+
+class FileFetcher(object):
+    """Reads the path of any URL from under `root`, for tests and local copies of images."""
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self.fetched = 0
+
+    def __call__(self, url):
+        path = os.path.realpath(os.path.join(self.root, urlparse(url).path.lstrip('/')))
+        if not path.startswith(self.root + os.sep):
+            raise ThumbnailError('Outside of %s: %s' % (self.root, url))
+        self.fetched += 1
+        try:
+            with open(path, 'rb') as fp:
+                return fp.read()
+        except OSError as error:
+            raise ThumbnailError('Cannot read %s: %s' % (url, error))
+
+
+def create_fetcher(config):
+    """Builds the fetcher described by the THUMBNAIL_FETCHER settings."""
+    fetcher = config['THUMBNAIL_FETCHER']
+    if fetcher == 'http':
+        return HTTPFetcher(config['THUMBNAIL_FETCH_TIMEOUT'], config['THUMBNAIL_MAX_SOURCE_BYTES'])
+    return import_string(fetcher)(**config.get('THUMBNAIL_FETCHER_OPTIONS', {}))
+
+
+def scale(data, edge):
+    """The image in `data` scaled to fit in an `edge` pixel square, as it is when it already does."""
+    if sniff(data) is None:
+        raise ThumbnailError('Not a JPEG, PNG, GIF or WebP image')
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if max(image.size) <= edge:
+                # Decoded all the same, so broken images are refused
+                image.load()
+                return data
+            # JPEGs are decoded straight at a fraction of their size where possible
+            image.draft('RGB', (edge, edge))
+            image.thumbnail((edge, edge))
+            output = io.BytesIO()
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image.save(output, 'PNG', optimize=True)
+            else:
+                image.convert('RGB').save(output, 'JPEG', quality=85, optimize=True)
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        raise ThumbnailError('Cannot read the image: %s' % error)
+    return output.getvalue()
+
+
+class Thumbnailer(object):
+    """Thumbnails of image URLs at the named `sizes`, the longest edge in pixels of each."""
+
+    def __init__(self, fetcher, cache, sizes):
+        self.fetcher = fetcher
+        self.cache = cache
+        self.sizes = sizes
+
+    def key(self, url, size):
+        return 'thumbnail:%s:%s' % (size, url)
+
+    def get(self, url, size):
+        """Bytes of the `size` thumbnail of `url`, fetched on a miss by one thread at a time."""
+        return self.cache.get_or_set(self.key(url, size), lambda: scale(self.fetcher(url), self.sizes[size]),
+                                     single_flight=True)
+
+    def check(self, url):
+        """Fetches `url` once and caches every size of it; raises ThumbnailError when it is no image."""
+        data = self.fetcher(url)
+        for size, edge in self.sizes.items():
+            self.cache.set(self.key(url, size), scale(data, edge))